@@ -4,12 +4,19 @@ import modules.llm
 import modules.datamanager
 import modules.tickers
 import modules.errors
+import modules.columnar
+import modules.ratelimit
+import modules.cache
+import modules.pipeline
+import modules.sentiment
 
 from statistics import mean, StatisticsError
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from datetime import datetime, date
 import time
 import pytz
+import asyncio
 
 import json
 
@@ -23,31 +30,66 @@ set_date = date.today()
 # Set up logger
 logger = modules.logger.logger('download.py', 'download-'+str(set_date))
 
-# Initialize ollama
-llm = modules.llm.LlamaChat()
+# Initialize ollama, reusing sentiments from previous runs
+sentiment_cache = modules.cache.SentimentCache(max_entries=config['SENTIMENT_CACHE_MAX_ENTRIES'])
+llm = modules.llm.LlamaChat(
+	sentiment_cache=sentiment_cache,
+	structured=config['LLM_STRUCTURED_OUTPUT'],
+	num_predict=config['LLM_NUM_PREDICT'],
+	keep_alive=config['LLM_KEEP_ALIVE']
+)
+
+# Score articles with a local classifier first, only sending them to ollama when it is unsure
+if config['SENTIMENT_CASCADE']:
+	llm = modules.sentiment.SentimentCascade(
+		llm,
+		modules.sentiment.LexiconClassifier(evidence=config['CASCADE_EVIDENCE']),
+		min_confidence=config['CASCADE_MIN_CONFIDENCE']
+	)
 
 # Initialize database manager
-dmanager = modules.datamanager.DataManager()
-
-# Create a YahooStockClient
-yahoo_client = modules.internet.YahooStockClient()
-
-def download(ticker: str):
-	'''
-	Collects data on the specified ticker, analyzes it, and saves it as a pandas dataframe
+dmanager = modules.datamanager.DataManager(config['DATA_BACKEND'], compact=config['COMPACT_STOCKDATA'])
+
+# Create a YahooStockClient, sharing one rate limiter between every thread that uses it
+yahoo_client = modules.internet.YahooStockClient(
+	modules.ratelimit.TokenBucket(config['YAHOO_REQUESTS_PER_SECOND'], config['YAHOO_REQUEST_BURST']),
+	article_cache=modules.cache.ArticleCache(
+		ttl=config['ARTICLE_CACHE_TTL_HOURS'] * 3600,
+		max_bytes=config['ARTICLE_CACHE_MAX_MB'] * 1_000_000
+	),
+	max_article_characters=config['ARTICLE_MAX_CHARACTERS'],
+	company_names=modules.tickers.COMPANY_NAMES
+)
+
+def quotes(tickers: list):
 	'''
+	Pulls the market data for every ticker in as few requests as possible
 
-	# Check to se if data exists for that day
-	if dmanager.data_exists(set_date, ticker):
-		return True
-
-	# Get the daily market data
+	Returns a dict mapping each ticker that could be pulled to its market data (a one row DataFrame)
+	'''
 	try:
-		current_data = yahoo_client.current(ticker, set_date)
+		current_data, failures = yahoo_client.current_batch(
+			tickers,
+			set_date,
+			chunk_size=config['QUOTE_CHUNK_SIZE'],
+			workers=config['DOWNLOAD_WORKERS']
+		)
 
 	except modules.errors.error as e:
 		logger.error(e)
-		return False
+		return {}
+
+	for e in failures.values():
+		logger.error(e)
+
+	return {ticker: current_data[current_data['ticker'] == ticker].reset_index(drop=True) for ticker in current_data['ticker']}
+
+def fetch(ticker: str, current_data):
+	'''
+	Pulls the news articles for a ticker, `current_data` is its market data from `quotes`
+
+	Returns a tuple of `(current_data, scraped_sites)`
+	'''
 
 	# Collect news information
 	try:
@@ -58,6 +100,31 @@ def download(ticker: str):
 		logger.error(e)
 		scraped_sites = []
 
+	return current_data, scraped_sites
+
+def average_sentiment(ticker: str, sentiments: list):
+	'''
+	Returns the average of a ticker's sentiments, or "None" if there are none
+	'''
+	try:
+		# Average sentiments
+		return mean(sentiments)
+
+	except StatisticsError:
+		logger.warning(f'Could not calculate average sentiment for {ticker}')
+		
+		# If there was no sentiment values in the list, just default to 5
+		return None
+
+def collect(ticker: str, current_data):
+	'''
+	Collects news on the specified ticker and analyzes it, returning the ticker's row as a pandas dataframe.
+	`current_data` is the ticker's market data from `quotes`
+
+	Does not touch `dmanager`, so it is safe to run from multiple threads at once
+	'''
+	current_data, scraped_sites = fetch(ticker, current_data)
+
 	# Create list to store sentiments
 	sentiments = []
 
@@ -80,22 +147,20 @@ def download(ticker: str):
 		if type(sentiment) == int: # Sentiment obtained correctly
 			sentiments.append(sentiment)
 
-	try:
-		# Average sentiments
-		avg_sentiment = mean(sentiments)
+	# Update sentiment to caluclated sentiment
+	current_data['sentiment'] = average_sentiment(ticker, sentiments)
 
-	except StatisticsError:
-		logger.warning(f'Could not calculate average sentiment for {ticker}')
-		
-		# If there was no sentiment values in the list, just default to 5
-		avg_sentiment = None
+	return current_data
 
-	# Update sentiment to caluclated sentiment
-	current_data['sentiment'] = avg_sentiment
-	
+def store(data):
+	'''
+	Adds a ticker's collected data to `dmanager` and saves it, returns "True" if it was stored
+
+	Only ever call this from one thread at a time
+	'''
 	# Add stockdata to database, and news data to dataframe
 	try:
-		dmanager.add_data(current_data)
+		dmanager.add_data(data)
 
 	except modules.errors.error as e:
 		logger.error(e)
@@ -105,6 +170,151 @@ def download(ticker: str):
 	dmanager.save()
 	return True
 
+def download(ticker: str, current_data = None):
+	'''
+	Collects data on the specified ticker, analyzes it, and saves it as a pandas dataframe
+
+	`current_data` is the ticker's market data from `quotes`, it is pulled if it is not passed
+	'''
+
+	# Check to se if data exists for that day
+	if dmanager.data_exists(set_date, ticker):
+		return True
+
+	if current_data is None:
+		current_data = quotes([ticker]).get(ticker)
+
+		if current_data is None:
+			return False
+
+	return store(collect(ticker, current_data))
+
+def download_concurrent(tickers: list, workers: int):
+	'''
+	Collects data for every ticker using a pool of `workers` threads
+
+	The main thread is the only writer: it stores each ticker's data as soon as it is collected.
+	Tickers that fail are retried (all together) every 30 minutes
+	'''
+	total = len(tickers)
+
+	# Tickers that already have data for the day count as completed
+	pending = [ticker for ticker in tickers if not dmanager.data_exists(set_date, ticker)]
+	completed = total - len(pending)
+
+	while len(pending) != 0:
+		# Pull the market data for every ticker together
+		current = quotes(pending)
+		failed = [ticker for ticker in pending if ticker not in current]
+
+		for ticker in failed:
+			logger.warning(f'{ticker.upper()} - FAIL')
+
+		executor = ThreadPoolExecutor(max_workers=workers)
+
+		try:
+			futures = {executor.submit(collect, ticker, current[ticker]): ticker for ticker in current}
+
+			for future in as_completed(futures):
+				ticker = futures[future]
+
+				if store(future.result()):
+					completed += 1
+					logger.warning(f'{ticker.upper()} - SUCCESS ({completed}/{total})')
+
+				else:
+					logger.warning(f'{ticker.upper()} - FAIL')
+					failed.append(ticker)
+
+		finally:
+			# If we are interrupted, do not start collecting any more tickers
+			executor.shutdown(cancel_futures=True)
+
+		pending = failed
+
+		# Sleep for 30 minutes and try again
+		if len(pending) != 0:
+			time.sleep(1800)
+
+def score_article(sites: list):
+	'''
+	Scores one article for every ticker in `sites` (one `NewsWebPage` per ticker) with a single LLM request,
+	returns a dict mapping each ticker to its sentiment
+	'''
+	try:
+		return llm.news_prompt_multi(sites)
+
+	except modules.errors.error as e:
+
+		# ValueError just means that there was no sentiment for the stocks, so no need to log an error
+		if not isinstance(e.error, ValueError):
+			logger.error(e)
+
+		return {}
+
+def download_grouped(tickers: list, workers: int):
+	'''
+	Collects data for every ticker, scoring each article once for all of the tickers it was found for
+
+	Market data and news are pulled for every ticker first (using `workers` threads), then articles are
+	grouped by URL and each group is scored with one LLM request. Tickers that fail are retried
+	(all together) every 30 minutes
+	'''
+	total = len(tickers)
+
+	# Tickers that already have data for the day count as completed
+	pending = [ticker for ticker in tickers if not dmanager.data_exists(set_date, ticker)]
+	completed = total - len(pending)
+
+	while len(pending) != 0:
+		failed = []
+
+		# Pull the market data for every ticker together, tickers that could not be pulled are "None"
+		current = quotes(pending)
+
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+			fetched = dict(zip(current, executor.map(fetch, current, current.values())))
+
+		fetched.update({ticker: None for ticker in pending if ticker not in current})
+
+		# Group the articles found for every ticker by URL
+		articles = {}
+		for ticker, result in fetched.items():
+			if result is None:
+				continue
+
+			for site in result[1]:
+				articles.setdefault(site.url or site.title, []).append(site)
+
+		# Score each article once, then split the sentiments back out to each ticker
+		sentiments = {ticker: [] for ticker in fetched}
+
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+			for scores in executor.map(score_article, articles.values()):
+				for ticker, sentiment in scores.items():
+					if type(sentiment) == int: # Sentiment obtained correctly
+						sentiments[ticker].append(sentiment)
+
+		# Store every ticker's data from this (single) thread
+		for ticker, result in fetched.items():
+			if result is not None:
+				current_data = result[0]
+				current_data['sentiment'] = average_sentiment(ticker, sentiments[ticker])
+
+			if result is not None and store(current_data):
+				completed += 1
+				logger.warning(f'{ticker.upper()} - SUCCESS ({completed}/{total})')
+
+			else:
+				logger.warning(f'{ticker.upper()} - FAIL')
+				failed.append(ticker)
+
+		pending = failed
+
+		# Sleep for 30 minutes and try again
+		if len(pending) != 0:
+			time.sleep(1800)
+
 
 # If the market was not open today, do not run
 # Also, if there was a previous attempt, check if it is too early to attempt again
@@ -122,30 +332,88 @@ if set_date != config['LAST_PROTOCALL_UPDATE'] and modules.internet.market_open(
 	
 	completed = 0 # Use for logging how many companies completed
 
+	# Score articles that were found for several tickers only once
+	if config['GROUP_SHARED_ARTICLES']:
+		try:
+			download_grouped(modules.tickers.TICKERS, config['DOWNLOAD_WORKERS'])
+		except KeyboardInterrupt:
+			logger.warning('KeyboardInterrupt')
+			exit()
+
+	# Fetch, score and store tickers as overlapping stages
+	elif config['DOWNLOAD_PIPELINE']:
+		pipeline = modules.pipeline.DownloadPipeline(
+			yahoo_client,
+			llm,
+			store,
+			logger,
+			set_date,
+			fetchers=config['DOWNLOAD_WORKERS'],
+			scorers=config['PIPELINE_SCORERS'],
+			queue_size=config['PIPELINE_QUEUE_SIZE'],
+			quote_chunk=config['QUOTE_CHUNK_SIZE']
+		)
+
+		# Tickers that already have data for the day count as completed
+		pending = [ticker for ticker in modules.tickers.TICKERS if not dmanager.data_exists(set_date, ticker)]
+
+		try:
+			asyncio.run(pipeline.run(pending, completed=len(modules.tickers.TICKERS) - len(pending)))
+		except KeyboardInterrupt:
+			logger.warning('KeyboardInterrupt')
+			exit()
+
+	# Collect data for multiple tickers at once
+	elif config['DOWNLOAD_WORKERS'] > 1:
+		try:
+			download_concurrent(modules.tickers.TICKERS, config['DOWNLOAD_WORKERS'])
+		except KeyboardInterrupt:
+			logger.warning('KeyboardInterrupt')
+			exit()
+
 	# Iterate through every ticker
-	for ticker in modules.tickers.TICKERS:
+	else:
+		# Pull the market data for every ticker together, tickers that fail are pulled again by `download`
+		current = quotes([ticker for ticker in modules.tickers.TICKERS if not dmanager.data_exists(set_date, ticker)])
 
-		# Collect data for specific ticker
-		while True:
-			try:
-				protocol_complete = download(ticker)
+		for ticker in modules.tickers.TICKERS:
 
-				if protocol_complete:
-					completed += 1
-					logger.warning(f'{ticker.upper()} - SUCCESS ({completed}/{len(modules.tickers.TICKERS)})')
-					break
+			# Collect data for specific ticker
+			while True:
+				try:
+					protocol_complete = download(ticker, current.pop(ticker, None))
 
-				else:
-					logger.warning(f'{ticker.upper()} - FAIL')
+					if protocol_complete:
+						completed += 1
+						logger.warning(f'{ticker.upper()} - SUCCESS ({completed}/{len(modules.tickers.TICKERS)})')
+						break
+
+					else:
+						logger.warning(f'{ticker.upper()} - FAIL')
 
-					# Sleep for 30 minutes and try again
-					time.sleep(1800)
-			except KeyboardInterrupt:
-				logger.warning('KeyboardInterrupt')
-				exit()
+						# Sleep for 30 minutes and try again
+						time.sleep(1800)
+				except KeyboardInterrupt:
+					logger.warning('KeyboardInterrupt')
+					exit()
 
 	# Log when data collection ends
 	logger.debug('DATA COLLECTED')
+	logger.debug(f'SENTIMENT CACHE: {sentiment_cache.hits} HITS / {sentiment_cache.misses} MISSES')
+
+	# Log what fraction of articles each tier of the cascade scored
+	if config['SENTIMENT_CASCADE']:
+		logger.debug(f'SENTIMENT CASCADE: {", ".join(f"{tier} {share:.0%}" for tier, share in llm.report().items())}')
+
+	# Update the columnar copy of our data used for training (starting from its last partition, 
+	# so any history that is missing from it gets filled in)
+	if config['TRAINING_BACKEND'] in ['parquet', 'feather']:
+		try:
+			columnar_store = modules.columnar.ColumnarStore(format=config['TRAINING_BACKEND'])
+			columnar_store.write(dmanager.to_dataframe(start=columnar_store.last_date()))
+
+		except modules.errors.error as e:
+			logger.error(e)
 
 	# Save last update time in config, but only if "save_data" is set to "True"
 	with open('config.json', 'w') as f:
@@ -0,0 +1,73 @@
+'''
+Exports `StockNet` to a TorchScript artifact (optionally with int8 quantized weights) used by `modules.inference.Predictor`
+
+Before the artifact is saved its predictions are compared against the float model, and the latency of both is printed
+'''
+import modules.datamanager
+import modules.inference
+
+import os
+import json
+import torch
+from datetime import date, timedelta
+
+# Load config
+with open('config.json') as f:
+	config = json.load(f)
+
+path = config['INFERENCE_ARTIFACT']
+window_size = config['LSTM_WINDOW_SIZE']
+
+model = modules.inference.load_model()
+model.eval()
+
+# Compare on the latest window of every ticker, or on random (already scaled looking) windows if there is no stock data
+try:
+	stock_data_manager = modules.datamanager.StockDataManager(config['TRAINING_BACKEND'], compact=config['COMPACT_STOCKDATA'])
+	stock_data_manager.start = date.fromisoformat(stock_data_manager.last_date()) - timedelta(days=2 * window_size + 7)
+
+	_, _, windows = modules.inference.Predictor(window_size, artifact_path=None).windows(
+		stock_data_manager.stockdata,
+		stock_data_manager.carried()
+	)
+	windows = torch.from_numpy(windows)
+
+except Exception as e:
+	print(f'Could not load stock data ({type(e).__name__}), comparing on random windows')
+	windows = torch.randn(512, window_size, model.lstm.input_size)
+
+# Export to a temporary path first, so a failed check never replaces a working artifact
+candidate_path = f'{path}.candidate'
+exported = modules.inference.export_model(model, candidate_path, window_size, quantize=config['EXPORT_QUANTIZE'])
+
+parity = modules.inference.compare_models(model, exported, windows)
+tolerance = config['EXPORT_TOLERANCE'] * parity['scale']
+
+print(
+	f'Parity: max difference {parity["max_difference"]:.2e}, mean difference {parity["mean_difference"]:.2e} '
+	f'over {len(windows)} windows (allowed {tolerance:.2e}, {config["EXPORT_TOLERANCE"]:.0%} of the prediction spread)'
+)
+
+# Latency for one ticker, and for every ticker at once
+for name, batch in [('1 window', windows[:1]), (f'{len(windows)} windows', windows)]:
+	eager = modules.inference.measure_latency(model, batch)
+	scripted = modules.inference.measure_latency(exported, batch)
+
+	print(f'Latency ({name}): eager {eager:.3f}ms, exported {scripted:.3f}ms ({eager / scripted:.1f}x)')
+
+# Only keep a quantized model if it is actually faster at scoring every ticker (the last latency measured)
+problem = None
+
+if parity['max_difference'] > tolerance:
+	problem = f'Exported model differs from StockNet by more than {tolerance:.2e}'
+
+elif config['EXPORT_QUANTIZE'] and scripted >= eager:
+	problem = 'Quantized model is not faster than StockNet'
+
+if problem is not None:
+	print(f'{problem}, not saving it')
+	os.remove(candidate_path)
+	exit(1)
+
+os.replace(candidate_path, path)
+print(f'Saved {"quantized " if config["EXPORT_QUANTIZE"] else ""}TorchScript model to {path}')
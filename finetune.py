@@ -0,0 +1,141 @@
+'''
+Fine-tunes `StockNet` on the stock data collected since it was last trained (run after `download.py`)
+
+Starts from the saved model and optimizer, trains a few epochs on the new windows mixed with a bounded
+sample of older ones, and only loads the stock data from shortly before the last trained date, so the cost
+depends on how much new data there is instead of on the whole history
+'''
+import modules.ml
+import modules.datamanager
+import modules.training
+import modules.errors
+
+import pickle
+import torch
+import json
+import time
+from datetime import date, timedelta
+from tqdm import tqdm
+
+# Load config
+with open('config.json') as f:
+	config = json.load(f)
+
+since = config['LAST_TRAINED_DATE']
+
+if since is None:
+	print('StockNet has not been trained yet, run train.py first')
+	exit(1)
+
+# Select appropriate backend device
+device = (
+    'cuda' if torch.cuda.is_available()
+    else 'mps' if torch.backends.mps.is_available()
+    else 'cpu'
+)
+
+print(f'BACKEND: {device}')
+
+# Set how many CPU threads torch uses (before any parallel work is done)
+modules.training.configure_threads(config['NUM_THREADS'], config['INTEROP_THREADS'])
+
+# Load the model, optimizer and scaler from the last training run
+try:
+	model = modules.ml.StockNet().to(device)
+	model.load_state_dict(torch.load('StockNet/model',weights_only=True))
+
+	optimizer = torch.optim.AdamW(model.parameters(), lr=config['FINETUNE_LEARNING_RATE'])
+	optimizer.load_state_dict(torch.load('StockNet/optimizer',weights_only=True))
+
+	with open('StockNet/scaler', 'rb') as f:
+		scaler = pickle.load(f)
+
+except FileNotFoundError:
+	print('No StockNet model avaliable to fine-tune, run train.py first')
+	exit(1)
+
+# Fine-tune with a smaller learning rate than the original training
+for group in optimizer.param_groups:
+	group['lr'] = config['FINETUNE_LEARNING_RATE']
+
+# Initialize our loss function
+loss_func = torch.nn.HuberLoss()
+
+# Only load the stock data needed for new windows and the replay sample (calendar days, so leave room for weekends/holidays)
+# Values missing at the start of it are filled from the last values known before it (see `StockDataManager.carried`)
+start = date.fromisoformat(since) - timedelta(days=config['REPLAY_DAYS'] + 2 * config['LSTM_WINDOW_SIZE'] + 7)
+
+stock_data_manager = modules.datamanager.StockDataManager(config['TRAINING_BACKEND'], start=start, compact=config['COMPACT_STOCKDATA'])
+last_date = stock_data_manager.last_date()
+
+try:
+	dataloader, validation_dataloader, new, replayed = stock_data_manager.incremental_split(
+		config['LSTM_WINDOW_SIZE'],
+		config['BATCH_SIZE'],
+		since,
+		scaler,
+		replay_windows=config['REPLAY_WINDOWS']
+	)
+
+# No company has enough days of stock data since `start` for a window
+except modules.errors.error as e:
+	print(f'No windows to fine-tune on since {since} ({e.message})')
+	exit(0)
+
+if new == 0:
+	print(f'No new stock data since {since}, nothing to fine-tune')
+	exit(0)
+
+print(f'Fine-tuning on {new} new windows and {replayed} replayed windows (since {since})')
+
+# Loss of the current model on the held-out windows, the fine-tuned model has to do at least as well to be saved
+starting_loss = modules.training.evaluate(model, validation_dataloader, loss_func, device)
+
+# Main logic to fine-tune the neural network
+model.train()
+
+for epoch in tqdm(range(config['FINETUNE_EPOCHS']), desc='Fine-tuning Progress', unit='Epochs'):
+	epoch_start = time.perf_counter()
+	tloss = 0
+	total = 0
+
+	for inputs, moves in iter(dataloader):
+
+		# Assign only the current batch to our device to save on memory
+		inputs, moves = inputs.to(device), moves.to(device)
+
+		# Zero your gradients for every batch!
+		optimizer.zero_grad()
+
+		# Compute the loss and its gradients
+		loss = loss_func(model(inputs), moves)
+		loss.backward()
+
+		# Adjust learning weights
+		optimizer.step()
+
+		tloss += loss.item() * len(inputs)
+		total += len(inputs)
+
+	tqdm.write(f'EPOCH {epoch} * {total / (time.perf_counter() - epoch_start):.0f} samples/sec * Avg. Loss: {tloss / total:.4f}')
+
+finetuned_loss = modules.training.evaluate(model, validation_dataloader, loss_func, device)
+
+print(f'Validation loss: {starting_loss:.4f} before, {finetuned_loss:.4f} after fine-tuning')
+
+# Keep the current model if fine-tuning made it worse (or there were too few windows to tell), the new
+# windows will be used again next time
+if not finetuned_loss <= starting_loss:
+	print('Fine-tuned model is not better on the held-out windows, keeping the current model')
+	exit(0)
+
+# Save the fine-tuned model and optimizer
+checkpointer = modules.training.AsyncCheckpointer()
+checkpointer.save({'StockNet/model': model.state_dict(), 'StockNet/optimizer': optimizer.state_dict()})
+checkpointer.close()
+
+# Remember how far the model has been trained
+config['LAST_TRAINED_DATE'] = last_date
+
+with open('config.json','w') as f:
+	json.dump(config, f, indent = 4)
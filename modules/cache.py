@@ -0,0 +1,320 @@
+'''
+# cache
+
+Persistent caches (stored in SQLite) that let `download.py` skip work it has
+already done on previous runs
+'''
+import sqlite3
+import threading
+import hashlib
+import time
+from contextlib import contextmanager
+
+from . import errors
+
+def _hash(*parts: str):
+	'''
+	Returns the SHA-256 hex digest of `parts`
+	'''
+	digest = hashlib.sha256()
+
+	for part in parts:
+		digest.update(str(part).encode('utf-8'))
+
+		# Separate parts so ("ab", "c") and ("a", "bc") hash differently
+		digest.update(b'\0')
+
+	return digest.hexdigest()
+
+class _SQLiteCache:
+	'''
+	# _SQLiteCache
+
+	Base class for the caches in this module. Owns the SQLite connection (shared between threads)
+	and counts cache hits/misses
+	'''
+	def __init__(self, path: str, schema: str):
+		self.path = path
+
+		self.hits = 0
+		self.misses = 0
+
+		# Every query holds this lock, so the connection can be shared between threads
+		self.lock = threading.Lock()
+
+		try:
+			self.connection = sqlite3.connect(path, check_same_thread=False)
+			self.connection.execute('PRAGMA journal_mode=WAL')
+			self.connection.execute('PRAGMA synchronous=NORMAL')
+
+			self.connection.executescript(schema)
+
+		except sqlite3.Error as e:
+			raise errors.error('cache.py', f'Could not open cache at {path}', e)
+
+	def _count(self, hit: bool):
+		'''
+		Records a cache hit or miss (must be called while holding `lock`)
+		'''
+		if hit:
+			self.hits += 1
+		else:
+			self.misses += 1
+
+	def hit_rate(self):
+		'''
+		Returns the fraction of lookups that were cache hits, or "None" if there were no lookups
+		'''
+		total = self.hits + self.misses
+
+		return self.hits / total if total != 0 else None
+
+	def close(self):
+		'''
+		Closes the cache's database connection
+		'''
+		self.connection.close()
+
+class CachedArticle:
+	'''
+	# CachedArticle
+
+	An article's extracted text, plus the validators needed to check if it changed
+	'''
+	def __init__(self, content: str, etag: str, last_modified: str, fresh: bool):
+		self.content = content # Text extracted from the article
+
+		self.etag = etag # "ETag" header from the last download
+
+		self.last_modified = last_modified # "Last-Modified" header from the last download
+
+		self.fresh = fresh # "True" if the article can be used without asking the website if it changed
+
+class ArticleCache(_SQLiteCache):
+	'''
+	# ArticleCache
+
+	Stores the extracted text of news articles keyed by a hash of their URL, so an article that
+	shows up for several tickers (or on several days) is only downloaded and parsed once
+
+	:param path: Where the cache is stored, defaults to "stockdata/articles.db"
+	:type path: str
+	:param ttl: Seconds an article is used without checking if it changed, defaults to 1 day
+	:type ttl: float
+	:param max_bytes: Once the stored text is larger than this, the least recently used articles are removed, defaults to 256MB
+	:type max_bytes: int
+	'''
+	def __init__(self, path: str = 'stockdata/articles.db', ttl: float = 86400, max_bytes: int = 256_000_000):
+		super().__init__(path, '''
+			CREATE TABLE IF NOT EXISTS articles (
+				key TEXT PRIMARY KEY,
+				url TEXT,
+				content TEXT,
+				etag TEXT,
+				last_modified TEXT,
+				fetched REAL,
+				accessed REAL,
+				size INTEGER
+			);
+			CREATE INDEX IF NOT EXISTS articles_accessed ON articles (accessed);
+		''')
+
+		self.ttl = ttl
+		self.max_bytes = max_bytes
+
+		# When the cache is full, this many extra bytes are evicted, so eviction only runs every so often
+		self.evict_bytes = max(1, max_bytes // 100)
+
+		# How many bytes of text are stored (only ever overestimated, as replacing an article also adds its size)
+		self.size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM articles').fetchone()[0]
+
+		# URL -> (lock, how many threads are using it) for articles that are being downloaded
+		self.in_flight = {}
+
+	@contextmanager
+	def claim(self, url: str):
+		'''
+		Only lets one thread at a time into the block for `url`, so an article several tickers need at once is only
+		downloaded and parsed once (the other threads wait, then find it in the cache)
+		'''
+		with self.lock:
+			lock, users = self.in_flight.get(url, (threading.Lock(), 0))
+			self.in_flight[url] = (lock, users + 1)
+
+		try:
+			with lock:
+				yield
+
+		finally:
+			with self.lock:
+				lock, users = self.in_flight[url]
+
+				if users == 1:
+					del self.in_flight[url]
+				else:
+					self.in_flight[url] = (lock, users - 1)
+
+	def get(self, url: str):
+		'''
+		Returns the `CachedArticle` stored for `url`, or "None" if it is not cached
+
+		Stale articles that have no "ETag"/"Last-Modified" validators are treated as not cached
+		'''
+		with self.lock:
+			row = self.connection.execute(
+				'SELECT content, etag, last_modified, fetched FROM articles WHERE key = ?', (_hash(url),)
+			).fetchone()
+
+			if row is None:
+				self._count(False)
+				return None
+
+			content, etag, last_modified, fetched = row
+			fresh = time.time() - fetched < self.ttl
+
+			if not fresh and etag is None and last_modified is None:
+				self._count(False)
+				return None
+
+			self._count(True)
+
+			with self.connection:
+				self.connection.execute('UPDATE articles SET accessed = ? WHERE key = ?', (time.time(), _hash(url)))
+
+		return CachedArticle(content, etag, last_modified, fresh)
+
+	def put(self, url: str, content: str, etag: str = None, last_modified: str = None):
+		'''
+		Stores the extracted text of an article, then evicts old articles if the cache is too large
+		'''
+		now = time.time()
+		size = len(content.encode('utf-8'))
+
+		with self.lock, self.connection:
+			self.connection.execute(
+				'INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+				(_hash(url), url, content, etag, last_modified, now, now, size)
+			)
+
+			self.size += size
+
+			if self.size > self.max_bytes:
+				self._evict()
+
+	def refresh(self, url: str):
+		'''
+		Marks an article as fresh again (used when the website says it has not changed)
+		'''
+		now = time.time()
+
+		with self.lock, self.connection:
+			self.connection.execute('UPDATE articles SET fetched = ?, accessed = ? WHERE key = ?', (now, now, _hash(url)))
+
+	def _evict(self):
+		'''
+		Removes the least recently used articles if the cache is larger than `max_bytes`, leaving room for `evict_bytes`
+		more (must be called while holding `lock`)
+		'''
+		self.size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM articles').fetchone()[0]
+
+		if self.size <= self.max_bytes:
+			return
+
+		keep = max(0, self.max_bytes - self.evict_bytes)
+
+		evicted = []
+		for key, size in self.connection.execute('SELECT key, size FROM articles ORDER BY accessed'):
+			if self.size <= keep:
+				break
+
+			evicted.append((key,))
+			self.size -= size
+
+		self.connection.executemany('DELETE FROM articles WHERE key = ?', evicted)
+
+class SentimentCache(_SQLiteCache):
+	'''
+	# SentimentCache
+
+	Memoizes the sentiment an LLM gave to a news article, keyed by the model, the ticker and a
+	hash of the article's title and content. Articles the model could not score ("NONE") are
+	stored as well, so they are not sent to the model again
+
+	:param path: Where the cache is stored, defaults to "stockdata/sentiments.db"
+	:type path: str
+	:param max_entries: Once the cache holds more sentiments than this, the least recently used ones are removed, defaults to 100000
+	:type max_entries: int
+	'''
+	def __init__(self, path: str = 'stockdata/sentiments.db', max_entries: int = 100_000):
+		super().__init__(path, '''
+			CREATE TABLE IF NOT EXISTS sentiments (
+				key TEXT PRIMARY KEY,
+				model TEXT,
+				ticker TEXT,
+				sentiment INTEGER,
+				accessed REAL
+			);
+			CREATE INDEX IF NOT EXISTS sentiments_accessed ON sentiments (accessed);
+		''')
+
+		self.max_entries = max_entries
+
+		# When the cache is full, this many extra sentiments are evicted, so eviction only runs every `evict_batch` puts
+		self.evict_batch = max(1, max_entries // 100)
+
+		# How many sentiments are stored (only ever overestimated, as replacing a sentiment also adds 1)
+		self.entries = self.connection.execute('SELECT COUNT(*) FROM sentiments').fetchone()[0]
+
+	def get(self, model: str, ticker: str, title: str, content: str):
+		'''
+		Returns a tuple of `(hit, sentiment)`. On a hit, `sentiment` is the stored sentiment, or "None" if the article was scored as "NONE"
+		'''
+		key = _hash(model, ticker, _hash(title, content))
+
+		with self.lock:
+			row = self.connection.execute('SELECT sentiment FROM sentiments WHERE key = ?', (key,)).fetchone()
+
+			self._count(row is not None)
+
+			if row is None:
+				return False, None
+
+			with self.connection:
+				self.connection.execute('UPDATE sentiments SET accessed = ? WHERE key = ?', (time.time(), key))
+
+		return True, row[0]
+
+	def put(self, model: str, ticker: str, title: str, content: str, sentiment: int = None):
+		'''
+		Stores the sentiment of an article ("None" meaning the model returned "NONE"), then evicts old sentiments if the cache is too large
+		'''
+		key = _hash(model, ticker, _hash(title, content))
+
+		with self.lock, self.connection:
+			self.connection.execute(
+				'INSERT OR REPLACE INTO sentiments VALUES (?, ?, ?, ?, ?)',
+				(key, model, ticker, sentiment, time.time())
+			)
+
+			self.entries += 1
+
+			if self.entries > self.max_entries:
+				self._evict()
+
+	def _evict(self):
+		'''
+		Removes the least recently used sentiments if there are more than `max_entries`, leaving room for `evict_batch` more
+		'''
+		self.entries = self.connection.execute('SELECT COUNT(*) FROM sentiments').fetchone()[0]
+
+		if self.entries <= self.max_entries:
+			return
+
+		keep = max(0, self.max_entries - self.evict_batch)
+
+		self.connection.execute(
+			'DELETE FROM sentiments WHERE key IN (SELECT key FROM sentiments ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+			(keep,)
+		)
+
+		self.entries = keep
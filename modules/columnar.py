@@ -0,0 +1,216 @@
+'''
+# columnar
+
+Date-partitioned columnar copy of the stock data (Parquet or Feather), used as
+a fast read path for training and inference
+
+Every trading day is stored in its own `date=YYYY-MM-DD` directory, so loading
+a date range only opens the partitions inside that range, and only the
+requested columns are ever decoded
+'''
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from . import valuations
+from . import errors
+
+# Map the SQL types used in `valuations.yf_values` onto arrow types
+_ARROW_TYPES = {
+	'TEXT': pa.string(),
+	'DOUBLE': pa.float64(),
+}
+
+class ColumnarStore:
+	'''
+	# ColumnarStore
+
+	Reads and writes stock data as a hive-partitioned (by date) columnar dataset
+
+	:param path: Directory that stores the partitions, defaults to "stockdata/columnar"
+	:type path: str
+	:param format: Either "parquet" or "feather", defaults to "parquet"
+	:type format: str
+	'''
+	def __init__(self, path: str = 'stockdata/columnar', format: str = 'parquet'):
+		if format not in ['parquet', 'feather']:
+			raise errors.error('columnar.py', f'Unknown columnar format "{format}"')
+
+		self.path = path
+		self.format = format
+
+		# Schema of each partition file (the "date" column lives in the directory name instead)
+		self.schema = pa.schema([
+			(value, _ARROW_TYPES[sql_type]) for value, sql_type in valuations.yf_values if value != 'date'
+		])
+
+		self.partitioning = ds.partitioning(pa.schema([('date', pa.string())]), flavor='hive')
+
+	def write(self, data: pd.DataFrame):
+		'''
+		Writes `data` into one partition per date, replacing any partitions that already exist for those dates
+		'''
+		for date, rows in data.groupby('date'):
+			directory = os.path.join(self.path, f'date={date}')
+			os.makedirs(directory, exist_ok=True)
+
+			# Sort by ticker so the min/max statistics of each row group can be used to skip tickers
+			rows = rows.sort_values('ticker').reindex(columns=self.schema.names)
+
+			try:
+				table = pa.Table.from_pandas(rows, schema=self.schema, preserve_index=False)
+
+			except Exception as e:
+				raise errors.error('columnar.py', f'Could not convert data from {date} into an arrow table', e)
+
+			# Write to a hidden temporary file first (dataset scans skip names starting with "."),
+			# so readers never see a half written partition
+			file = os.path.join(directory, f'part-0.{self.format}')
+			temporary_file = os.path.join(directory, f'.part-0.{self.format}.tmp')
+
+			if self.format == 'parquet':
+				pq.write_table(table, temporary_file, compression='zstd')
+			else:
+				feather.write_feather(table, temporary_file, compression='zstd')
+
+			os.replace(temporary_file, file)
+
+	def _filter(self, tickers: list = None, start: str = None, end: str = None):
+		'''
+		Returns the filter that is pushed down into a scan, or "None" if nothing is filtered
+		'''
+		expression = None
+		conditions = []
+
+		if tickers is not None:
+			conditions.append(ds.field('ticker').isin(list(tickers)))
+		if start is not None:
+			conditions.append(ds.field('date') >= str(start))
+		if end is not None:
+			conditions.append(ds.field('date') <= str(end))
+
+		for condition in conditions:
+			expression = condition if expression is None else expression & condition
+
+		return expression
+
+	def dates(self):
+		'''
+		Returns a sorted list of every date that has a partition
+		'''
+		if not os.path.isdir(self.path):
+			return []
+
+		return sorted(
+			directory.removeprefix('date=') for directory in os.listdir(self.path)
+			if directory.startswith('date=')
+		)
+
+	def last_date(self):
+		'''
+		Returns the most recent date in the store, or "None" if the store is empty
+		'''
+		dates = self.dates()
+
+		return dates[-1] if len(dates) != 0 else None
+
+	def read(self, columns: list = None, tickers: list = None, start: str = None, end: str = None, compact: bool = False):
+		'''
+		Loads the stock data as a pandas DataFrame, sorted by date and ticker
+
+		:param columns: Only decode these columns, defaults to every column in `valuations.yf_values`
+		:type columns: list
+		:param tickers: Only return rows for these tickers
+		:type tickers: list
+		:param start: First date (inclusive) to load, partitions before it are never opened
+		:type start: str
+		:param end: Last date (inclusive) to load, partitions after it are never opened
+		:type end: str
+		:param compact: Return metrics as float32 and text columns (other than "date") as categoricals
+		:type compact: bool
+		'''
+		if len(self.dates()) == 0:
+			raise errors.error('columnar.py', f'No columnar stock data found in {self.path}')
+
+		columns = [value for value, _ in valuations.yf_values] if columns is None else list(columns)
+
+		try:
+			dataset = ds.dataset(self.path, format=self.format, partitioning=self.partitioning)
+			table = dataset.to_table(columns=columns, filter=self._filter(tickers, start, end))
+
+		except Exception as e:
+			raise errors.error('columnar.py', 'Could not read columnar stock data', e)
+
+		# Convert to compact types inside arrow, so the float64/string versions never reach pandas
+		if compact:
+			table = table.cast(pa.schema([
+				(field.name, pa.float32() if field.type == pa.float64() else field.type) for field in table.schema
+			]))
+
+			data = table.to_pandas(categories=[
+				field.name for field in table.schema if field.type == pa.string() and field.name != 'date'
+			])
+
+		else:
+			data = table.to_pandas()
+
+		# Keep rows in chronological order so each ticker's history is in sequence
+		sort_by = [column for column in ['date', 'ticker'] if column in data.columns]
+
+		return data.sort_values(sort_by, kind='stable').reset_index(drop=True)
+
+	def last_known(self, columns: list, before: str, tickers: list = None, dates_per_read: int = 32):
+		'''
+		Returns a DataFrame with one row per ticker, holding the newest non-null value of each column in `columns`
+		from before the date `before` ("NaN" if a column was never known)
+
+		Partitions are read newest first, `dates_per_read` dates at a time, stopping once every value is known
+
+		:param tickers: Only load values for these tickers
+		:type tickers: list
+		'''
+		dates = [date for date in self.dates() if date < str(before)]
+		known = pd.DataFrame(columns=columns, dtype='float64').rename_axis('ticker')
+
+		for end in range(len(dates), 0, -dates_per_read):
+			rows = self.read(['ticker'] + list(columns), tickers, dates[max(end - dates_per_read, 0)], dates[end - 1])
+
+			# Rows are in chronological order, and `last` skips missing values
+			known = known.combine_first(rows.groupby('ticker', sort=False).last())
+
+			if known.notna().all().all():
+				break
+
+		return known.reindex(columns=columns).reset_index()
+
+	def ticker_counts(self, tickers: list = None, start: str = None, end: str = None):
+		'''
+		Returns a DataFrame with the first date ("first_date") and number of rows ("rows") of every ticker, sorted by
+		first date and then ticker (the order `read` first returns each ticker in)
+
+		Only the ticker and date columns are scanned, one batch at a time
+		'''
+		if len(self.dates()) == 0:
+			raise errors.error('columnar.py', f'No columnar stock data found in {self.path}')
+
+		counts = []
+
+		try:
+			dataset = ds.dataset(self.path, format=self.format, partitioning=self.partitioning)
+
+			for batch in dataset.to_batches(columns=['ticker', 'date'], filter=self._filter(tickers, start, end)):
+				counts.append(batch.to_pandas().groupby('ticker').agg(first_date=('date', 'min'), rows=('date', 'size')))
+
+		except Exception as e:
+			raise errors.error('columnar.py', 'Could not read columnar stock data', e)
+
+		if len(counts) == 0:
+			return pd.DataFrame({'ticker': [], 'first_date': [], 'rows': []})
+
+		counts = pd.concat(counts).groupby(level=0).agg(first_date=('first_date', 'min'), rows=('rows', 'sum'))
+
+		return counts.rename_axis('ticker').reset_index().sort_values(['first_date', 'ticker'], ignore_index=True)
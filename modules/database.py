@@ -0,0 +1,242 @@
+'''
+# database
+
+SQLite storage backend for stock data. The table layout is built from
+`valuations.yf_values`, and every row is written in its own transaction so a
+crash mid-run never loses previously collected tickers
+'''
+import sqlite3
+
+import pandas as pd
+
+from . import valuations
+from . import errors
+
+class StockDatabase:
+	'''
+	# StockDatabase
+
+	Stores one row per (date, ticker) in a SQLite database running in WAL mode
+	'''
+	def __init__(self, path: str = 'stockdata/stockdata.db', table: str = 'stockdata'):
+		self.path = path
+		self.table = table
+
+		# Column names in the order they appear in `valuations.yf_values`
+		self.columns = [value for value, _ in valuations.yf_values]
+
+		try:
+			# The connection can be handed to another thread (ex: the download pipeline stores rows from a worker
+			# thread), callers make sure only one thread uses it at a time
+			self.connection = sqlite3.connect(self.path, check_same_thread=False)
+
+			# WAL lets readers (training, inference) open the database while a download is writing to it
+			self.connection.execute('PRAGMA journal_mode=WAL')
+			self.connection.execute('PRAGMA synchronous=NORMAL')
+
+			self._create_table()
+
+		except sqlite3.Error as e:
+			raise errors.error('database.py', f'Could not open database at {self.path}', e)
+
+	def _create_table(self):
+		'''
+		Creates the stock data table and its unique (date, ticker) index if they do not exist yet
+		'''
+		columns = ', '.join(f'"{value}" {sql_type}' for value, sql_type in valuations.yf_values)
+
+		with self.connection:
+			self.connection.execute(f'CREATE TABLE IF NOT EXISTS {self.table} (id INTEGER PRIMARY KEY, {columns})')
+			self.connection.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {self.table}_date_ticker ON {self.table} (date, ticker)')
+
+			# Article text is kept in its own side table, so loading stock data never has to read it
+			self.connection.execute('CREATE TABLE IF NOT EXISTS news (date TEXT, ticker TEXT, news TEXT, UNIQUE (date, ticker))')
+
+	def upsert(self, data: pd.DataFrame):
+		'''
+		Inserts every row of `data`, replacing any row that already exists for the same (date, ticker)
+
+		Each call is a single transaction, so either all rows are written or none are
+		'''
+		# Only keep columns that are a part of the schema, in schema order
+		data = data.reindex(columns=self.columns)
+
+		# SQLite does not understand pandas/numpy missing values, so convert them to "None"
+		rows = data.astype(object).where(data.notna(), None).itertuples(index=False, name=None)
+
+		names = ', '.join(f'"{value}"' for value in self.columns)
+		placeholders = ', '.join('?' for _ in self.columns)
+		updates = ', '.join(f'"{value}" = excluded."{value}"' for value in self.columns if value not in ['date', 'ticker'])
+
+		try:
+			with self.connection:
+				self.connection.executemany(
+					f'INSERT INTO {self.table} ({names}) VALUES ({placeholders}) '
+					f'ON CONFLICT (date, ticker) DO UPDATE SET {updates}',
+					list(rows)
+				)
+
+		except sqlite3.Error as e:
+			raise errors.error('database.py', 'Could not insert data into database', e)
+
+	def add_news(self, data: pd.DataFrame):
+		'''
+		Inserts (or replaces) the article text in the "date", "ticker" and "news" columns of `data`
+		'''
+		data = data[['date', 'ticker', 'news']]
+		rows = data.astype(object).where(data.notna(), None).itertuples(index=False, name=None)
+
+		try:
+			with self.connection:
+				self.connection.executemany('INSERT OR REPLACE INTO news (date, ticker, news) VALUES (?, ?, ?)', list(rows))
+
+		except sqlite3.Error as e:
+			raise errors.error('database.py', 'Could not insert news into database', e)
+
+	def news(self):
+		'''
+		Returns the article text side table as a pandas DataFrame
+		'''
+		return pd.read_sql_query('SELECT date, ticker, news FROM news ORDER BY date, ticker', self.connection)
+
+	def exists(self, date: str, ticker: str):
+		'''
+		Checks if a row exists for a ticker on a specific day (uses the unique index)
+		'''
+		cursor = self.connection.execute(
+			f'SELECT 1 FROM {self.table} WHERE date = ? AND ticker = ? LIMIT 1',
+			(str(date), ticker)
+		)
+
+		return cursor.fetchone() is not None
+
+	def last_date(self):
+		'''
+		Returns the newest date in the table, or "None" if it is empty
+		'''
+		return self.connection.execute(f'SELECT MAX(date) FROM {self.table}').fetchone()[0]
+
+	def _where(self, tickers: list = None, start: str = None, end: str = None):
+		'''
+		Returns a tuple of `(where, parameters)`: the WHERE clause (an empty string if nothing is filtered) and its
+		parameters, so filtering happens inside SQLite (using the (date, ticker) index)
+		'''
+		conditions, parameters = [], []
+
+		if tickers is not None:
+			conditions.append(f'ticker IN ({", ".join("?" for _ in tickers)})')
+			parameters.extend(tickers)
+		if start is not None:
+			conditions.append('date >= ?')
+			parameters.append(str(start))
+		if end is not None:
+			conditions.append('date <= ?')
+			parameters.append(str(end))
+
+		where = f'WHERE {" AND ".join(conditions)} ' if len(conditions) != 0 else ''
+
+		return where, parameters
+
+	def to_dataframe(self, columns: list = None, tickers: list = None, start: str = None, end: str = None):
+		'''
+		Exports the table as a pandas DataFrame, sorted by date and ticker
+
+		:param columns: Only load these columns, defaults to every column in `valuations.yf_values`
+		:type columns: list
+		:param tickers: Only load rows for these tickers
+		:type tickers: list
+		:param start: First date (inclusive) to load
+		:type start: str
+		:param end: Last date (inclusive) to load
+		:type end: str
+		'''
+		columns = self.columns if columns is None else columns
+		names = ', '.join(f'"{value}"' for value in columns)
+
+		where, parameters = self._where(tickers, start, end)
+
+		try:
+			return pd.read_sql_query(
+				f'SELECT {names} FROM {self.table} {where}ORDER BY date, ticker',
+				self.connection,
+				params=parameters
+			)
+
+		except Exception as e:
+			raise errors.error('database.py', 'Could not export database to DataFrame', e)
+
+	def ticker_counts(self, tickers: list = None, start: str = None, end: str = None):
+		'''
+		Returns a DataFrame with the first date ("first_date") and number of rows ("rows") of every ticker, sorted by
+		first date and then ticker (the order `to_dataframe` first returns each ticker in)
+		'''
+		where, parameters = self._where(tickers, start, end)
+
+		try:
+			return pd.read_sql_query(
+				f'SELECT ticker, MIN(date) AS first_date, COUNT(*) AS rows FROM {self.table} {where}'
+				'GROUP BY ticker ORDER BY first_date, ticker',
+				self.connection,
+				params=parameters
+			)
+
+		except Exception as e:
+			raise errors.error('database.py', 'Could not count rows in database', e)
+
+	def last_known(self, columns: list, before: str, tickers: list = None):
+		'''
+		Returns a DataFrame with one row per ticker, holding the newest non-null value of each column in `columns`
+		from before the date `before` ("NaN" if a column was never known)
+
+		:param tickers: Only load values for these tickers
+		:type tickers: list
+		'''
+		condition, parameters = '', []
+
+		if tickers is not None:
+			condition = f'AND ticker IN ({", ".join("?" for _ in tickers)}) '
+
+		# SQLite returns the other columns of the row MAX(date) picked, so each part of the query is the
+		# newest known value of one column for every ticker
+		queries = []
+		for column in columns:
+			queries.append(
+				f'SELECT ticker, \'{column}\' AS metric, "{column}" AS value, MAX(date) FROM {self.table} '
+				f'WHERE date < ? AND "{column}" IS NOT NULL {condition}GROUP BY ticker'
+			)
+			parameters.extend([str(before)] + ([] if tickers is None else list(tickers)))
+
+		try:
+			rows = pd.read_sql_query(' UNION ALL '.join(queries), self.connection, params=parameters)
+
+		except Exception as e:
+			raise errors.error('database.py', 'Could not load the last known values from database', e)
+
+		known = rows.pivot(index='ticker', columns='metric', values='value').reindex(columns=columns).astype('float64')
+
+		return known.rename_axis(columns=None).reset_index()
+
+	def import_csv(self, path: str = 'stockdata/stockdata.csv'):
+		'''
+		Copies every row of a stock data CSV file into the database
+		'''
+		try:
+			data = pd.read_csv(path)
+
+		except FileNotFoundError as e:
+			raise errors.error('database.py', f'Couldn\'t find {path} to import', e)
+
+		self.upsert(data)
+
+		# Article text goes to the side table
+		if 'news' in data.columns:
+			self.add_news(data)
+
+	def __len__(self):
+		return self.connection.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+	def close(self):
+		'''
+		Closes the database connection
+		'''
+		self.connection.close()
@@ -1,32 +1,239 @@
 '''
 Module that manages the database for stock data, and stores news imformation on each company
 '''
+import os
 import pickle
+import shutil
 
 from . import errors
 import pandas as pd
 from torch.utils.data import DataLoader
 from . import ml
 from . import valuations
-from numpy import array
+from . import database
+from . import columnar
+from . import tensorcache
+from . import shards
+import numpy as np
 from torch import from_numpy
-from sklearn.preprocessing import RobustScaler
+from sklearn.preprocessing import StandardScaler
 
 # Do these do avoid warnings
 pd.options.mode.chained_assignment = None
 pd.set_option('future.no_silent_downcasting', True)
 
+# The only columns needed to train `StockNet` or run inference
+_training_columns = ['date', 'ticker'] + valuations.numeric_values
+
+# Text columns that are stored as pandas categoricals in compact mode
+_categorical_columns = ['ticker', 'sector', 'industry']
+
+# Change this whenever `prepare` or `StockDataManager.training_arrays` would create different arrays from
+# the same stock data, so arrays cached by an older version are not reused
+_PREPROCESSING_VERSION = 1
+
+# Where `StockDataManager.streaming_split` writes its shards
+_shards_path = 'stockdata/shards'
+
+# Side table that stores article text once it has been split out of `stockdata.csv`
+_news_path = 'stockdata/news.csv'
+
+def _compact_dtypes(columns):
+	'''
+	Returns the compact dtype of every column in `columns` that has one
+	'''
+	dtypes = {value: 'float32' for value in valuations.numeric_values if value in columns}
+	dtypes.update({value: 'category' for value in _categorical_columns if value in columns})
+
+	return dtypes
+
+def to_compact(stockdata: pd.DataFrame):
+	'''
+	Returns `stockdata` with float32 metrics, categorical ticker/sector/industry columns, and without article text
+	'''
+	stockdata = stockdata.drop(['news'], axis=1, errors='ignore')
+
+	return stockdata.astype(_compact_dtypes(stockdata.columns))
+
+def _read_csv(path: str = 'stockdata/stockdata.csv', compact: bool = False):
+	'''
+	Reads a stock data CSV file
+
+	In compact mode, the "news" column is never parsed (it is moved to `stockdata/news.csv` the
+	first time the file is read) and every column is given its compact dtype while parsing
+	'''
+	if not compact:
+		return pd.read_csv(path)
+
+	header = pd.read_csv(path, nrows=0).columns
+
+	# Move article text into its own side table, so it only has to be parsed when it is needed
+	if 'news' in header and not os.path.exists(_news_path):
+		pd.read_csv(path, usecols=['date', 'ticker', 'news']).to_csv(_news_path, index=False)
+
+	return pd.read_csv(
+		path,
+		usecols=[column for column in header if column != 'news'],
+		dtype=_compact_dtypes(header)
+	)
+
+def prepare(stockdata: pd.DataFrame, carried: pd.DataFrame = None):
+	'''
+	Cleans the stock data of every ticker at once, for training and inference
+
+	Returns a DataFrame with each ticker's rows grouped together (in their original order), with the "date" (if there
+	is one) and "ticker" columns, every numeric column in `valuations.yf_values` as float32, and an "expectedReturn"
+	column (the percent return of the next day, which is what `StockNet` predicts). Missing numeric values are
+	linearly interpolated within each ticker, then forward filled, then set to 0
+
+	:param carried: The newest known values of each ticker from before the first row of `stockdata` (see
+	`StockDataManager.carried`). They act as one extra row at the start of the ticker, so missing values are filled
+	from them instead of set to 0, like they are when the older rows are loaded. That row is not returned
+	:type carried: pd.DataFrame
+	'''
+	features = [value for value in valuations.numeric_values if value in stockdata.columns]
+	keys = [column for column in ['date', 'ticker'] if column in stockdata.columns]
+
+	stockdata = stockdata[keys + features]
+	carried_rows = np.zeros(len(stockdata), dtype=bool)
+
+	if carried is not None and len(carried) != 0:
+		stockdata = pd.concat([carried.reindex(columns=['ticker'] + features), stockdata], ignore_index=True)
+		carried_rows = np.arange(len(stockdata)) < len(carried)
+
+	# Group each ticker's rows together once (in the order tickers first appear), keeping their chronological order
+	order = np.argsort(pd.factorize(stockdata['ticker'])[0], kind='stable')
+	stockdata = stockdata.iloc[order].reset_index(drop=True)
+	carried_rows = carried_rows[order]
+
+	tickers = stockdata['ticker'].to_numpy()
+	values = stockdata[features].astype(np.float64)
+
+	# Add "expectedReturn" column that stores the percent return for the next day (this is what we are trying to predict)
+	price = values['regularMarketPrice']
+	next_price = price.groupby(tickers, sort=False).shift(-1)
+	expected_return = (next_price - price) / price
+
+	# Linear interpolation within each ticker, done for every column at once: find the position and value of
+	# the closest known value before and after each missing value (without looking into other tickers)
+	valid = values.notna()
+	position = pd.DataFrame(
+		np.where(valid, np.arange(len(values), dtype=np.float64)[:, None], np.nan),
+		index=values.index,
+		columns=features
+	)
+
+	previous_position = position.groupby(tickers, sort=False).ffill()
+	next_position = position.groupby(tickers, sort=False).bfill()
+	previous_value = values.groupby(tickers, sort=False).ffill()
+	next_value = values.groupby(tickers, sort=False).bfill()
+
+	current_position = np.arange(len(values), dtype=np.float64)[:, None]
+	interpolated = previous_value + (next_value - previous_value) * (current_position - previous_position) / (next_position - previous_position)
+
+	# Known values stay the same, values between two known values are interpolated, values after the last
+	# known value are forward filled, and values before the first known value are set to 0
+	values = values.where(valid, interpolated.where(next_position.notna(), previous_value)).fillna(0)
+
+	prepared = stockdata[keys].copy()
+	prepared[features] = values.astype(np.float32)
+	prepared['expectedReturn'] = expected_return
+
+	if carried_rows.any():
+		prepared = prepared.loc[~carried_rows].reset_index(drop=True)
+
+	return prepared
+
+def _last_known(stockdata: pd.DataFrame):
+	'''
+	Returns the newest non-null value of every numeric column for each ticker in `stockdata` (rows in chronological order)
+	'''
+	features = [value for value in valuations.numeric_values if value in stockdata.columns]
+
+	return stockdata.groupby('ticker', sort=False, observed=True)[features].last().reset_index()
+
+def _coverage(starts: np.ndarray, rows: int, window_size: int):
+	'''
+	Returns how many of the windows starting at `starts` each of the `rows` rows appears in
+	'''
+	coverage = np.zeros(rows + window_size)
+	np.add.at(coverage, starts, 1)
+	np.add.at(coverage, starts + window_size, -1)
+
+	return np.cumsum(coverage)[:rows]
+
+def _open_database():
+	'''
+	Opens the SQLite stock database, first copying in `stockdata/stockdata.csv` if the database is empty
+	(so data collected before switching to the SQLite backend carries over)
+	'''
+	stock_database = database.StockDatabase()
+
+	if len(stock_database) == 0 and os.path.exists('stockdata/stockdata.csv'):
+		stock_database.import_csv()
+
+	return stock_database
+
+def _columnar_store(format: str):
+	'''
+	Opens the columnar copy of the stock data. If it is empty (it is only updated at the end of `download.py`),
+	it is first filled from the SQLite database or `stockdata/stockdata.csv`, whichever exists
+	'''
+	store = columnar.ColumnarStore(format=format)
+
+	if len(store.dates()) != 0:
+		return store
+
+	if os.path.exists('stockdata/stockdata.db'):
+		stockdata = _open_database().to_dataframe()
+	elif os.path.exists('stockdata/stockdata.csv'):
+		stockdata = _read_csv()
+	else:
+		return store
+
+	if len(stockdata) != 0:
+		store.write(stockdata)
+
+	return store
+
 class DataManager:
 	'''
 	# DataManager
 
 	Manages stock data storage
+
+	:param backend: Either "csv" (`stockdata/stockdata.csv`) or "sqlite" (`stockdata/stockdata.db`), defaults to "csv"
+	:type backend: str
+	:param compact: Keep metrics as float32 and ticker/sector/industry as categoricals, and only load
+	article text when `news` is used, defaults to False. The compact data is only kept in memory, rows
+	are always saved at full precision
+	:type compact: bool
 	'''
-	def __init__(self):
+	def __init__(self, backend: str = 'csv', compact: bool = False):
+		self.backend = backend
+		self.compact = compact
+
+		# Article text is loaded lazily (see `news`)
+		self._news = None
+
+		# Article text added since the last save (compact mode keeps it out of `stockdata`, see `save`)
+		self._pending_news = []
+
+		# Full precision rows added since the last save (compact `stockdata` is float32, so it is never saved, see `save`)
+		self._pending_rows = []
+
+		if backend == 'sqlite':
+			self.stockdata = None
+			self.database = _open_database()
+
+			return
+
+		elif backend != 'csv':
+			raise errors.error('datamanager.py', f'Unknown storage backend "{backend}"')
 
 		# Check if a saved DataFrame already exists
 		try:
-			self.stockdata = pd.read_csv('stockdata/stockdata.csv')
+			self.stockdata = _read_csv(compact=compact)
 		
 		# If no DataFrame exists, set self.stockdata to "None"
 		except FileNotFoundError:
@@ -35,118 +242,403 @@ class DataManager:
 	def add_data(self, data: pd.DataFrame):
 		'''
 		Adds data for a specific ticker to the `stockdata` dataframe
+
+		With the "sqlite" backend, the row is written to the database immediately
 		'''
+		if self.backend == 'sqlite':
+			self.database.upsert(data)
+			return
+
+		# Compact stock data never holds article text, so set it aside for `news.csv`
+		if self.compact and 'news' in data.columns:
+			news = data[['date', 'ticker', 'news']].copy()
+			news['date'] = news['date'].astype(str)
+
+			self._pending_news.append(news)
+
+		if self.compact:
+			self._pending_rows.append(data.drop(['news'], axis=1, errors='ignore'))
+
 		if self.stockdata is None:
 			self.stockdata = data
 		
 		self.stockdata = pd.concat([self.stockdata, data])
+
+		# Concatenating categoricals with new values falls back to strings, so compact the data again
+		if self.compact:
+			self.stockdata = to_compact(self.stockdata)
 	
 	def data_exists(self, date: str, ticker: str):
 		'''
 		Checks if data for a stock has been entered (for a specific day)
 		'''
-		return not self.stockdata.loc[(self.stockdata['date'] == date) & (self.stockdata['ticker'] == ticker)].empty
+		if self.backend == 'sqlite':
+			return self.database.exists(date, ticker)
+
+		if self.stockdata is None:
+			return False
+
+		return not self.stockdata.loc[(self.stockdata['date'] == str(date)) & (self.stockdata['ticker'] == ticker)].empty
 	
 	def save(self):
 		'''
 		Saves the DataFrame to file
+
+		Does nothing with the "sqlite" backend, as every row is committed when it is added
+		'''
+		if self.backend == 'sqlite':
+			return
+
+		if not self.compact:
+			self.stockdata.to_csv('stockdata/stockdata.csv')
+
+		# Compact stock data is a rounded (float32) view, so only the full precision rows added since the
+		# last save are written, appended to the end of the file
+		elif len(self._pending_rows) != 0:
+			rows = pd.concat(self._pending_rows)
+
+			if os.path.exists('stockdata/stockdata.csv'):
+				header = pd.read_csv('stockdata/stockdata.csv', nrows=0).columns
+				rows.reindex(columns=header).to_csv('stockdata/stockdata.csv', mode='a', header=False, index=False)
+
+			else:
+				rows.to_csv('stockdata/stockdata.csv')
+
+			self._pending_rows = []
+
+		# In compact mode, article text is saved to its own side table
+		if len(self._pending_news) != 0:
+			news = pd.concat([self.news] + self._pending_news).drop_duplicates(['date', 'ticker'], keep='last')
+			news.to_csv(_news_path, index=False)
+
+			self._news = news
+			self._pending_news = []
+
+	def to_dataframe(self, start: str = None):
+		'''
+		Returns the stored stock data as a pandas DataFrame
+
+		Metrics are always at full precision (even in compact mode), so the result is safe to save elsewhere
+
+		:param start: Only return rows on or after this date, defaults to returning every row
+		:type start: str
+		'''
+		if self.backend == 'sqlite':
+			return self.database.to_dataframe(start=start)
+
+		stockdata = self.stockdata
+
+		# Compact stock data is rounded to float32, so read the full precision rows back from the file
+		if self.compact:
+			rows = list(self._pending_rows)
+
+			if os.path.exists('stockdata/stockdata.csv'):
+				rows.insert(0, pd.read_csv('stockdata/stockdata.csv', usecols=lambda column: column != 'news'))
+
+			stockdata = pd.concat(rows) if len(rows) != 0 else None
+
+		if start is None or stockdata is None:
+			return stockdata
+
+		return stockdata.loc[stockdata['date'] >= str(start)]
+
+	@property
+	def news(self):
 		'''
-		self.stockdata.to_csv('stockdata/stockdata.csv')
+		Article text stored for each date and ticker (loaded from disk the first time it is used)
+		'''
+		if self._news is None:
+			if self.backend == 'sqlite':
+				self._news = self.database.news()
+
+			elif os.path.exists(_news_path):
+				self._news = pd.read_csv(_news_path)
+
+			elif self.stockdata is not None and 'news' in self.stockdata.columns:
+				self._news = self.stockdata[['date', 'ticker', 'news']]
+
+			else:
+				self._news = pd.DataFrame(columns=['date', 'ticker', 'news'])
+
+		return self._news
 
 class StockDataManager:
 	'''
 	# StockDataManager
 
 	Class that manages the data used to train `StockNet`
+
+	:param backend: Where to load stock data from, either "csv", "sqlite", "parquet" or "feather", defaults to "csv"
+	:type backend: str
+	:param tickers: Only load data for these tickers
+	:type tickers: list
+	:param start: First date (inclusive) to load
+	:type start: str
+	:param end: Last date (inclusive) to load
+	:type end: str
+	:param compact: Load metrics as float32 and the ticker column as a categorical, defaults to False
+	:type compact: bool
+
+	**NOTE:** The "sqlite", "parquet" and "feather" backends only load the date, ticker and numeric
+	columns in `valuations.yf_values`, as the text columns are never used for training or inference
 	'''
 
-	def __init__(self):
+	def __init__(self, backend: str = 'csv', tickers: list = None, start: str = None, end: str = None, compact: bool = False):
+		self.backend = backend
+		self.tickers = tickers
+		self.start = start
+		self.end = end
+		self.compact = compact
+
+		# Stock data is only loaded the first time it is needed (see `stockdata`), so training can skip it
+		# entirely when `train_test_split` finds its arrays in the cache
+		self._stockdata = None
+
+		# Cleaned stock data, created the first time it is needed (see `prepared`)
+		self._prepared = None
+		self._ticker_rows = None
+
+		# Scaler used by `get_ticker_data`, loaded the first time it is needed
+		self._scaler = None
+
+		# Newest known values from before `start`, loaded the first time they are needed (see `carried`)
+		self._carried = None
+
+	@property
+	def stockdata(self):
+		'''
+		The stock data loaded from `backend`
+		'''
+		if self._stockdata is None:
+			self._stockdata = self._load()
+
+		return self._stockdata
+
+	@stockdata.setter
+	def stockdata(self, stockdata: pd.DataFrame):
+		self._stockdata = stockdata
+
+		self._prepared = None
+		self._ticker_rows = None
+		self._carried = None
+
+	def _load(self):
+		'''
+		Loads stock data from `backend`, applying the ticker/date filters
+		'''
+		# Load the columnar copy of our stock data, pushing the ticker/date filters down into the scan
+		if self.backend in ['parquet', 'feather']:
+			return _columnar_store(self.backend).read(_training_columns, self.tickers, self.start, self.end, self.compact)
+
+		# Load stock data from the SQLite database
+		if self.backend == 'sqlite':
+			stock_database = _open_database()
+
+			if len(stock_database) == 0:
+				raise errors.error('datamanager.py', 'The stock database is empty, run download.py first')
+
+			stockdata = stock_database.to_dataframe(_training_columns, self.tickers, self.start, self.end)
+
+			if self.compact:
+				stockdata = to_compact(stockdata)
+
+			return stockdata
+
 		# Try and load our stockdata from file
 		try:
-			self.stockdata = pd.read_csv('stockdata/stockdata.csv')
+			stockdata = _read_csv(compact=self.compact)
 		except FileNotFoundError as e:
 			raise errors.error('datamanager.py','Couldn\'t find stockdata in file', e)
 
-	def train_test_split(self, LSTM_window_size: int, batch_size, split_size: int = 0.6):
+		# Apply filters after the fact, as CSV files can not be filtered while parsing
+		if self.tickers is not None:
+			stockdata = stockdata.loc[stockdata['ticker'].isin(self.tickers)]
+		if self.start is not None:
+			# The rows before `start` are already parsed, so keep what `carried` needs from them
+			self._carried = _last_known(stockdata.loc[stockdata['date'] < str(self.start)])
+			stockdata = stockdata.loc[stockdata['date'] >= str(self.start)]
+		if self.end is not None:
+			stockdata = stockdata.loc[stockdata['date'] <= str(self.end)]
+
+		return stockdata
+
+	def carried(self):
 		'''
-		Uses `sklearn.preprocessing.StandardScaler` to standardize stock data
+		Returns the newest known value of every metric from before `start`, one row per ticker (see `prepare`), or
+		"None" if every date is loaded. Only a small query is needed with the "sqlite", "parquet" and "feather" backends
+		'''
+		if self.start is None:
+			return None
 
-		:param LSTM_window_size: The size of the "window" **in days**. A size of 3 would equal 3 days long
+		if self._carried is None:
+			if self.backend in ['parquet', 'feather']:
+				carried = _columnar_store(self.backend).last_known(valuations.numeric_values, self.start, self.tickers)
 
-		:param batch_size: The batch size the dataloaders will use, defaults to 8
-		:type batch_size: int
+			elif self.backend == 'sqlite':
+				carried = _open_database().last_known(valuations.numeric_values, self.start, self.tickers)
 
-		:param split_size: What % of the data will be in the **train** dataset, defaults to 0.6 (60%)
-		:type split_size: int
+			else:
+				# Parsing the CSV file sets `_carried` (it is already set if `stockdata` was loaded from it)
+				self._load()
+				carried = self._carried
+
+			self._carried = to_compact(carried) if self.compact else carried
+
+		return self._carried
+
+	def _source_files(self):
 		'''
-		# Use default stock data
-		stockdata = self.stockdata
+		Returns the files `backend` loads stock data from
+		'''
+		if self.backend in ['parquet', 'feather']:
+			store = _columnar_store(self.backend)
 
-		# Drop unnecessary columns (do this here so if the stock data is custom, there isn't any error when dropping columns)
-		stockdata = stockdata.drop(['id', 'industry', 'sector', 'date', 'news'], axis=1)
+			return [
+				os.path.join(store.path, f'date={date}', f'part-0.{self.backend}') for date in store.dates()
+				if (self.start is None or date >= str(self.start)) and (self.end is None or date <= str(self.end))
+			]
 
-		# For each ticker, format its data
-		stockdata_formatted = []
-		for ticker in stockdata['ticker'].unique():
+		if self.backend == 'sqlite':
+			# Uncheckpointed writes live in the write-ahead log, so it is part of the data too
+			return ['stockdata/stockdata.db', 'stockdata/stockdata.db-wal']
 
-			# Pull data for specific ticker
-			df = stockdata.loc[stockdata['ticker'] == ticker].copy()
+		return ['stockdata/stockdata.csv']
 
-			# Skip companies with insufficient data
-			if len(df) <= LSTM_window_size:
-				continue
+	def fingerprint(self):
+		'''
+		Returns a hash of the source stock data and the filters used to load it, which changes whenever the loaded stock data would
+		'''
+		return tensorcache.TensorCache.key(
+			tensorcache.hash_files(self._source_files()),
+			self.backend,
+			None if self.tickers is None else sorted(self.tickers),
+			None if self.start is None else str(self.start),
+			None if self.end is None else str(self.end),
+			self.compact
+		)
 
-			# Add "expectedReturn" column that stores the percent return for the next day (this is what we are trying to predict)
-			df['expectedReturn'] = (df['regularMarketPrice'].shift(-1) - df['regularMarketPrice']) / df['regularMarketPrice']
+	def _windows(self, LSTM_window_size: int):
+		'''
+		Returns a tuple of `(prepared, features, starts)`: the cleaned stock data of every company with enough days for
+		a window (without each company's last row, as it has no expected return), the numeric columns used as inputs
+		(in a fixed order), and the row in `prepared` each window starts at (windows never cross from one company into the next)
+		'''
+		# Clean every company's data
+		prepared = self.prepared()
 
-			# Process numeric columns individually
-			for col in df.columns:
+		# Remove the last row of each company as it has no expected return, then skip companies with insufficient data
+		last_row = prepared.groupby('ticker', sort=False, observed=True).cumcount(ascending=False) == 0
+		prepared = prepared.loc[~last_row]
 
-				# Skip columns that are not numbers
-				if col in ['ticker', 'expectedReturn']:
-					continue
+		codes = pd.factorize(prepared['ticker'])[0]
+		prepared = prepared.loc[np.bincount(codes)[codes] >= LSTM_window_size]
 
-				# Fix missing data
-				df[col] = df[col].interpolate(method='linear')
-				df[col] = df[col].ffill()
-				df[col] = df[col].fillna(0)
+		if len(prepared) == 0:
+			raise errors.error('datamanager.py', f'No company has more than {LSTM_window_size} days of stock data')
 
-			# Append formatted data, removing the last row as it is not usefull
-			stockdata_formatted.append(df.drop(df.tail(1).index))
+		features = [value for value in valuations.numeric_values if value in prepared.columns]
 
-		# Iterate through each company, and format data into sequences
-		X, y = [], []
-		for company_data in stockdata_formatted:
+		# Where each company's rows start (rows are already grouped by company)
+		lengths = np.bincount(pd.factorize(prepared['ticker'])[0])
+		offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
 
-			# Seperate data into input and output (also seperate input into numeric and categorial)
-			inp = company_data.drop(['ticker', 'expectedReturn'], axis=1).astype('float32').reset_index(drop=True)
-			out = company_data['expectedReturn'].astype('float32').reset_index(drop=True)
+		starts = np.concatenate([
+			offset + np.arange(length - LSTM_window_size + 1) for offset, length in zip(offsets, lengths)
+		])
 
-			# Create sequences of 2-day periods
-			for i in range(len(inp) - LSTM_window_size + 1):
+		return prepared, features, starts
 
-				# Add data to "X" and "y" lists
-				X.append( inp.iloc[i : (i + LSTM_window_size)] )
-				y.append([ out.iloc[ i + LSTM_window_size-1 ] ]) # Add "[]" to make the output array 2D
+	def _build_arrays(self, LSTM_window_size: int, split_size: float):
+		'''
+		Cleans, windows and scales the stock data (see `training_arrays`)
+		'''
+		prepared, features, starts = self._windows(LSTM_window_size)
 
-		# Convert y into a numpy array
-		y = array(y)
+		# Every company's inputs as one contiguous float32 matrix (rows are already grouped by company)
+		inp = prepared[features].to_numpy(dtype=np.float32)
+		out = prepared['expectedReturn'].to_numpy(dtype=np.float32)
 
 		# Split into train/test sets
-		split_idx = int(len(X) * split_size)
+		split_idx = int(len(starts) * split_size)
 
-		X_train, X_test = X[:split_idx], X[split_idx:]
-		y_train, y_test = y[:split_idx], y[split_idx:]
+		# Fit scaler on training data ONLY. Each row is weighted by how many training windows it appears in,
+		# which gives the same result as fitting on every training window stacked together
+		coverage = _coverage(starts[:split_idx], len(inp), LSTM_window_size)
 
-		# Transform with StandardScaler
+		# Fitted (and always used) on plain arrays with the columns in `valuations.numeric_values` order
 		scaler = StandardScaler()
-		
-		# Fit scaler on training data ONLY. Make sure to concatenate to remove sequences for fitting
-		scaler.fit(pd.concat(X_train, ignore_index=True))
+		scaler.fit(
+			inp[coverage > 0],
+			sample_weight=coverage[coverage > 0]
+		)
+
+		# Scale every row once, before creating windows
+		inp = scaler.transform(inp).astype(np.float32, copy=False)
+
+		# The output of each window is the expected return on its last day (2D, one value per window)
+		y = out[starts + LSTM_window_size - 1].reshape(-1, 1)
+
+		return {'inp': inp, 'starts': starts, 'y': y, 'split_idx': np.array([split_idx])}, scaler
+
+	def training_arrays(
+		self,
+		LSTM_window_size: int,
+		split_size: float = 0.6,
+		cache: bool = False,
+		cache_entries: int = 4,
+		fingerprint: str = None
+	):
+		'''
+		Returns a tuple of `(arrays, scaler)`, where arrays is a dict of:
+
+		- "inp": Every company's scaled rows, `[rows, features]` float32
+		- "starts": The first row of every window (train windows first, then test windows)
+		- "y": The output of every window, `[windows, 1]` float32
+		- "split_idx": A one item array, the number of train windows
+
+		:param cache: Load the arrays from (or save them to) the on-disk cache, defaults to False
+		:type cache: bool
+		:param cache_entries: How many sets of arrays the cache keeps, defaults to 4
+		:type cache_entries: int
+		:param fingerprint: The stock data's `fingerprint`, if it is already known (saves hashing the source files again)
+		:type fingerprint: str
+		'''
+		if not cache:
+			return self._build_arrays(LSTM_window_size, split_size)
+
+		tensor_cache = tensorcache.TensorCache(max_entries=cache_entries)
+		fingerprint = self.fingerprint() if fingerprint is None else fingerprint
+		key = tensorcache.TensorCache.key(fingerprint, LSTM_window_size, split_size, _PREPROCESSING_VERSION)
+
+		cached = tensor_cache.load(key)
+		if cached is not None:
+			return cached
+
+		arrays, scaler = self._build_arrays(LSTM_window_size, split_size)
+		tensor_cache.save(key, arrays, scaler)
+
+		return arrays, scaler
+
+	def train_test_split(self, LSTM_window_size: int, batch_size, split_size: int = 0.6, cache: bool = False):
+		'''
+		Uses `sklearn.preprocessing.StandardScaler` to standardize stock data
+
+		:param LSTM_window_size: The size of the "window" **in days**. A size of 3 would equal 3 days long
+
+		:param batch_size: The batch size the dataloaders will use, defaults to 8
+		:type batch_size: int
+
+		:param split_size: What % of the data will be in the **train** dataset, defaults to 0.6 (60%)
+		:type split_size: int
+
+		:param cache: Reuse the arrays from the last run if the stock data has not changed (see `training_arrays`), defaults to False
+		:type cache: bool
+		'''
+		arrays, scaler = self.training_arrays(LSTM_window_size, split_size, cache)
+		split_idx = int(arrays['split_idx'][0])
 
-		# Transform X_train and X_test using the scaler, this will convert our list of dataframes to a list of numpy arrays
-		X_train = [scaler.transform(df) for df in X_train]
-		X_test = [scaler.transform(df) for df in X_test]
+		# Windows are created on demand from the scaled rows, so each row is only stored once
+		inp, starts, y = from_numpy(arrays['inp']), from_numpy(arrays['starts']), from_numpy(arrays['y'])
 
 		# Save our scaler for inference later on
 		with open('StockNet/scaler', 'wb') as f:
@@ -154,76 +646,303 @@ class StockDataManager:
 
 		# Now, convert our training and testing data into dataloaders for model training
 		train_dataloader = DataLoader(
-			StockNetDataset(
-				from_numpy(array(X_train)),
-				from_numpy(y_train)
+			ml.StockNetWindowDataset(
+				inp,
+				starts[:split_idx],
+				y[:split_idx],
+				LSTM_window_size
 			),
 			batch_size=batch_size,
-			shuffle=True
+			shuffle=True,
+			collate_fn=ml.collate_windows
 		)
 
 		test_dataloader = DataLoader(
-			StockNetDataset(
-				from_numpy(array(X_test)),
-				from_numpy(y_test)
+			ml.StockNetWindowDataset(
+				inp,
+				starts[split_idx:],
+				y[split_idx:],
+				LSTM_window_size
 			),
 			batch_size=batch_size,
-			shuffle=False # We want validation to be the same for each epoch
+			shuffle=False, # We want validation to be the same for each epoch
+			collate_fn=ml.collate_windows
 		)
 
 		# Return the train/test split
 		return train_dataloader, test_dataloader
 	
-	def get_ticker_data(self, ticker: str):
+	def streaming_split(
+		self,
+		LSTM_window_size: int,
+		batch_size,
+		split_size: float = 0.6,
+		windows_per_shard: int = 65536,
+		buffer_size: int = 8192,
+		workers: int = 0,
+		rows_per_read: int = 100_000
+	):
 		'''
-		Returns a formatted dataframe of the stock data for a particular ticker
+		Same as `train_test_split`, but the dataloaders stream windows from memory mapped shards on disk (see `shards.ShardedWindowDataset`)
+
+		Shards are keyed the same way as the `training_arrays` cache, so they are only written when the stock data changes,
+		and later runs never load the stock data at all. Except with the "csv" backend, they are written from groups of
+		whole tickers of at most `rows_per_read` rows (see `_write_shards`), so the stock data is never loaded all at once
+
+		:param windows_per_shard: How many windows are stored in each shard, defaults to 65536
+		:type windows_per_shard: int
+		:param buffer_size: How many windows the shuffle buffer holds, defaults to 8192
+		:type buffer_size: int
+		:param workers: How many DataLoader worker processes read shards, defaults to 0 (read in the main process)
+		:type workers: int
+		:param rows_per_read: The most rows of stock data loaded at once while the shards are written, defaults to 100000
+		:type rows_per_read: int
+		'''
+		key = tensorcache.TensorCache.key(self.fingerprint(), LSTM_window_size, split_size, _PREPROCESSING_VERSION)
+		path = os.path.join(_shards_path, key)
 
-		:param ticker: The company's ticker symbol
-		:type ticker: str
+		if not os.path.exists(os.path.join(path, 'scaler')):
+			# CSV files can not be read one group of tickers at a time, so they are cleaned all at once
+			if self.backend == 'csv':
+				arrays, scaler = self._build_arrays(LSTM_window_size, split_size)
+				shards.write_shards(path, arrays, scaler, LSTM_window_size, windows_per_shard)
+
+			else:
+				self._write_shards(path, LSTM_window_size, split_size, windows_per_shard, rows_per_read)
+
+			# Only keep the shards of the current stock data
+			for entry in os.listdir(_shards_path):
+				if entry != key and not entry.startswith('.'):
+					shutil.rmtree(os.path.join(_shards_path, entry), ignore_errors=True)
+
+		# Save our scaler for inference later on
+		with open('StockNet/scaler', 'wb') as f:
+			pickle.dump(shards.load_scaler(path), f)
+
+		train_dataloader = DataLoader(
+			shards.ShardedWindowDataset(os.path.join(path, 'train'), shuffle=True, buffer_size=buffer_size),
+			batch_size=batch_size,
+			num_workers=workers
+		)
+
+		test_dataloader = DataLoader(
+			shards.ShardedWindowDataset(os.path.join(path, 'test'), shuffle=False), # We want validation to be the same for each epoch
+			batch_size=batch_size,
+			num_workers=workers
+		)
+
+		return train_dataloader, test_dataloader
+
+	def _ticker_counts(self):
 		'''
-		# Use default stock data
-		stockdata = self.stockdata
+		Returns a DataFrame with the number of rows ("rows") of every ticker, in the order `prepare` groups them in
+		'''
+		if self.backend in ['parquet', 'feather']:
+			return _columnar_store(self.backend).ticker_counts(self.tickers, self.start, self.end)
 
-		# Drop unnecessary columns (do this here so if the stock data is custom, there isn't any error when dropping columns)
-		stockdata = stockdata.drop(['id', 'industry', 'sector', 'news'], axis=1)
+		if self.backend == 'sqlite':
+			return _open_database().ticker_counts(self.tickers, self.start, self.end)
 
-		# For each ticker, format its data
-		stockdata_formatted = []
+		raise errors.error('datamanager.py', f'Can not count the rows of each ticker with the "{self.backend}" backend')
 
-		# Pull data for specific ticker
-		df = stockdata.loc[stockdata['ticker'] == ticker].copy()
+	def _write_shards(self, path: str, LSTM_window_size: int, split_size: float, windows_per_shard: int, rows_per_read: int):
+		'''
+		Writes the same shards as `shards.write_shards` does with the arrays from `training_arrays`, but only ever loads
+		one group of tickers (at most `rows_per_read` rows, unless a single ticker has more) at a time
 
-		# Get the dates
-		dates = df['date']
+		Every group is read twice: once to fit the scaler (with `StandardScaler.partial_fit`, weighting each row by how
+		many training windows it appears in, the same as `_build_arrays`), and once to scale it and write its windows
+		'''
+		counts = self._ticker_counts()
+
+		# Every ticker has one window per row, except for the last row and the rows of its first window
+		windows = np.maximum(counts['rows'].to_numpy() - LSTM_window_size, 0)
+
+		if windows.sum() == 0:
+			raise errors.error('datamanager.py', f'No company has more than {LSTM_window_size} days of stock data')
+
+		# Windows are numbered in the same order as `_windows`, so the train/test split matches `_build_arrays`
+		split_idx = int(windows.sum() * split_size)
+		first_window = np.concatenate([[0], np.cumsum(windows)[:-1]])
+
+		# Split tickers with windows into groups of whole tickers
+		groups = []
+		rows = 0
+
+		for ticker, ticker_rows, ticker_windows, first in zip(counts['ticker'], counts['rows'], windows, first_window):
+			if ticker_windows == 0:
+				continue
+
+			if len(groups) == 0 or rows + ticker_rows > rows_per_read:
+				groups.append(([], first))
+				rows = 0
+
+			groups[-1][0].append(ticker)
+			rows += ticker_rows
+
+		def load(tickers: list, first: int):
+			'''
+			Returns the windows of one group (see `_windows`), and which of them are training windows
+			'''
+			group = StockDataManager(self.backend, tickers=tickers, start=self.start, end=self.end, compact=self.compact)
+			prepared, features, starts = group._windows(LSTM_window_size)
+
+			return prepared, features, starts, first + np.arange(len(starts)) < split_idx
+
+		scaler = StandardScaler()
+
+		for tickers, first in groups:
+			prepared, features, starts, train = load(tickers, first)
+			coverage = _coverage(starts[train], len(prepared), LSTM_window_size)
+
+			if coverage.any():
+				scaler.partial_fit(
+					prepared[features].to_numpy(dtype=np.float32)[coverage > 0],
+					sample_weight=coverage[coverage > 0]
+				)
+
+		writer = shards.ShardWriter(path, LSTM_window_size, windows_per_shard)
 
-		# Drop more columns
-		df = df.drop(['date'], axis=1)
-		df = df.drop(['ticker'], axis=1)
+		for tickers, first in groups:
+			prepared, features, starts, train = load(tickers, first)
 
-		# Process numeric columns individually
-		for col in df.columns:
+			inp = scaler.transform(prepared[features].to_numpy(dtype=np.float32)).astype(np.float32, copy=False)
+			y = prepared['expectedReturn'].to_numpy(dtype=np.float32)[starts + LSTM_window_size - 1].reshape(-1, 1)
 
-			# Fix missing data
-			df[col] = df[col].interpolate(method='linear')
-			df[col] = df[col].ffill()
-			df[col] = df[col].fillna(0)
+			writer.add('train', inp, starts[train], y[train])
+			writer.add('test', inp, starts[~train], y[~train])
 
-		# Append formatted data, removing the last row as it is not usefull
-		stockdata_formatted.append(df.drop(df.tail(1).index))
+		writer.close(scaler)
+
+	def last_date(self):
+		'''
+		Returns the newest date in the stock data (as a "YYYY-MM-DD" string), without loading all of it when possible
+		'''
+		if self._stockdata is None:
+			if self.backend in ['parquet', 'feather']:
+				dates = [date for date in _columnar_store(self.backend).dates() if self.end is None or date <= str(self.end)]
+				return dates[-1] if len(dates) != 0 else None
+
+			if self.backend == 'sqlite' and self.tickers is None and self.end is None:
+				return _open_database().last_date()
+
+			# Only parse the date column
+			if self.backend == 'csv' and self.tickers is None and self.end is None:
+				dates = pd.read_csv('stockdata/stockdata.csv', usecols=['date'])['date']
+				return str(dates.max()) if len(dates) != 0 else None
+
+		if len(self.stockdata) == 0:
+			return None
+
+		return str(self.stockdata['date'].max())
+
+	def incremental_split(
+		self,
+		LSTM_window_size: int,
+		batch_size,
+		since: str,
+		scaler,
+		replay_windows: int = 4096,
+		validation_size: float = 0.2,
+		seed: int = None
+	):
+		'''
+		Creates dataloaders for fine-tuning `StockNet` on stock data collected since it was last trained
+
+		Returns a tuple of `(train_dataloader, validation_dataloader, new, replayed)`. The windows used are every window
+		whose last day is on or after `since` (the windows that had no expected return yet when the model was last
+		trained), plus a random sample of at most `replay_windows` older windows, so the model does not forget older
+		data. A random `validation_size` share of them is held out for the validation dataloader
+
+		Only the loaded stock data is used, so load it with a `start` date shortly before `since` to keep the cost bounded
+
+		:param since: The newest date in the stock data the model was last trained on
+		:type since: str
+		:param scaler: The scaler the model was trained with (the scaler is not refitted)
+		:type scaler: StandardScaler
+		:param replay_windows: The most older windows to mix in, defaults to 4096
+		:type replay_windows: int
+		:param validation_size: What % of the windows are held out for validation, defaults to 0.2 (20%)
+		:type validation_size: float
+		'''
+		prepared, features, starts = self._windows(LSTM_window_size)
+
+		# Scale with the model's scaler, so new rows look like the rows it was trained on
+		inp = scaler.transform(prepared[features].to_numpy(dtype=np.float32)).astype(np.float32, copy=False)
+		out = prepared['expectedReturn'].to_numpy(dtype=np.float32)
+		dates = prepared['date'].astype(str).to_numpy()
+
+		# Windows are new if their last day is on or after `since`, everything else can be replayed
+		new = dates[starts + LSTM_window_size - 1] >= str(since)
+
+		generator = np.random.default_rng(seed)
+
+		older = np.flatnonzero(~new)
+		replayed = generator.choice(older, size=min(replay_windows, len(older)), replace=False)
+
+		# Hold out a random share of the windows for validation
+		starts = generator.permutation(np.concatenate([starts[new], starts[replayed]]))
+		split_idx = len(starts) - int(len(starts) * validation_size)
+
+		inp = from_numpy(inp)
+		dataloaders = []
+
+		for window_starts, shuffle in [(np.sort(starts[:split_idx]), True), (np.sort(starts[split_idx:]), False)]:
+			dataloaders.append(DataLoader(
+				ml.StockNetWindowDataset(
+					inp,
+					from_numpy(window_starts),
+					from_numpy(out[window_starts + LSTM_window_size - 1].reshape(-1, 1)),
+					LSTM_window_size
+				),
+				batch_size=batch_size,
+				shuffle=shuffle,
+				collate_fn=ml.collate_windows
+			))
+
+		return dataloaders[0], dataloaders[1], int(new.sum()), len(replayed)
+
+	def prepared(self):
+		'''
+		Returns the cleaned stock data of every ticker (see `prepare`), which is only created once
+		'''
+		if self._prepared is None:
+			self._prepared = prepare(self.stockdata, self.carried())
+
+			# Row numbers of each ticker, so a ticker's data can be found without scanning every row
+			self._ticker_rows = self._prepared.groupby('ticker', sort=False, observed=True).indices
+
+		return self._prepared
+
+	def get_ticker_data(self, ticker: str):
+		'''
+		Returns a formatted dataframe of the stock data for a particular ticker
+
+		:param ticker: The company's ticker symbol
+		:type ticker: str
+		'''
+		# Pull the cleaned data for specific ticker
+		prepared = self.prepared()
+		df = prepared.iloc[self._ticker_rows.get(ticker, [])]
+
+		# Get the dates
+		dates = df['date']
 
-		# Concatenate formatted stock data
-		stockdata_formatted_concat = pd.concat(stockdata_formatted)
+		# Drop more columns, and remove the last row as it is not usefull
+		df = df[[value for value in valuations.numeric_values if value in df.columns]]
+		df = df.iloc[:-1]
 		
-		# Load scaler from our training data
-		with open('StockNet/scaler', 'rb') as f:
-			scaler = pickle.load(f)
+		# Load scaler from our training data (only once)
+		if self._scaler is None:
+			with open('StockNet/scaler', 'rb') as f:
+				self._scaler = pickle.load(f)
 
 		# Fit scaler on stock data
 		stockdata_formatted_scaled = pd.DataFrame(
-			scaler.transform(stockdata_formatted_concat),
-			columns=stockdata_formatted_concat.columns,
-			index=stockdata_formatted_concat.index
+			self._scaler.transform(df.to_numpy(dtype=np.float32)),
+			columns=df.columns,
+			index=df.index
 		)
 
 		# Return scaled data
-		return dates, stockdata_formatted_scaled
\ No newline at end of file
+		return dates, stockdata_formatted_scaled
@@ -0,0 +1,134 @@
+'''
+# extract
+
+Pulls the main text out of a news article's HTML (using `lxml`), and trims it
+to fit a character budget before it is sent to the LLM
+'''
+import re
+
+import lxml.html
+import lxml.etree
+
+# Elements that never contain article text
+_BOILERPLATE_TAGS = [
+	'script', 'style', 'noscript', 'template', 'nav', 'header', 'footer',
+	'aside', 'form', 'iframe', 'svg', 'button', 'select', 'figure'
+]
+
+# Class/id names used by ads, share buttons, newsletter sign ups, related stories, etc.
+_BOILERPLATE_NAMES = (
+	r'(^|[\s_-])(ad|ads|advert\w*|promo\w*|sponsor\w*|newsletter\w*|subscribe\w*|related|recommend\w*|'
+	r'cookie\w*|consent|share|sharing|social|comments?|disclaimer|caas-da|byline|breadcrumb\w*)($|[\s_-])'
+)
+
+_EXSLT_REGEX = {'re': 'http://exslt.org/regular-expressions'}
+
+# Words removed from the end of company names before they are searched for (ex: "APPLE INC" -> "APPLE")
+_NAME_SUFFIXES = {
+	'INC', 'INC.', 'CORP', 'CORP.', 'CORPORATION', 'CO', 'CO.', 'COMPANY', 'LTD', 'LTD.', 'PLC', 'LLC',
+	'LP', 'NV', 'SA', 'AG', 'HOLDINGS', 'HOLDING', 'GROUP', 'CLASS', 'CL', 'A', 'B', 'C', '&', 'THE'
+}
+
+def extract_article(html: str):
+	'''
+	Returns the main text of a news article, one paragraph per line
+
+	Boilerplate (navigation, ads, share buttons, ...) is removed first, then the paragraphs of the
+	element that holds the most paragraph text (usually the article body) are returned
+	'''
+	try:
+		document = lxml.html.fromstring(html)
+
+	except ValueError:
+		# lxml refuses strings that declare their own encoding, so hand it bytes instead
+		try:
+			document = lxml.html.fromstring(html.encode('utf-8'))
+		except (lxml.etree.ParserError, ValueError):
+			return ''
+
+	except lxml.etree.ParserError:
+		# Empty or unparsable page
+		return ''
+
+	# Remove elements that are never a part of the article
+	for element in document.xpath('|'.join(f'//{tag}' for tag in _BOILERPLATE_TAGS)):
+		element.drop_tree()
+
+	for element in document.xpath(
+		f"//*[re:test(@class, '{_BOILERPLATE_NAMES}', 'i') or re:test(@id, '{_BOILERPLATE_NAMES}', 'i')]",
+		namespaces=_EXSLT_REGEX
+	):
+		# The root element can not be dropped
+		if element.getparent() is not None:
+			element.drop_tree()
+
+	# Score each element by how much paragraph text it directly contains
+	paragraphs = document.xpath('//p')
+	scores = {}
+
+	for paragraph in paragraphs:
+		parent = paragraph.getparent()
+		scores[parent] = scores.get(parent, 0) + len(paragraph.text_content())
+
+	if len(scores) == 0:
+		return ''
+
+	# Prefer <article> elements, as they almost always wrap the story itself
+	articles = [element for element in scores if element.tag == 'article' or len(element.xpath('ancestor::article')) != 0]
+	body = max(articles if len(articles) != 0 else scores, key=scores.get)
+
+	# Collapse whitespace in each paragraph, skipping empty ones
+	text = [' '.join(paragraph.text_content().split()) for paragraph in body.iter('p')]
+
+	return '\n'.join(paragraph for paragraph in text if len(paragraph) != 0)
+
+def name_keywords(name: str):
+	'''
+	Returns the words used to find a company in an article from its full name (ex: "APPLE INC" -> "APPLE")
+	'''
+	words = name.upper().replace(',', ' ').split()
+
+	while len(words) > 1 and words[-1] in _NAME_SUFFIXES:
+		words.pop()
+
+	return ' '.join(words)
+
+def fit_budget(text: str, keywords: list, max_characters: int, names: list = None):
+	'''
+	Trims text from `extract_article` to at most `max_characters` characters
+
+	Paragraphs that mention one of `keywords` (ex: the ticker) or `names` (ex: the company name from `name_keywords`)
+	are kept first, then the rest are kept in order while they fit. Paragraphs stay in their original order
+
+	Keywords are matched with their exact case, as tickers like "ON", "A" or "IT" are also ordinary words. Names are
+	matched ignoring case
+	'''
+	if max_characters is None or len(text) <= max_characters:
+		return text
+
+	paragraphs = text.split('\n')
+
+	# Match keywords and names as whole words, only ignoring the case of names
+	alternatives = [re.escape(keyword) for keyword in keywords if keyword]
+	alternatives += [f'(?i:{re.escape(name)})' for name in (names or []) if name]
+	pattern = re.compile(r'\b(' + '|'.join(alternatives) + r')\b') if len(alternatives) != 0 else None
+
+	relevant = [i for i, paragraph in enumerate(paragraphs) if pattern is not None and pattern.search(paragraph)]
+	others = sorted(set(range(len(paragraphs))) - set(relevant))
+
+	kept = []
+	used = 0
+
+	for i in relevant + others:
+		# Count the newline that joins paragraphs together
+		size = len(paragraphs[i]) + (1 if len(kept) != 0 else 0)
+
+		if used + size <= max_characters:
+			kept.append(i)
+			used += size
+
+	# If not even one paragraph fits, cut the most relevant one short
+	if len(kept) == 0:
+		return paragraphs[(relevant + others)[0]][:max_characters]
+
+	return '\n'.join(paragraphs[i] for i in sorted(kept))
@@ -0,0 +1,196 @@
+'''
+# inference
+
+Predicts the next day's expected return of every ticker at once with `StockNet`,
+and exports `StockNet` to TorchScript (optionally int8 quantized) for fast CPU inference
+'''
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+
+from . import ml
+from . import valuations
+from . import errors
+from .datamanager import prepare
+
+def load_model(path: str = 'StockNet/model'):
+	'''
+	Loads a saved `StockNet`, reading its sizes from the saved weights (so models from `sweep.py` load too)
+	'''
+	state = torch.load(path, weights_only=True)
+
+	num_layers = len([name for name in state if name.startswith('lstm.weight_ih_l')])
+	hidden_size, input_size = state['lstm.weight_ih_l0'].shape
+
+	model = ml.StockNet(input_size=input_size, hidden_size=hidden_size // 4, num_layers=num_layers)
+	model.load_state_dict(state)
+
+	return model
+
+def export_model(model: torch.nn.Module, path: str, window_size: int, quantize: bool = False):
+	'''
+	Saves `model` as a TorchScript artifact at `path` (written to a temporary file then renamed), returns the exported module
+
+	:param quantize: Quantize the weights of the LSTM and Linear layers to int8 (activations stay float), defaults to False
+	:type quantize: bool
+	'''
+	model.eval()
+
+	if quantize:
+		model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.LSTM, torch.nn.Linear}, dtype=torch.qint8)
+
+	example = torch.zeros(1, window_size, model.lstm.input_size)
+
+	with torch.inference_mode():
+		try:
+			exported = torch.jit.script(model)
+
+		except Exception:
+			# Some quantized modules can only be traced
+			exported = torch.jit.trace(model, example)
+
+	# Fold the weights into the graph, so there is nothing left to build when it is loaded
+	try:
+		exported = torch.jit.freeze(exported)
+	except Exception:
+		pass
+
+	temporary_path = f'{path}.tmp'
+
+	try:
+		torch.jit.save(exported, temporary_path)
+		os.replace(temporary_path, path)
+
+	except OSError as e:
+		raise errors.error('inference.py', f'Could not save exported model to {path}', e)
+
+	return exported
+
+def compare_models(reference, candidate, windows: torch.Tensor):
+	'''
+	Returns a dict with the largest and average absolute difference between the predictions of two models on `windows`,
+	and the "scale" (standard deviation) of the reference model's predictions, so differences can be judged relative to it
+	'''
+	with torch.inference_mode():
+		predictions = reference(windows)
+		difference = (predictions - candidate(windows)).abs()
+
+	return {
+		'max_difference': difference.max().item(),
+		'mean_difference': difference.mean().item(),
+		'scale': predictions.std().item() if len(predictions) > 1 else predictions.abs().max().item()
+	}
+
+def measure_latency(model, windows: torch.Tensor, repeats: int = 50):
+	'''
+	Returns the median time (in milliseconds) `model` takes to predict `windows`
+	'''
+	times = []
+
+	with torch.inference_mode():
+		# Warm up (the first calls of a TorchScript module also optimize it)
+		for _ in range(3):
+			model(windows)
+
+		for _ in range(repeats):
+			start = time.perf_counter()
+			model(windows)
+			times.append((time.perf_counter() - start) * 1000)
+
+	return float(np.median(times))
+
+class Predictor:
+	'''
+	# Predictor
+
+	Loads `StockNet` and its scaler once, then predicts the expected return of every ticker with one batched forward pass
+
+	:param window_size: How many days `StockNet` looks at (the `LSTM_WINDOW_SIZE` it was trained with)
+	:type window_size: int
+	:param model_path: The saved model, defaults to "StockNet/model"
+	:type model_path: str
+	:param scaler_path: The scaler saved while training, defaults to "StockNet/scaler"
+	:type scaler_path: str
+	:param artifact_path: A TorchScript artifact from `export_model`. If it exists it is used instead of `model_path`, defaults to "StockNet/model.pt"
+	:type artifact_path: str
+	'''
+	def __init__(
+		self,
+		window_size: int,
+		model_path: str = 'StockNet/model',
+		scaler_path: str = 'StockNet/scaler',
+		artifact_path: str = 'StockNet/model.pt'
+	):
+		self.window_size = window_size
+
+		try:
+			# The exported artifact loads without building StockNet, and runs without Python overhead (it is
+			# skipped if the model was saved after it was exported, so a stale artifact is never used)
+			if artifact_path is not None and os.path.exists(artifact_path) and (
+				not os.path.exists(model_path) or os.path.getmtime(artifact_path) >= os.path.getmtime(model_path)
+			):
+				self.model = torch.jit.load(artifact_path)
+			else:
+				self.model = load_model(model_path)
+
+			with open(scaler_path, 'rb') as f:
+				self.scaler = pickle.load(f)
+
+		except FileNotFoundError as e:
+			raise errors.error('inference.py', 'No StockNet model avaliable, run train.py first', e)
+
+		self.model.eval()
+
+	def windows(self, stockdata: pd.DataFrame, carried: pd.DataFrame = None):
+		'''
+		Returns a tuple of `(tickers, dates, windows)`: the latest `window_size` days of every ticker (scaled,
+		as one `[tickers, window_size, features]` float32 array) and the date of each window's last day
+
+		Tickers with less than `window_size` days of stock data are skipped. If `stockdata` only holds the newest
+		days, pass the values known before them as `carried` (see `StockDataManager.carried`), so missing
+		values are filled the same way as they were in training
+		'''
+		prepared = prepare(stockdata, carried)
+
+		# Keep the newest `window_size` rows of each ticker (rows stay grouped by ticker, in chronological order)
+		newest = prepared.groupby('ticker', sort=False, observed=True).cumcount(ascending=False) < self.window_size
+		prepared = prepared.loc[newest]
+
+		codes = pd.factorize(prepared['ticker'])[0]
+		prepared = prepared.loc[np.bincount(codes)[codes] == self.window_size]
+
+		if len(prepared) == 0:
+			raise errors.error('inference.py', f'No company has {self.window_size} days of stock data')
+
+		# The scaler was fitted on the numeric columns, in `valuations.numeric_values` order
+		features = [value for value in valuations.numeric_values if value in prepared.columns]
+
+		# Scale every row at once, then split the rows into one window per ticker
+		scaled = self.scaler.transform(prepared[features].to_numpy(dtype=np.float32)).astype(np.float32, copy=False)
+		windows = scaled.reshape(-1, self.window_size, len(features))
+
+		last_rows = prepared.iloc[self.window_size - 1 :: self.window_size]
+
+		return last_rows['ticker'].astype(str).to_numpy(), last_rows['date'].astype(str).to_numpy(), windows
+
+	def predict(self, stockdata: pd.DataFrame, carried: pd.DataFrame = None):
+		'''
+		Returns a DataFrame of every ticker's expected return for the day after its latest stock data, ranked from highest to lowest
+
+		:param stockdata: Stock data of every ticker to predict (only the newest `window_size` days of each are used)
+		:type stockdata: pd.DataFrame
+		:param carried: The values known before the first row of `stockdata` (see `windows`)
+		:type carried: pd.DataFrame
+		'''
+		tickers, dates, windows = self.windows(stockdata, carried)
+
+		with torch.inference_mode():
+			expected_returns = self.model(torch.from_numpy(windows)).numpy().reshape(-1)
+
+		predictions = pd.DataFrame({'ticker': tickers, 'date': dates, 'expectedReturn': expected_returns})
+
+		return predictions.sort_values('expectedReturn', ascending=False, ignore_index=True)
@@ -1,16 +1,27 @@
 import requests
-from bs4 import BeautifulSoup
+import requests.adapters
+
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
 
 from pandas import DataFrame
 import pandas_market_calendars as mcal
 
 import yfinance as yf
 import yfinance.exceptions
+from yfinance.data import YfData
 
 import datetime
 
 from . import valuations
 from . import errors
+from .ratelimit import TokenBucket
+from .cache import ArticleCache
+from . import extract
+
+# Yahoo Finance's quote endpoint, returns prices/volumes for many tickers at once
+_QUOTE_URL = 'https://query1.finance.yahoo.com/v7/finance/quote'
 
 def market_open():
 	'''
@@ -36,29 +47,90 @@ class YahooStockClient:
 	'''
 	# YahooStockClient
 	Uses the `yfinance` library to get market data for a stock trading AI
+
+	:param rate_limiter: A `TokenBucket` that every request to Yahoo Finance waits on, can be shared
+	between clients/threads so they stay under Yahoo's rate limit together. Defaults to no limit
+	:type rate_limiter: TokenBucket
+	:param article_workers: How many news articles are downloaded at the same time, defaults to 8
+	:type article_workers: int
+	:param connections_per_host: The most connections open to a single website at once, defaults to 4
+	:type connections_per_host: int
+	:param connect_timeout: Seconds to wait while connecting to a news website, defaults to 5
+	:type connect_timeout: float
+	:param read_timeout: Seconds to wait for a news website to send data, defaults to 10
+	:type read_timeout: float
+	:param max_article_bytes: Stop reading a news article after this many bytes, defaults to 2MB
+	:type max_article_bytes: int
+	:param article_cache: Stores the text of articles that were already scraped, defaults to no cache
+	:type article_cache: ArticleCache
+	:param max_article_characters: Trim each article's text to this many characters (keeping paragraphs
+	that mention the ticker or company first), defaults to no limit
+	:type max_article_characters: int
+	:param company_names: Maps tickers to company names (ex: `tickers.COMPANY_NAMES`), used to find relevant paragraphs
+	:type company_names: dict
 	'''
+	def __init__(
+		self,
+		rate_limiter: TokenBucket = None,
+		article_workers: int = 8,
+		connections_per_host: int = 4,
+		connect_timeout: float = 5,
+		read_timeout: float = 10,
+		max_article_bytes: int = 2_000_000,
+		article_cache: ArticleCache = None,
+		max_article_characters: int = None,
+		company_names: dict = None
+	):
+		self.rate_limiter = rate_limiter
+		self.article_cache = article_cache
+
+		self.max_article_characters = max_article_characters
+		self.company_names = {} if company_names is None else company_names
+
+		self.article_workers = article_workers
+		self.connections_per_host = connections_per_host
+		self.timeout = (connect_timeout, read_timeout)
+		self.max_article_bytes = max_article_bytes
+
+		# One session for every article, so connections to the same website are kept alive and reused
+		self.session = requests.Session()
+		self.session.headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36'
+
+		adapter = requests.adapters.HTTPAdapter(pool_connections=32, pool_maxsize=connections_per_host)
+		self.session.mount('http://', adapter)
+		self.session.mount('https://', adapter)
+
+		# Semaphores that limit how many requests are sent to each website at once
+		self._host_limits = {}
+		self._host_limits_lock = threading.Lock()
+
+	def _wait(self):
+		'''
+		Blocks until the rate limiter (if there is one) allows another request to Yahoo Finance
+		'''
+		if self.rate_limiter is not None:
+			self.rate_limiter.acquire()
 
-	def current(self, ticker: str, set_date = datetime.date.today()):
+	def _info(self, yf_ticker: yf.Ticker):
 		'''
-		Returns daily valuation metrics of a stock
-		
-		:param self:
-		:param ticker: The ticker symbol of the company
-		:type ticker: str
-		:param set_date: Defaults to the current date, can be manually set if needed
-		:type set_date: date
+		Returns the `info` dict of a `yfinance.Ticker`, waiting on the rate limiter first
 		'''
+		self._wait()
 
-		# Get info about the company
 		try:
-			info = yf.Ticker(ticker).info
+			return yf_ticker.info
 
-		except yfinance.exceptions.YFRateLimitError:
+		except yfinance.exceptions.YFRateLimitError as e:
 			raise errors.error('internet.py', 'Rate limiting implemented, try again', e)
 
 		except Exception as e:
 			raise errors.error('internet.py', 'Could not pull data', e)
 
+	def _valuations(self, ticker: str, info: dict, set_date):
+		'''
+		Picks the metrics in `valuations.yf_values` out of a `yfinance` info dict
+		'''
+
 		# Combine valuation metrics into a single dict
 		data = {}
 		data['ticker'] = ticker
@@ -73,19 +145,140 @@ class YahooStockClient:
 			try:
 				# Use `info.get(value, None)` so that if there is no data metric 
 				# for a specific ticker, it defaults to "None"
-				data[value] = [info.get(value, None)]
+				data[value] = info.get(value, None)
 
 			except Exception as e:
 				# Key error will usually mean the user did not enter the ticker/value name corectly
 				raise errors.error('internet.py', 'Unable to create price dict', e)
+
+		return data
+
+	def current(self, ticker: str, set_date = datetime.date.today()):
+		'''
+		Returns daily valuation metrics of a stock
+		
+		:param self:
+		:param ticker: The ticker symbol of the company
+		:type ticker: str
+		:param set_date: Defaults to the current date, can be manually set if needed
+		:type set_date: date
+		'''
+
+		# Get info about the company
+		info = self._info(yf.Ticker(ticker))
+
+		data = self._valuations(ticker, info, set_date)
 			
 		try:
-			data_df = DataFrame(data, index=None)
+			data_df = DataFrame([data], columns=list(data.keys()))
 		except Exception as e:
 			raise errors.error('internet.py', 'Unable to create price DataFrame', e)
 
 		return data_df
 
+	def _quotes(self, tickers: list):
+		'''
+		Returns a dict mapping each ticker (in upper case) to its fields from Yahoo's multi-symbol
+		quote endpoint, pulling every ticker in `tickers` with a single request
+		'''
+		self._wait()
+
+		try:
+			# `YfData` handles the cookie/crumb that Yahoo Finance requires
+			response = YfData().get_raw_json(_QUOTE_URL, params={'symbols': ','.join(ticker.upper() for ticker in tickers)})
+
+			return {quote['symbol']: quote for quote in response['quoteResponse']['result']}
+
+		except yfinance.exceptions.YFRateLimitError as e:
+			raise errors.error('internet.py', 'Rate limiting implemented, try again', e)
+
+		except Exception as e:
+			raise errors.error('internet.py', 'Could not pull quotes', e)
+
+	def _complete(self, ticker: str, data: dict, set_date):
+		'''
+		Fills in the metrics of `data` (a ticker's row from `_quotes`) that are only in the ticker's `info`.
+		If the quote endpoint did not return the ticker (`data` is "None"), every metric is taken from `info`
+		'''
+		info = self._info(yf.Ticker(ticker))
+
+		if data is None:
+			return self._valuations(ticker, info, set_date)
+
+		for value, _ in valuations.yf_values:
+			if value not in data:
+				data[value] = info.get(value, None)
+
+		return data
+
+	def current_batch(self, tickers: list, set_date = datetime.date.today(), chunk_size: int = 100, workers: int = 1):
+		'''
+		Returns daily valuation metrics for many stocks at once
+
+		Prices and volumes are pulled for `chunk_size` tickers per request from Yahoo's quote endpoint. Metrics
+		that only a ticker's `info` has (sector, beta, margins, ratios, ...) are still pulled one ticker at a time
+
+		Returns a tuple of `(data, failures)`, where `data` is a single DataFrame (one row per ticker, in
+		the same layout as `current`) and `failures` is a dict mapping each ticker that could not be
+		pulled to its `errors.error`. A failing ticker never stops the rest of the batch
+
+		:param tickers: The ticker symbols of the companies
+		:type tickers: list
+		:param set_date: Defaults to the current date, can be manually set if needed
+		:type set_date: date
+		:param chunk_size: How many tickers are pulled per quote request, defaults to 100
+		:type chunk_size: int
+		:param workers: How many tickers' `info` are pulled at once, defaults to 1
+		:type workers: int
+		'''
+		rows = {}
+
+		for start in range(0, len(tickers), chunk_size):
+			chunk = tickers[start : start + chunk_size]
+
+			try:
+				quotes = self._quotes(chunk)
+
+			except errors.error:
+				# Pull the whole chunk from `info` instead
+				quotes = {}
+
+			for ticker in chunk:
+				quote = quotes.get(ticker.upper())
+
+				if quote is None:
+					rows[ticker] = None
+					continue
+
+				data = {'ticker': ticker, 'date': str(set_date)}
+
+				for value, name in valuations.quote_values.items():
+					data[value] = quote.get(name, None)
+
+				rows[ticker] = data
+
+		failures = {}
+
+		def complete(ticker):
+			try:
+				return self._complete(ticker, rows[ticker], set_date)
+
+			except errors.error as e:
+				failures[ticker] = e
+
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+			completed = [data for data in executor.map(complete, tickers) if data is not None]
+
+		# Build one DataFrame for the whole batch, using `current`'s column layout even if every ticker failed
+		columns = ['ticker', 'date'] + [value for value, _ in valuations.yf_values if value not in ['ticker', 'date', 'id']]
+
+		try:
+			data_df = DataFrame(completed, columns=columns)
+		except Exception as e:
+			raise errors.error('internet.py', 'Unable to create price DataFrame', e)
+
+		return data_df, failures
+
 	def scrape_from_yf(self, ticker: str):
 		'''
 		Scrapes websites provided by `yfinance` and returns a list of 
@@ -93,22 +286,16 @@ class YahooStockClient:
 		'''
 
 		# Search the news on yfinance
+		self._wait()
+
 		try:
 			yf_news = yf.Search(ticker, news_count=3).news
 
-		except Exception as e:
-			raise errors.error('internet.py', 'Could not pull news data', e)
-
-		except yfinance.exceptions.YFRateLimitError:
+		except yfinance.exceptions.YFRateLimitError as e:
 			raise errors.error('internet.py', 'Rate limiting implemented, try again', e)
 
-		# Make a list to store each scraped site
-		scraped_sites = []
-
-		# User-Agent headers
-		headers = {
-			'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36'
-		}
+		except Exception as e:
+			raise errors.error('internet.py', 'Could not pull news data', e)
 
 		# Fetch historical news
 		try:
@@ -117,55 +304,144 @@ class YahooStockClient:
 		except Exception as e:
 			raise errors.error('internet.py', f'Could not create DataFrame for {ticker} from news source', e)
 
-		# Get the html content of each webpage
-		for i in range(len(news_data)):
+		# Get the html content of every webpage at the same time
+		with ThreadPoolExecutor(max_workers=self.article_workers) as executor:
+			scraped_sites = executor.map(
+				lambda i: self._scrape_article(ticker, news_data['title'][i], news_data['link'][i]),
+				range(len(news_data))
+			)
 
-			# Fetch the website data
-			try:
-				data = requests.get(news_data['link'][i],
-					allow_redirects=True,
-					headers=headers
-				)
-			except:
-				# No need to return error if site was unable to be reached, only
-				# return error if no data was able to be pulled at all
-				data = None
-
-			# Verfiy that the site was cleanly retreived
-			if data == None:
-				pass
-			elif data.status_code == 200:
-				
-				# Get the HTML content
-				data = data.text
-
-				# Parse the HTML content
-				soup = BeautifulSoup(data, 'html.parser')
-
-				# Attempt 1: Extract data from "<p>" tag
-				# NOTE: 'yf-1pe5jgt' is a class where most text can be found on some articles
-				news_content = ''
-				for content in soup.find_all('p'):
-					news_content += (content.text + ' ')
-
-				# If the data scraped from the site is not empty, create a
-				# "NewsWebPage" object and store the site information
-				if len(news_content) != 0 or news_content is not None:
-					
-					scraped_sites.append(
-						NewsWebPage(
-							ticker,
-							news_data['title'][i],
-							news_content,
-						)
-					)
+			# Remove sites that could not be scraped
+			scraped_sites = [site for site in scraped_sites if site is not None]
 
 		# Return the scraped sites only if there are enough "NewsWabPage" objects
 		if len(scraped_sites) == 0:
-			raise errors.error('internet.py', 'Could not pull sufficient news data', e)
+			raise errors.error('internet.py', 'Could not pull sufficient news data')
 		
 		return scraped_sites
 
+	def _host_limit(self, url: str):
+		'''
+		Returns the semaphore that limits how many requests are sent to `url`'s website at once
+		'''
+		host = urlparse(url).netloc
+
+		with self._host_limits_lock:
+			if host not in self._host_limits:
+				self._host_limits[host] = threading.BoundedSemaphore(self.connections_per_host)
+
+			return self._host_limits[host]
+
+	def _fetch_article(self, url: str, cached = None):
+		'''
+		Downloads the HTML of a news article
+
+		Returns a tuple of `(status_code, html, etag, last_modified)`, or "None" if the site could not be
+		reached. If a `CachedArticle` is passed, the request is conditional, and a 304 status means it is unchanged
+
+		The response is streamed, and reading stops after `max_article_bytes` bytes
+		'''
+		headers = {}
+
+		# Ask the website to only send the article if it changed since we cached it
+		if cached is not None:
+			if cached.etag is not None:
+				headers['If-None-Match'] = cached.etag
+			if cached.last_modified is not None:
+				headers['If-Modified-Since'] = cached.last_modified
+
+		with self._host_limit(url):
+			try:
+				with self.session.get(url, allow_redirects=True, headers=headers, timeout=self.timeout, stream=True) as response:
+
+					# Verfiy that the site was cleanly retreived
+					if response.status_code != 200:
+						return response.status_code, None, None, None
+
+					content = bytearray()
+
+					for chunk in response.iter_content(chunk_size=65536):
+						content += chunk
+
+						# Stop once we have enough of the page
+						if len(content) >= self.max_article_bytes:
+							break
+
+					return (
+						response.status_code,
+						bytes(content[:self.max_article_bytes]).decode(response.encoding or 'utf-8', errors='replace'),
+						response.headers.get('ETag'),
+						response.headers.get('Last-Modified')
+					)
+
+			except Exception:
+				# No need to return error if site was unable to be reached, only
+				# return error if no data was able to be pulled at all
+				return None
+
+	def _news_web_page(self, ticker: str, title: str, content: str, url: str):
+		'''
+		Creates a `NewsWebPage` from an article's extracted text, trimmed to `max_article_characters`.
+		Returns "None" if the article has no text
+		'''
+		if len(content) == 0:
+			return None
+
+		# Keep paragraphs that mention the ticker or the company first
+		names = []
+		if ticker in self.company_names:
+			names.append(extract.name_keywords(self.company_names[ticker]))
+
+		return NewsWebPage(ticker, title, extract.fit_budget(content, [ticker], self.max_article_characters, names), url)
+
+	def _scrape_article(self, ticker: str, title: str, url: str):
+		'''
+		Downloads and parses a news article, returns a `NewsWebPage` or "None" if it could not be scraped
+
+		Articles in `article_cache` are only downloaded again once they are stale, and only if they changed
+		'''
+		if self.article_cache is None:
+			return self._download_article(ticker, title, url, None)
+
+		# Threads that need the same article wait for the first one to cache it, instead of downloading it again
+		with self.article_cache.claim(url):
+			return self._download_article(ticker, title, url, self.article_cache.get(url))
+
+	def _download_article(self, ticker: str, title: str, url: str, cached):
+		'''
+		Same as `_scrape_article`, where `cached` is the article's `CachedArticle` ("None" if it is not cached)
+		'''
+
+		# Use the cached text without making a request at all
+		if cached is not None and cached.fresh:
+			return self._news_web_page(ticker, title, cached.content, url)
+
+		response = self._fetch_article(url, cached)
+
+		if response is None:
+			return None
+
+		status_code, data, etag, last_modified = response
+
+		# The article has not changed since it was cached
+		if status_code == 304 and cached is not None:
+			self.article_cache.refresh(url)
+
+			return self._news_web_page(ticker, title, cached.content, url)
+
+		if data is None:
+			return None
+
+		# Extract the article's main text (without navigation, ads, etc.)
+		news_content = extract.extract_article(data)
+
+		# Cache the full text (even if it is empty, so the page is not parsed again). The
+		# character budget is applied afterwards, as it depends on which ticker the article is for
+		if self.article_cache is not None:
+			self.article_cache.put(url, news_content, etag, last_modified)
+
+		return self._news_web_page(ticker, title, news_content, url)
+
 class NewsWebPage:
 		'''
 		# NewsWebPage
@@ -175,9 +451,11 @@ class NewsWebPage:
 		**NOTE:** This class is used in `NewsWebScraper`, so there is no need to 
 		contruct objects using this class manually
 		'''
-		def __init__(self, ticker: str, title: str, content: str):
+		def __init__(self, ticker: str, title: str, content: str, url: str = None):
 			self.ticker = ticker # The company ticker that the web page is talking about
 
 			self.title = title # Title of the news article
 
-			self.content = content # The content in the news article
\ No newline at end of file
+			self.content = content # The content in the news article
+
+			self.url = url # Where the news article was downloaded from
\ No newline at end of file
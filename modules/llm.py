@@ -1,19 +1,91 @@
 from datetime import datetime
+import asyncio
+import json
 
 import ollama
 
 from httpx import ConnectError
 
 from .internet import NewsWebPage
+from .cache import SentimentCache
 from . import errors
 
+# System prompt used by the structured sentiment mode. It never changes between articles,
+# so ollama can reuse its cached prompt processing for every request
+_SENTIMENT_SYSTEM_PROMPT = '''
+You rate the sentiment of news articles about a company's stock.
+
+Step 1: Read the article
+Step 2: Ignore any parts of the article that do not provide insight into the stock (things like advertisements)
+Step 3: Identify what parts of the article convey an opinion about the stock
+Step 4: On a scale of 1-10, rate the average "sentiment" of those opinions (1 is very negative, 10 is very positive)
+
+Sometimes the article may not talk about the stock directly, but may give information that could have impacts on the stock price. Try to use as much info as possible to rate the sentiment 1-10.
+If there is not enough information in the article to rate the sentiment, answer "NONE".
+
+Answer with JSON only, in the form {"sentiment": <1-10 or "NONE">}
+'''
+
+# System prompt used to score one article for several stocks at once
+_MULTI_SENTIMENT_SYSTEM_PROMPT = '''
+You rate the sentiment of news articles about several companies' stocks at once.
+
+For each stock you are given:
+Step 1: Read the article
+Step 2: Ignore any parts of the article that do not provide insight into that stock (things like advertisements)
+Step 3: Identify what parts of the article convey an opinion about that stock
+Step 4: On a scale of 1-10, rate the average "sentiment" of those opinions (1 is very negative, 10 is very positive)
+
+Sometimes the article may not talk about a stock directly, but may give information that could have impacts on its price. Try to use as much info as possible to rate the sentiment 1-10.
+If there is not enough information in the article to rate the sentiment of a stock, answer "NONE" for that stock.
+
+Answer with JSON only, with one key per stock, in the form {"<stock>": <1-10 or "NONE">, ...}
+'''
+
+# JSON schema the structured sentiment mode constrains the model's reply to
+_SENTIMENT_FORMAT = {
+	'type': 'object',
+	'properties': {
+		'sentiment': {'enum': list(range(1, 11)) + ['NONE']}
+	},
+	'required': ['sentiment']
+}
+
 
 class LlamaChat:
 	'''
 	# LlamaChat
 	Used to access and talk to ollama LLM's in python
+
+	:param model: The ollama model to use, defaults to "llama3.3:70b"
+	:type model: str
+	:param sentiment_cache: Remembers the sentiment of articles that were already scored, defaults to no cache
+	:type sentiment_cache: SentimentCache
+	:param structured: Score news with a fixed system prompt and a reply constrained (by JSON schema)
+	to a number between 1-10 or "NONE", defaults to False
+	:type structured: bool
+	:param num_predict: The most tokens the model may generate in structured mode (enough for the whole JSON reply), defaults to 32
+	:type num_predict: int
+	:param keep_alive: How long ollama keeps the model loaded after a request (ex: "30m"), defaults to ollama's setting
+	:type keep_alive: str
 	'''
-	def __init__(self, model: str = 'llama3.3:70b'):
+	def __init__(
+		self,
+		model: str = 'llama3.3:70b',
+		sentiment_cache: SentimentCache = None,
+		structured: bool = False,
+		num_predict: int = 32,
+		keep_alive: str = None
+	):
+		self.sentiment_cache = sentiment_cache
+
+		self.structured = structured
+		self.num_predict = num_predict
+		self.keep_alive = keep_alive
+
+		# Created the first time `prompt_async` is used (see `prompt_async`)
+		self._async_client = None
+		self._async_loop = None
 
 		# Check to see if the requested model is downloaded
 		models = []
@@ -50,27 +122,79 @@ class LlamaChat:
 				elif choice.lower() == 'n':
 					raise errors.error('llm.py','User declined model download',)
 
-	def prompt(self, message: str):
+	def _chat_arguments(self, message: str, system: str = None, format: dict = None, options: dict = None):
+		'''
+		Creates the keyword arguments for `ollama.chat` (shared by `prompt` and `prompt_async`)
+		'''
+		messages = [{'role':'user','content':message}]
+
+		if system is not None:
+			messages.insert(0, {'role':'system','content':system})
+
+		arguments = {'model': self.model, 'messages': messages}
+
+		if format is not None:
+			arguments['format'] = format
+		if options is not None:
+			arguments['options'] = options
+		if self.keep_alive is not None:
+			arguments['keep_alive'] = self.keep_alive
+
+		return arguments
+
+	def prompt(self, message: str, system: str = None, format: dict = None, options: dict = None):
 		'''
 		Sends a prompt to the LLM and returns the response
 
-		if `create_LlamaPrompt` is set to True, a 
-		LlamaPrompt object will be returned as well
+		:param system: An optional system prompt sent before the message
+		:type system: str
+		:param format: An optional JSON schema the response must follow
+		:type format: dict
+		:param options: Optional ollama model options (ex: `num_predict`, `temperature`)
+		:type options: dict
 		'''
-		response = ollama.chat(
-			model=self.model, 
-			messages=[{'role':'user','content':message}]
-		)
+		response = ollama.chat(**self._chat_arguments(message, system, format, options))
 
 		# Return the message
 		return str(response['message']['content'])
 		
-	def news_prompt(self, site: NewsWebPage):
+	async def prompt_async(self, message: str, system: str = None, format: dict = None, options: dict = None):
 		'''
-		A custom prompt that returns the sentiment of a company's stock based on the news site
+		Sends a prompt to the LLM without blocking the event loop, and returns the response
+
+		Uses one `ollama.AsyncClient` per event loop, so many prompts can be waiting on ollama at once
 		'''
+		loop = asyncio.get_running_loop()
+
+		# An AsyncClient can only be used from the event loop it was created in
+		if self._async_loop is not loop:
+			self._async_client = ollama.AsyncClient()
+			self._async_loop = loop
+
+		response = await self._async_client.chat(**self._chat_arguments(message, system, format, options))
 
-		prompt = f'''
+		# Return the message
+		return str(response['message']['content'])
+
+	def _news_request(self, site: NewsWebPage):
+		'''
+		Returns the keyword arguments for `prompt`/`prompt_async` used to score a news site
+		'''
+		if not self.structured:
+			return {'message': self._news_message(site)}
+
+		return {
+			'message': f'Stock: {site.ticker}\n\nTitle: {site.title}\n\nBody: {site.content}',
+			'system': _SENTIMENT_SYSTEM_PROMPT,
+			'format': _SENTIMENT_FORMAT,
+			'options': {'num_predict': self.num_predict, 'temperature': 0}
+		}
+
+	def _news_message(self, site: NewsWebPage):
+		'''
+		Creates the prompt used by `news_prompt` for a news site
+		'''
+		return f'''
 			\rHere is a news article on {site.ticker} stock:
 			
 			\rTitle: {site.title}
@@ -87,13 +211,161 @@ class LlamaChat:
 
 			\rNow, follow these steps to derive the sentiment of {site.ticker} stock
 		'''
+
+	def _cached_sentiment(self, site: NewsWebPage):
+		'''
+		Returns a tuple of `(hit, sentiment)` from `sentiment_cache`
+
+		Raises a `ValueError` if the model previously returned "NONE" for this article
+		'''
+		# Check if this exact article was already scored for this ticker by this model
+		if self.sentiment_cache is None:
+			return False, None
+
+		hit, sentiment = self.sentiment_cache.get(self.model, site.ticker, site.title, site.content)
+
+		if hit and sentiment is None:
+			raise ValueError('Model previously returned "NONE" for this article')
+
+		return hit, sentiment
+
+	def _store_sentiment(self, site: NewsWebPage, value):
+		'''
+		Converts a sentiment value from the model into an int and stores it in `sentiment_cache`
+
+		Raises a `ValueError` if the value is not a number. Only an actual "NONE" answer is cached, anything else
+		(an empty, cut off or garbled reply) is not, so the article is scored again next time
+		'''
+		# Remember that the model could not score this article
+		if isinstance(value, str) and value.strip().strip('"').upper() == 'NONE':
+			if self.sentiment_cache is not None:
+				self.sentiment_cache.put(self.model, site.ticker, site.title, site.content, None)
+
+			raise ValueError('Model returned "NONE" for this article')
+
+		try:
+			sentiment = int(value)
+
+		except (ValueError, TypeError) as e:
+			raise ValueError(f'Could not convert "{value}" into a sentiment') from e
+
+		if self.sentiment_cache is not None:
+			self.sentiment_cache.put(self.model, site.ticker, site.title, site.content, sentiment)
+
+		return sentiment
+
+	def _parse_sentiment(self, site: NewsWebPage, reply: str):
+		'''
+		Converts the model's reply into a sentiment and stores it in `sentiment_cache`
+
+		Raises a `ValueError` if the reply is not a number
+		'''
+		# Structured replies look like {"sentiment": 7} or {"sentiment": "NONE"}
+		if self.structured:
+			try:
+				reply = json.loads(reply)['sentiment']
+
+			except (ValueError, KeyError, TypeError) as e:
+				# Usually a reply cut off by `num_predict`, which is not cached so the article is scored again later
+				raise ValueError(f'Could not parse structured reply "{reply}"') from e
+
+		return self._store_sentiment(site, reply)
+
+	def _multi_news_request(self, sites: list):
+		'''
+		Returns the keyword arguments for `prompt` used to score one article for several tickers
+		'''
+		tickers = [site.ticker for site in sites]
+
+		# Each ticker may have a differently trimmed copy of the article, use the longest one
+		site = max(sites, key=lambda site: len(site.content))
+
+		return {
+			'message': f'Stocks: {", ".join(tickers)}\n\nTitle: {site.title}\n\nBody: {site.content}',
+			'system': _MULTI_SENTIMENT_SYSTEM_PROMPT,
+			'format': {
+				'type': 'object',
+				'properties': {ticker: {'enum': list(range(1, 11)) + ['NONE']} for ticker in tickers},
+				'required': tickers
+			},
+			'options': {'num_predict': self.num_predict * len(tickers), 'temperature': 0}
+		}
+		
+	def news_prompt(self, site: NewsWebPage):
+		'''
+		A custom prompt that returns the sentiment of a company's stock based on the news site
+		'''
+		try:
+			hit, sentiment = self._cached_sentiment(site)
+
+			if not hit:
+				sentiment = self._parse_sentiment(site, self.prompt(**self._news_request(site)))
+		
+		except ValueError as e:
+			raise errors.error('llm.py', f'Could not obtain sentiment for news article on {site.ticker}', e)
+		except Exception as e:
+			raise errors.error('llm.py', f'Unknown error while obtaining sentiment on {site.ticker}', e)
 		
+		return sentiment
+
+	async def news_prompt_async(self, site: NewsWebPage):
+		'''
+		Same as `news_prompt`, but waits on ollama without blocking the event loop
+		'''
 		try:
-			sentiment = int(self.prompt(prompt))
+			hit, sentiment = self._cached_sentiment(site)
+
+			if not hit:
+				sentiment = self._parse_sentiment(site, await self.prompt_async(**self._news_request(site)))
 		
 		except ValueError as e:
 			raise errors.error('llm.py', f'Could not obtain sentiment for news article on {site.ticker}', e)
 		except Exception as e:
 			raise errors.error('llm.py', f'Unknown error while obtaining sentiment on {site.ticker}', e)
 		
-		return sentiment
\ No newline at end of file
+		return sentiment
+
+	def news_prompt_multi(self, sites: list):
+		'''
+		Returns the sentiment of several companies' stocks from one news article, using a single request
+
+		`sites` should all be the same article (one `NewsWebPage` per ticker). Returns a dict mapping each
+		ticker to its sentiment, or to "None" if the model returned "NONE" for that ticker
+		'''
+		scores = {}
+		uncached = []
+
+		# Only ask the model about tickers it has not already scored this article for
+		for site in sites:
+			try:
+				hit, sentiment = self._cached_sentiment(site)
+
+			except ValueError:
+				scores[site.ticker] = None
+				continue
+
+			if hit:
+				scores[site.ticker] = sentiment
+			else:
+				uncached.append(site)
+
+		if len(uncached) == 0:
+			return scores
+
+		try:
+			reply = json.loads(self.prompt(**self._multi_news_request(uncached)))
+
+		except ValueError as e:
+			raise errors.error('llm.py', f'Could not parse sentiments for news article on {", ".join(site.ticker for site in uncached)}', e)
+		except Exception as e:
+			raise errors.error('llm.py', f'Unknown error while obtaining sentiment on {", ".join(site.ticker for site in uncached)}', e)
+
+		# Split the reply back out to each ticker
+		for site in uncached:
+			try:
+				scores[site.ticker] = self._store_sentiment(site, reply.get(site.ticker) if isinstance(reply, dict) else None)
+
+			except ValueError:
+				scores[site.ticker] = None
+
+		return scores
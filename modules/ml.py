@@ -6,14 +6,21 @@ class StockNet(torch.nn.Module):
 	# StockNet
 
 	An LSTM neural network for predicting weather to buy/sell a stock
+
+	:param input_size: How many values are in each day of stock data, defaults to 31
+	:type input_size: int
+	:param hidden_size: The size of the LSTM's hidden state, defaults to 30
+	:type hidden_size: int
+	:param num_layers: How many LSTM layers are stacked, defaults to 1
+	:type num_layers: int
 	'''
-	def __init__(self):
+	def __init__(self, input_size: int = 31, hidden_size: int = 30, num_layers: int = 1):
 		super(StockNet, self).__init__()
 
-		self.lstm = torch.nn.LSTM(input_size=31, hidden_size=30, num_layers=1, batch_first=True)
+		self.lstm = torch.nn.LSTM(input_size=input_size, hidden_size=hidden_size, num_layers=num_layers, batch_first=True)
 		
 		self.linear = torch.nn.Linear(
-			30, # input dimensions
+			hidden_size, # input dimensions
 			1 # output dimension(s)
 		)
 
@@ -40,4 +47,65 @@ class StockNetDataset(torch.utils.data.Dataset):
 		return len(self.y)
 	
 	def __getitem__(self, index):
-		return self.x[index], self.y[index]
\ No newline at end of file
+		return self.x[index], self.y[index]
+
+
+# A Dataset() that creates windows on demand, instead of storing every window
+class StockNetWindowDataset(torch.utils.data.Dataset):
+	'''
+	# StockNetWindowDataset
+
+	Stores every company's scaled rows once, in one contiguous `[rows, features]` tensor, and returns
+	each window as a view of those rows. Use with `collate_windows` so a batch is gathered in one indexing operation
+
+	:param data: Every company's scaled rows, with each company's rows next to each other
+	:type data: torch.Tensor
+	:param starts: The first row of each window in `data` (windows should never cross from one company into the next)
+	:type starts: torch.Tensor
+	:param y: The output of each window, `[windows, 1]`
+	:type y: torch.Tensor
+	:param window_size: How many rows (days) are in each window
+	:type window_size: int
+	'''
+	def __init__(self, data: torch.Tensor, starts: torch.Tensor, y: torch.Tensor, window_size: int):
+		self.data = data
+		self.starts = starts.long()
+		self.y = y
+		self.window_size = window_size
+
+		# Row offsets within a window, used to gather a whole batch at once
+		self.offsets = torch.arange(window_size)
+
+	def __len__(self):
+		return len(self.y)
+
+	def __getitem__(self, index):
+		start = int(self.starts[index])
+		return self.data[start : start + self.window_size], self.y[index]
+
+	def to(self, device):
+		'''
+		Moves the dataset's tensors to `device`, returns the dataset
+		'''
+		self.data = self.data.to(device)
+		self.starts = self.starts.to(device)
+		self.y = self.y.to(device)
+		self.offsets = self.offsets.to(device)
+
+		return self
+
+	def __getitems__(self, indices):
+		'''
+		Returns a whole batch of windows as `([batch, window_size, features], [batch, 1])`
+		'''
+		indices = torch.as_tensor(indices, dtype=torch.long, device=self.starts.device)
+		rows = self.starts[indices][:, None] + self.offsets
+
+		return self.data[rows], self.y[indices]
+
+
+def collate_windows(batch):
+	'''
+	`collate_fn` for `StockNetWindowDataset`, the batch is already stacked by `__getitems__`
+	'''
+	return batch
@@ -0,0 +1,258 @@
+'''
+# pipeline
+
+Collects data for many tickers as four overlapping stages connected by bounded queues:
+
+1. One quoter pulls the market data for a chunk of tickers at a time
+2. Fetchers pull each ticker's news (`NewsWebPage` objects)
+3. Scorers send the news to ollama, several requests at a time
+4. One aggregator averages each ticker's sentiments and stores its data
+
+When a later stage falls behind, its queue fills up and the stages before it wait
+'''
+import asyncio
+from statistics import mean, StatisticsError
+
+from . import errors
+from .internet import YahooStockClient
+from .llm import LlamaChat
+from .logger import logger
+
+class _TickerJob:
+	'''
+	# _TickerJob
+
+	Tracks the data collected for a ticker while it moves through the pipeline
+	'''
+	def __init__(self, ticker: str, data, articles: int):
+		self.ticker = ticker # The ticker symbol
+
+		self.data = data # Market data from `YahooStockClient.current_batch`
+
+		self.remaining = articles # How many articles still need to be scored
+
+		self.sentiments = [] # Sentiment of every article that was scored
+
+class DownloadPipeline:
+	'''
+	# DownloadPipeline
+
+	Runs the fetch -> score -> store stages of `download.py` at the same time
+
+	:param yahoo_client: Used to pull market data and news
+	:type yahoo_client: YahooStockClient
+	:param llm: Used to score news articles
+	:type llm: LlamaChat
+	:param store: Called with each ticker's finished DataFrame, returns "True" if it was stored. Runs in a worker thread (so saving does not pause the other stages), but only ever from one thread at a time
+	:type store: function
+	:param logger: Where errors/progress are logged
+	:type logger: logger
+	:param set_date: The date the data is collected for
+	:type set_date: date
+	:param fetchers: How many tickers are fetched at once, defaults to 8
+	:type fetchers: int
+	:param scorers: How many ollama requests are sent at once, defaults to 2
+	:type scorers: int
+	:param queue_size: How many items can wait between two stages, defaults to 32
+	:type queue_size: int
+	:param quote_chunk: How many tickers' market data are pulled per request, defaults to 100
+	:type quote_chunk: int
+	'''
+	def __init__(
+		self,
+		yahoo_client: YahooStockClient,
+		llm: LlamaChat,
+		store,
+		logger: logger,
+		set_date,
+		fetchers: int = 8,
+		scorers: int = 2,
+		queue_size: int = 32,
+		quote_chunk: int = 100
+	):
+		self.yahoo_client = yahoo_client
+		self.llm = llm
+		self.store = store
+		self.logger = logger
+		self.set_date = set_date
+
+		self.fetchers = fetchers
+		self.scorers = scorers
+		self.queue_size = queue_size
+		self.quote_chunk = quote_chunk
+
+	async def _quote(self, tickers: list, quotes: asyncio.Queue, failed: list):
+		'''
+		Stage 1: pulls the market data for `quote_chunk` tickers at a time, then sends one "None" to every fetcher
+		'''
+		for start in range(0, len(tickers), self.quote_chunk):
+			chunk = tickers[start : start + self.quote_chunk]
+
+			# yfinance is blocking, so run it in a thread
+			try:
+				current_data, failures = await asyncio.to_thread(
+					self.yahoo_client.current_batch, chunk, self.set_date, self.quote_chunk, self.fetchers
+				)
+
+			except errors.error as e:
+				self.logger.error(e)
+				failures = {ticker: e for ticker in chunk}
+
+			else:
+				for e in failures.values():
+					self.logger.error(e)
+
+			for ticker in chunk:
+				if ticker in failures:
+					self.logger.warning(f'{ticker.upper()} - FAIL')
+					failed.append(ticker)
+					continue
+
+				# Waits here if the fetchers are behind
+				await quotes.put((ticker, current_data[current_data['ticker'] == ticker].reset_index(drop=True)))
+
+		for _ in range(self.fetchers):
+			await quotes.put(None)
+
+	async def _fetch(self, quotes: asyncio.Queue, articles: asyncio.Queue, finished: asyncio.Queue):
+		'''
+		Stage 2: pulls the news for tickers until it receives "None"
+		'''
+		while True:
+			item = await quotes.get()
+
+			if item is None:
+				return
+
+			ticker, current_data = item
+
+			# Collect news information
+			try:
+				scraped_sites = await asyncio.to_thread(self.yahoo_client.scrape_from_yf, ticker)
+
+			except errors.error as e:
+				# If there is no news data, set `scraped_sites` to an empty list
+				self.logger.error(e)
+				scraped_sites = []
+
+			job = _TickerJob(ticker, current_data, len(scraped_sites))
+
+			# Tickers without news skip straight to the aggregator
+			if len(scraped_sites) == 0:
+				await finished.put(job)
+
+			# Waits here if the scorers are behind
+			for site in scraped_sites:
+				await articles.put((job, site))
+
+	async def _score(self, articles: asyncio.Queue, finished: asyncio.Queue):
+		'''
+		Stage 3: scores articles until it receives "None"
+		'''
+		while True:
+			item = await articles.get()
+
+			if item is None:
+				return
+
+			job, site = item
+
+			# Obtain sentiment from article
+			try:
+				sentiment = await self.llm.news_prompt_async(site)
+
+			except errors.error as e:
+
+				# ValueError just means that there was no sentiment for the stock, so no need to log an error
+				if not isinstance(e.error, ValueError):
+					self.logger.error(e)
+
+				# If there was an error, set the sentiment value to "None"
+				sentiment = None
+
+			if type(sentiment) == int: # Sentiment obtained correctly
+				job.sentiments.append(sentiment)
+
+			# Once every article for the ticker is scored, pass it to the aggregator
+			job.remaining -= 1
+
+			if job.remaining == 0:
+				await finished.put(job)
+
+	async def _aggregate(self, finished: asyncio.Queue, total: int, completed: int, failed: list):
+		'''
+		Stage 4: averages sentiments and stores each ticker's data until it receives "None"
+		'''
+		while True:
+			job = await finished.get()
+
+			if job is None:
+				return completed
+
+			try:
+				# Average sentiments
+				avg_sentiment = mean(job.sentiments)
+
+			except StatisticsError:
+				self.logger.warning(f'Could not calculate average sentiment for {job.ticker}')
+				avg_sentiment = None
+
+			# Update sentiment to caluclated sentiment
+			job.data['sentiment'] = avg_sentiment
+
+			# Saving is blocking, so run it in a thread (the next ticker is only stored once this one is done)
+			if await asyncio.to_thread(self.store, job.data):
+				completed += 1
+				self.logger.warning(f'{job.ticker.upper()} - SUCCESS ({completed}/{total})')
+
+			else:
+				self.logger.warning(f'{job.ticker.upper()} - FAIL')
+				failed.append(job.ticker)
+
+	async def _run_once(self, tickers: list, total: int, completed: int):
+		'''
+		Runs every stage over `tickers` once, returns the new completed count and the tickers that failed
+		'''
+		quotes = asyncio.Queue(maxsize=self.queue_size)
+		articles = asyncio.Queue(maxsize=self.queue_size)
+		finished = asyncio.Queue(maxsize=self.queue_size)
+		failed = []
+
+		scorers = [asyncio.create_task(self._score(articles, finished)) for _ in range(self.scorers)]
+		aggregator = asyncio.create_task(self._aggregate(finished, total, completed, failed))
+
+		# Wait for every ticker to be quoted and fetched, then shut down each stage in order
+		await asyncio.gather(
+			self._quote(tickers, quotes, failed),
+			*[self._fetch(quotes, articles, finished) for _ in range(self.fetchers)]
+		)
+
+		for _ in scorers:
+			await articles.put(None)
+		await asyncio.gather(*scorers)
+
+		await finished.put(None)
+		completed = await aggregator
+
+		return completed, failed
+
+	async def run(self, tickers: list, completed: int = 0, retry_delay: float = 1800):
+		'''
+		Collects data for every ticker, retrying tickers that failed (all together) every `retry_delay` seconds
+
+		:param tickers: Tickers that still need data
+		:type tickers: list
+		:param completed: How many tickers were already completed before this run (used for logging), defaults to 0
+		:type completed: int
+		'''
+		total = completed + len(tickers)
+		pending = list(tickers)
+
+		while len(pending) != 0:
+			completed, pending = await self._run_once(pending, total, completed)
+
+			# Sleep for 30 minutes and try again
+			if len(pending) != 0:
+				await asyncio.sleep(retry_delay)
+
+		return completed
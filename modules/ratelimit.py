@@ -0,0 +1,56 @@
+'''
+# ratelimit
+
+Token bucket rate limiter that can be shared between threads, used to keep
+requests to Yahoo Finance under its rate limits
+'''
+import threading
+import time
+
+class TokenBucket:
+	'''
+	# TokenBucket
+
+	Allows up to `rate` requests per second on average, with bursts of up to `capacity` requests
+
+	:param rate: How many tokens are added to the bucket every second
+	:type rate: float
+	:param capacity: The most tokens the bucket can hold, defaults to `rate`
+	:type capacity: float
+	'''
+	def __init__(self, rate: float, capacity: float = None):
+		self.rate = rate
+		self.capacity = rate if capacity is None else capacity
+
+		# Start with a full bucket
+		self.tokens = self.capacity
+		self.updated = time.monotonic()
+
+		self.lock = threading.Lock()
+
+	def _refill(self):
+		'''
+		Adds the tokens earned since the last refill (must be called while holding `lock`)
+		'''
+		now = time.monotonic()
+
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def acquire(self, tokens: float = 1):
+		'''
+		Blocks until `tokens` tokens are available, then takes them from the bucket
+		'''
+		while True:
+			with self.lock:
+				self._refill()
+
+				if self.tokens >= tokens:
+					self.tokens -= tokens
+					return
+
+				# How long until enough tokens have been added
+				wait = (tokens - self.tokens) / self.rate
+
+			# Sleep without holding the lock, so other threads can check the bucket
+			time.sleep(wait)
@@ -0,0 +1,263 @@
+'''
+# sentiment
+
+A cheap, local (CPU only) sentiment classifier for news articles, and a
+cascade that only sends articles to the LLM when the local classifier is unsure
+'''
+import math
+import re
+import threading
+
+from .internet import NewsWebPage
+from . import errors
+
+# Finance specific word lists (based on the Loughran-McDonald sentiment dictionary)
+_POSITIVE_WORDS = {
+	'beat', 'beats', 'surpass', 'surpassed', 'exceed', 'exceeded', 'exceeds', 'outperform', 'outperformed',
+	'outperforms', 'upgrade', 'upgraded', 'upgrades', 'raise', 'raised', 'raises', 'gain', 'gains', 'gained',
+	'rally', 'rallied', 'rallies', 'surge', 'surged', 'surges', 'soar', 'soared', 'soars', 'jump', 'jumped',
+	'record', 'strong', 'stronger', 'strength', 'growth', 'grow', 'grew', 'profit', 'profitable', 'profits',
+	'improve', 'improved', 'improvement', 'improves', 'boost', 'boosted', 'bullish', 'buy', 'optimistic',
+	'optimism', 'momentum', 'upside', 'expand', 'expanded', 'expansion', 'success', 'successful', 'win',
+	'wins', 'won', 'approval', 'approved', 'breakthrough', 'dividend', 'buyback', 'rebound', 'rebounded',
+	'recover', 'recovered', 'recovery', 'robust', 'positive', 'favorable', 'lead', 'leading', 'innovative'
+}
+
+_NEGATIVE_WORDS = {
+	'miss', 'missed', 'misses', 'underperform', 'underperformed', 'downgrade', 'downgraded', 'downgrades',
+	'cut', 'cuts', 'lower', 'lowered', 'loss', 'losses', 'lose', 'lost', 'decline', 'declined', 'declines',
+	'drop', 'dropped', 'drops', 'fall', 'fell', 'falls', 'plunge', 'plunged', 'plunges', 'slump', 'slumped',
+	'tumble', 'tumbled', 'sink', 'sank', 'weak', 'weaker', 'weakness', 'bearish', 'sell', 'pessimistic',
+	'concern', 'concerns', 'worry', 'worries', 'risk', 'risks', 'lawsuit', 'litigation', 'investigation',
+	'probe', 'fined', 'penalty', 'recall', 'recalled', 'layoff', 'layoffs', 'bankruptcy', 'default',
+	'fraud', 'downturn', 'slowdown', 'warning', 'warns', 'warned', 'negative', 'adverse', 'volatile',
+	'volatility', 'uncertain', 'uncertainty', 'headwind', 'headwinds', 'disappoint', 'disappointed',
+	'disappointing', 'delay', 'delayed', 'shortfall', 'crisis', 'tariff', 'tariffs', 'selloff'
+}
+
+# Words that flip the meaning of the word after them (ex: "not strong")
+_NEGATIONS = {'not', 'no', 'never', 'without'}
+
+_WORD = re.compile(r"[a-z]+(?:'[a-z]+)?")
+
+# Default sentiment for each lexicon tier (1-10). Word counts push articles to the ends of the scale far more often
+# than the LLM does (it mostly answers between 3 and 8), so the tiers are compressed into that range, keeping the
+# "sentiment" feature distributed like the LLM's whichever tier scored an article. `LexiconClassifier.calibrate`
+# replaces these with the mean LLM score of each tier measured on a sample of articles
+_CALIBRATION = {tier: round(5.5 + (tier - 5.5) * 0.55, 2) for tier in range(1, 11)}
+
+class LexiconClassifier:
+	'''
+	# LexiconClassifier
+
+	Scores news articles by counting positive and negative finance words
+
+	The word counts place an article in a tier (1-10), and each tier's sentiment is calibrated to the LLM's scale
+	(see `calibrate`), so confident classifier scores are not more extreme than the LLM's for the same article
+
+	:param evidence: How many sentiment words are needed before the classifier is fairly confident, defaults to 8
+	:type evidence: float
+	:param title_weight: How many times more a word in the title counts than a word in the body, defaults to 3
+	:type title_weight: float
+	:param calibration: A dict of tier (1-10) -> sentiment, defaults to compressing the tiers into the range the LLM usually answers in
+	:type calibration: dict
+	'''
+	def __init__(self, evidence: float = 8, title_weight: float = 3, calibration: dict = None):
+		self.evidence = evidence
+		self.title_weight = title_weight
+		self.calibration = dict(_CALIBRATION if calibration is None else calibration)
+
+	def _count(self, text: str):
+		'''
+		Returns the number of positive and negative words in `text`
+		'''
+		positive, negative = 0, 0
+		previous = None
+
+		for word in _WORD.findall(text.lower()):
+			negated = previous in _NEGATIONS or (previous is not None and previous.endswith("n't"))
+
+			if word in _POSITIVE_WORDS:
+				if negated:
+					negative += 1
+				else:
+					positive += 1
+
+			elif word in _NEGATIVE_WORDS:
+				if negated:
+					positive += 1
+				else:
+					negative += 1
+
+			previous = word
+
+		return positive, negative
+
+	def _tier(self, site: NewsWebPage):
+		'''
+		Returns a tuple of `(tier, confidence)`, where tier is between 1-10 ("None" if the article had no
+		sentiment words at all) and confidence is between 0-1
+		'''
+		title_positive, title_negative = self._count(site.title or '')
+		body_positive, body_negative = self._count(site.content or '')
+
+		positive = title_positive * self.title_weight + body_positive
+		negative = title_negative * self.title_weight + body_negative
+		total = positive + negative
+
+		if total == 0:
+			return None, 0.0
+
+		# -1 (all negative) to 1 (all positive)
+		polarity = (positive - negative) / total
+
+		tier = min(10, max(1, round(5.5 + 4.5 * polarity)))
+
+		# Confident when the words mostly agree, and there are enough of them
+		confidence = abs(polarity) * (1 - math.exp(-total / self.evidence))
+
+		return tier, confidence
+
+	def score(self, site: NewsWebPage):
+		'''
+		Returns a tuple of `(sentiment, confidence)`, where sentiment is on the LLM's 1-10 scale (the calibrated
+		sentiment of the article's tier) and confidence is between 0-1. A confidence of 0 means the article had no
+		sentiment words at all
+		'''
+		tier, confidence = self._tier(site)
+
+		if tier is None:
+			return 5, 0.0
+
+		return self.calibration[tier], confidence
+
+	def calibrate(self, sites: list, scores: list):
+		'''
+		Sets each tier's sentiment to the mean LLM score of the articles in `sites` that fall in it, where `scores`
+		are the LLM's sentiments for `sites` (ex: a held-out sample scored with `LlamaChat.news_prompt`). Tiers
+		without any articles keep their current sentiment. Returns the new calibration dict
+		'''
+		if len(sites) != len(scores):
+			raise errors.error('sentiment.py', f'Got {len(scores)} scores for {len(sites)} articles')
+
+		scored = {}
+
+		for site, llm_score in zip(sites, scores):
+			tier, _ = self._tier(site)
+
+			if tier is not None and llm_score is not None:
+				scored.setdefault(tier, []).append(llm_score)
+
+		for tier, tier_scores in scored.items():
+			self.calibration[tier] = sum(tier_scores) / len(tier_scores)
+
+		return dict(self.calibration)
+
+class SentimentCascade:
+	'''
+	# SentimentCascade
+
+	Scores articles with a local classifier first, and only sends them to the LLM when the
+	classifier's confidence is below `min_confidence`. Can be used anywhere a `LlamaChat` is used to score news
+
+	:param llm: The `LlamaChat` used for articles the classifier is unsure about
+	:type llm: LlamaChat
+	:param classifier: The local classifier, defaults to `LexiconClassifier()`
+	:type classifier: LexiconClassifier
+	:param min_confidence: The lowest confidence (0-1) at which the classifier's sentiment is used, defaults to 0.6
+	:type min_confidence: float
+	'''
+	def __init__(self, llm, classifier: LexiconClassifier = None, min_confidence: float = 0.6):
+		self.llm = llm
+		self.classifier = LexiconClassifier() if classifier is None else classifier
+		self.min_confidence = min_confidence
+
+		# How many articles each tier resolved
+		self.resolved = {'classifier': 0, 'llm': 0}
+		self.lock = threading.Lock()
+
+	def _classify(self, site: NewsWebPage):
+		'''
+		Returns the classifier's sentiment if it is confident enough, otherwise "None"
+		'''
+		try:
+			sentiment, confidence = self.classifier.score(site)
+
+		except Exception as e:
+			raise errors.error('sentiment.py', f'Local classifier failed on {site.ticker}', e)
+
+		if confidence < self.min_confidence:
+			return None
+
+		with self.lock:
+			self.resolved['classifier'] += 1
+
+		return sentiment
+
+	def _escalated(self):
+		'''
+		Records that an article was sent to the LLM
+		'''
+		with self.lock:
+			self.resolved['llm'] += 1
+
+	def news_prompt(self, site: NewsWebPage):
+		'''
+		Returns the sentiment of a company's stock based on the news site (see `LlamaChat.news_prompt`)
+		'''
+		sentiment = self._classify(site)
+
+		if sentiment is not None:
+			return sentiment
+
+		self._escalated()
+		return self.llm.news_prompt(site)
+
+	async def news_prompt_async(self, site: NewsWebPage):
+		'''
+		Same as `news_prompt`, but waits on the LLM without blocking the event loop
+		'''
+		sentiment = self._classify(site)
+
+		if sentiment is not None:
+			return sentiment
+
+		self._escalated()
+		return await self.llm.news_prompt_async(site)
+
+	def news_prompt_multi(self, sites: list):
+		'''
+		Returns the sentiment of several companies' stocks from one news article (see `LlamaChat.news_prompt_multi`)
+
+		Only the tickers the classifier is unsure about are sent to the LLM, together in one request
+		'''
+		scores = {}
+		unsure = []
+
+		for site in sites:
+			sentiment = self._classify(site)
+
+			if sentiment is None:
+				unsure.append(site)
+			else:
+				scores[site.ticker] = sentiment
+
+		if len(unsure) != 0:
+			for _ in unsure:
+				self._escalated()
+
+			scores.update(self.llm.news_prompt_multi(unsure))
+
+		return scores
+
+	def report(self):
+		'''
+		Returns a dict with the fraction of articles each tier resolved (empty if nothing was scored)
+		'''
+		with self.lock:
+			total = sum(self.resolved.values())
+
+			if total == 0:
+				return {}
+
+			return {tier: count / total for tier, count in self.resolved.items()}
@@ -0,0 +1,211 @@
+'''
+# shards
+
+Sharded on-disk copy of the training windows, streamed from memory mapped
+files so training never needs the whole dataset (or all of its windows) in memory
+
+Each shard holds a contiguous run of windows: the scaled rows they cover, the
+start row of each window within those rows, and each window's output. Train and
+test windows are written to separate shard sets
+'''
+import json
+import os
+import pickle
+import shutil
+
+import numpy as np
+import torch
+
+from . import errors
+
+class ShardWriter:
+	'''
+	# ShardWriter
+
+	Writes windows into "train" and "test" shard sets under `path`, one chunk of rows at a time, so the whole
+	dataset never has to be in memory at once. Shards are written to a hidden temporary directory, which `close`
+	moves into place
+
+	:param path: Directory the shard sets are moved to by `close`
+	:type path: str
+	:param window_size: How many rows each window covers
+	:type window_size: int
+	:param windows_per_shard: The most windows stored in each shard, defaults to 65536
+	:type windows_per_shard: int
+	'''
+	def __init__(self, path: str, window_size: int, windows_per_shard: int = 65536):
+		self.path = path
+		self.window_size = window_size
+		self.windows_per_shard = windows_per_shard
+
+		self.temporary_path = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.tmp')
+		self.manifests = {name: {'window_size': window_size, 'shards': []} for name in ['train', 'test']}
+
+		try:
+			shutil.rmtree(self.temporary_path, ignore_errors=True)
+
+			for name in self.manifests:
+				os.makedirs(os.path.join(self.temporary_path, name))
+
+		except OSError as e:
+			raise errors.error('shards.py', f'Could not create shards for {path}', e)
+
+	def add(self, name: str, inp: np.ndarray, starts: np.ndarray, y: np.ndarray):
+		'''
+		Adds windows to the "train" or "test" shard set, in order
+
+		:param inp: Scaled rows, `[rows, features]` float32
+		:param starts: The first row in `inp` of every window
+		:param y: The output of every window, `[windows, 1]` float32
+		'''
+		directory = os.path.join(self.temporary_path, name)
+		manifest = self.manifests[name]
+
+		try:
+			for first in range(0, len(starts), self.windows_per_shard):
+				shard_starts = starts[first : first + self.windows_per_shard]
+
+				# Rows covered by this shard's windows (neighbouring shards may share up to `window_size - 1` rows)
+				low, high = int(shard_starts[0]), int(shard_starts[-1]) + self.window_size
+
+				prefix = f'shard-{len(manifest["shards"]):05d}'
+				np.save(os.path.join(directory, f'{prefix}-inp.npy'), np.ascontiguousarray(inp[low:high]))
+				np.save(os.path.join(directory, f'{prefix}-starts.npy'), shard_starts - low)
+				np.save(os.path.join(directory, f'{prefix}-y.npy'), np.ascontiguousarray(y[first : first + self.windows_per_shard]))
+
+				manifest['shards'].append({'prefix': prefix, 'windows': len(shard_starts)})
+
+		except OSError as e:
+			raise errors.error('shards.py', f'Could not write shards to {self.temporary_path}', e)
+
+	def close(self, scaler):
+		'''
+		Writes the index of each shard set and the scaler, then moves the shards to `path` (replacing any shards already there)
+		'''
+		try:
+			for name, manifest in self.manifests.items():
+				with open(os.path.join(self.temporary_path, name, 'index.json'), 'w') as f:
+					json.dump(manifest, f, indent=4)
+
+			with open(os.path.join(self.temporary_path, 'scaler'), 'wb') as f:
+				pickle.dump(scaler, f)
+
+			shutil.rmtree(self.path, ignore_errors=True)
+			os.replace(self.temporary_path, self.path)
+
+		except OSError as e:
+			raise errors.error('shards.py', f'Could not write shards to {self.path}', e)
+
+def write_shards(path: str, arrays: dict, scaler, window_size: int, windows_per_shard: int = 65536):
+	'''
+	Writes the arrays from `StockDataManager.training_arrays` into "train" and "test" shard sets under `path`
+
+	The shards are written to a hidden temporary directory first, then moved into place
+	'''
+	split_idx = int(arrays['split_idx'][0])
+
+	writer = ShardWriter(path, window_size, windows_per_shard)
+	writer.add('train', arrays['inp'], arrays['starts'][:split_idx], arrays['y'][:split_idx])
+	writer.add('test', arrays['inp'], arrays['starts'][split_idx:], arrays['y'][split_idx:])
+	writer.close(scaler)
+
+def load_scaler(path: str):
+	'''
+	Returns the scaler stored with the shards at `path`
+	'''
+	with open(os.path.join(path, 'scaler'), 'rb') as f:
+		return pickle.load(f)
+
+class ShardedWindowDataset(torch.utils.data.IterableDataset):
+	'''
+	# ShardedWindowDataset
+
+	Streams `(window, output)` pairs from a shard set written by `write_shards`. Only one shard is
+	memory mapped at a time (per DataLoader worker), so memory use does not grow with the dataset
+
+	When shuffling, the order of the shards is shuffled, then windows pass through a shuffle buffer of
+	`buffer_size` windows. Each DataLoader worker reads a different subset of the shards
+
+	:param path: Directory of the shard set (ex: "<shards>/train")
+	:type path: str
+	:param shuffle: Shuffle the windows, defaults to False
+	:type shuffle: bool
+	:param buffer_size: How many windows the shuffle buffer holds, defaults to 8192
+	:type buffer_size: int
+	:param seed: Seed of the shuffle, combined with the epoch (see `set_epoch`), defaults to 0
+	:type seed: int
+	'''
+	def __init__(self, path: str, shuffle: bool = False, buffer_size: int = 8192, seed: int = 0):
+		self.path = path
+		self.shuffle = shuffle
+		self.buffer_size = buffer_size
+		self.seed = seed
+		self.epoch = 0
+
+		try:
+			with open(os.path.join(path, 'index.json')) as f:
+				manifest = json.load(f)
+
+		except (OSError, ValueError) as e:
+			raise errors.error('shards.py', f'Could not read shard index in {path}', e)
+
+		self.window_size = manifest['window_size']
+		self.shards = manifest['shards']
+
+	def set_epoch(self, epoch: int):
+		'''
+		Changes the shuffle order, call before iterating over each epoch
+		'''
+		self.epoch = epoch
+
+	def __len__(self):
+		return sum(shard['windows'] for shard in self.shards)
+
+	def _windows(self, shard: dict, generator: np.random.Generator):
+		'''
+		Yields every window in `shard` from its memory mapped files
+		'''
+		inp = np.load(os.path.join(self.path, f'{shard["prefix"]}-inp.npy'), mmap_mode='r')
+		starts = np.load(os.path.join(self.path, f'{shard["prefix"]}-starts.npy'), mmap_mode='r')
+		y = np.load(os.path.join(self.path, f'{shard["prefix"]}-y.npy'), mmap_mode='r')
+
+		order = generator.permutation(len(starts)) if self.shuffle else range(len(starts))
+
+		for index in order:
+			start = int(starts[index])
+
+			# Copy the window out of the memory map, so the shard's pages can be dropped once it is read
+			yield torch.from_numpy(np.array(inp[start : start + self.window_size])), torch.from_numpy(np.array(y[index]))
+
+	def __iter__(self):
+		worker = torch.utils.data.get_worker_info()
+		worker_id, workers = (0, 1) if worker is None else (worker.id, worker.num_workers)
+
+		# Every worker shuffles the shards the same way, then takes its own share of them
+		generator = np.random.default_rng([self.seed, self.epoch])
+		shards = [self.shards[i] for i in generator.permutation(len(self.shards))] if self.shuffle else self.shards
+		shards = shards[worker_id::workers]
+
+		# Each worker shuffles windows with its own stream of random numbers
+		generator = np.random.default_rng([self.seed, self.epoch, worker_id])
+
+		if not self.shuffle:
+			for shard in shards:
+				yield from self._windows(shard, generator)
+			return
+
+		buffer = []
+
+		for shard in shards:
+			for item in self._windows(shard, generator):
+				if len(buffer) < self.buffer_size:
+					buffer.append(item)
+					continue
+
+				# Swap a random window out of the buffer
+				index = generator.integers(len(buffer))
+				buffer[index], item = item, buffer[index]
+				yield item
+
+		generator.shuffle(buffer)
+		yield from buffer
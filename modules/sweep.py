@@ -0,0 +1,234 @@
+'''
+# sweep
+
+Runs many `StockNet` training trials at once (a hyperparameter sweep), one
+process per trial, with each process pinned to its own CPU cores
+
+Every trial reads the same memory mapped training arrays from the on-disk
+cache, and trials that are clearly worse than the others are stopped early
+'''
+import itertools
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from statistics import median
+
+import pandas as pd
+import torch
+
+from . import ml
+from . import training
+from . import errors
+from .datamanager import StockDataManager
+
+# Hyperparameters a trial can change (anything else in a trial is ignored)
+HYPERPARAMETERS = ['BATCH_SIZE', 'LEARNING_RATE', 'LSTM_WINDOW_SIZE', 'HIDDEN_SIZE', 'NUM_LAYERS']
+
+def create_trials(space: dict, search: str = 'grid', trials: int = 20, seed: int = None):
+	'''
+	Returns a list of trials (dicts of hyperparameter -> value) from `space` (a dict of hyperparameter -> list of values)
+
+	:param search: "grid" (every combination) or "random" (`trials` random combinations, without repeats)
+	:type search: str
+	'''
+	unknown = [name for name in space if name not in HYPERPARAMETERS]
+	if len(unknown) != 0:
+		raise errors.error('sweep.py', f'Unknown hyperparameters in sweep space: {", ".join(unknown)}')
+
+	names = list(space)
+	grid = [dict(zip(names, values)) for values in itertools.product(*[space[name] for name in names])]
+
+	if search == 'grid':
+		return grid
+
+	if search == 'random':
+		return random.Random(seed).sample(grid, min(trials, len(grid)))
+
+	raise errors.error('sweep.py', f'Unknown search "{search}"')
+
+def _pin(cores):
+	'''
+	Process pool initializer: pins the worker process to one set of cores from the `cores` queue
+	'''
+	assigned = cores.get()
+
+	# Core pinning is only available on Linux
+	if hasattr(os, 'sched_setaffinity'):
+		os.sched_setaffinity(0, assigned)
+
+	torch.set_num_threads(len(assigned))
+
+	# Each worker only runs one trial at a time, so there is no need for inter-op threads
+	torch.set_num_interop_threads(1)
+
+def _should_prune(history, lock, window_size: int, epoch: int, loss: float, warmup: int, minimum_trials: int = 3):
+	'''
+	Records a trial's best loss at `epoch`, returns "True" if it is worse than the median of the other trials with the
+	same `window_size` at the same epoch (each window size is tested on different windows, so only their losses compare)
+	'''
+	with lock:
+		losses = history.get((window_size, epoch), [])
+		history[(window_size, epoch)] = losses + [loss]
+
+	if epoch < warmup or len(losses) < minimum_trials:
+		return False
+
+	return loss > median(losses)
+
+def run_trial(
+	trial: dict,
+	defaults: dict,
+	epochs: int,
+	patience: int,
+	warmup: int,
+	history,
+	lock,
+	backend: str,
+	compact: bool,
+	fingerprint: str,
+	cache_entries: int
+):
+	'''
+	Trains a new `StockNet` with the hyperparameters in `trial` (anything missing comes from `defaults`), returns a dict of results
+
+	`fingerprint` is the stock data's `StockDataManager.fingerprint`, computed once by `run_sweep`
+	'''
+	parameters = {name: trial.get(name, defaults[name]) for name in HYPERPARAMETERS}
+	start = time.perf_counter()
+
+	# Windows come from the (already built) memory mapped cache
+	arrays, _ = StockDataManager(backend, compact=compact).training_arrays(
+		parameters['LSTM_WINDOW_SIZE'],
+		cache=True,
+		cache_entries=cache_entries,
+		fingerprint=fingerprint
+	)
+
+	split_idx = int(arrays['split_idx'][0])
+	inp, starts, y = torch.from_numpy(arrays['inp']), torch.from_numpy(arrays['starts']), torch.from_numpy(arrays['y'])
+
+	train_batches = training.WindowBatches(
+		ml.StockNetWindowDataset(inp, starts[:split_idx], y[:split_idx], parameters['LSTM_WINDOW_SIZE']),
+		parameters['BATCH_SIZE'],
+		shuffle=True
+	)
+	test_batches = training.WindowBatches(
+		ml.StockNetWindowDataset(inp, starts[split_idx:], y[split_idx:], parameters['LSTM_WINDOW_SIZE']),
+		parameters['BATCH_SIZE']
+	)
+
+	model = ml.StockNet(input_size=inp.shape[1], hidden_size=parameters['HIDDEN_SIZE'], num_layers=parameters['NUM_LAYERS'])
+	optimizer = torch.optim.AdamW(model.parameters(), lr=parameters['LEARNING_RATE'])
+	loss_func = torch.nn.HuberLoss()
+	early_stopping = training.EarlyStopping(patience)
+
+	status = 'complete'
+
+	for epoch in range(epochs):
+		model.train()
+
+		for inputs, moves in train_batches:
+			optimizer.zero_grad()
+			loss_func(model(inputs), moves).backward()
+			optimizer.step()
+
+		model.eval()
+
+		with torch.no_grad():
+			vloss = 0
+			total = 0
+
+			for vinputs, vmoves in test_batches:
+				vloss += loss_func(model(vinputs), vmoves).item() * len(vinputs)
+				total += len(vinputs)
+
+		stop = early_stopping.step(vloss / total)
+
+		if _should_prune(history, lock, parameters['LSTM_WINDOW_SIZE'], epoch, early_stopping.best, warmup):
+			status = 'pruned'
+			break
+
+		if stop:
+			status = 'stopped early'
+			break
+
+	return {
+		**parameters,
+		'best_loss': early_stopping.best,
+		'epochs': epoch + 1,
+		'status': status,
+		'seconds': round(time.perf_counter() - start, 1)
+	}
+
+def run_sweep(
+	trials: list,
+	defaults: dict,
+	results_path: str,
+	epochs: int = 50,
+	patience: int = 10,
+	warmup: int = 5,
+	processes: int = 0,
+	backend: str = 'csv',
+	compact: bool = False
+):
+	'''
+	Runs every trial in a process pool, writing the results table to `results_path` (a CSV, sorted by best loss)
+	after each trial finishes. Returns the results table as a pandas DataFrame
+
+	:param processes: How many trials run at once (at most one per core, each gets an equal share of the cores), defaults to 0 (one per 2 cores)
+	:type processes: int
+	'''
+	cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+	processes = max(1, min(len(trials), len(cores), processes if processes > 0 else len(cores) // 2))
+
+	# Build the training arrays for every window size once, so the trials only ever read them from the cache
+	window_sizes = sorted({trial.get('LSTM_WINDOW_SIZE', defaults['LSTM_WINDOW_SIZE']) for trial in trials})
+	cache_entries = max(4, len(window_sizes))
+
+	stock_data_manager = StockDataManager(backend, compact=compact)
+	fingerprint = stock_data_manager.fingerprint()
+
+	for window_size in window_sizes:
+		stock_data_manager.training_arrays(window_size, cache=True, cache_entries=cache_entries, fingerprint=fingerprint)
+
+	# Spawn (instead of fork) so workers do not inherit torch's thread pools
+	context = multiprocessing.get_context('spawn')
+	manager = context.Manager()
+
+	# Hand the cores out round-robin, so every worker gets at least one and leftover cores are not wasted
+	core_sets = context.Queue()
+	for process in range(processes):
+		core_sets.put(cores[process::processes])
+
+	history = manager.dict()
+	lock = manager.Lock()
+
+	results = []
+	table = pd.DataFrame()
+
+	with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_pin, initargs=(core_sets,)) as executor:
+		futures = {
+			executor.submit(
+				run_trial, trial, defaults, epochs, patience, warmup, history, lock, backend, compact, fingerprint, cache_entries
+			): trial
+			for trial in trials
+		}
+
+		for future in as_completed(futures):
+			try:
+				result = future.result()
+
+			except Exception as e:
+				result = {**futures[future], 'best_loss': None, 'status': f'failed ({type(e).__name__}: {e})'}
+
+			results.append(result)
+			print(f'[{len(results)}/{len(trials)}] {result}')
+
+			table = pd.DataFrame(results).sort_values('best_loss', na_position='last')
+			table.to_csv(results_path, index=False)
+
+	manager.shutdown()
+
+	return table
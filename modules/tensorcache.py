@@ -0,0 +1,130 @@
+'''
+# tensorcache
+
+On-disk cache of the arrays `StockDataManager.train_test_split` creates, so
+training can skip reading, cleaning and scaling the stock data when nothing
+has changed since the last run
+
+Each entry is a directory named after a hash of everything the arrays depend
+on, holding one `.npy` file per array (loaded memory mapped) and the fitted scaler
+'''
+import hashlib
+import os
+import pickle
+import shutil
+
+import numpy as np
+
+from . import errors
+
+# Read files in 1MB chunks while hashing them
+_CHUNK_SIZE = 1 << 20
+
+def hash_files(paths: list):
+	'''
+	Returns a hash of the contents of every file in `paths` (in order). Files that do not exist are skipped
+	'''
+	digest = hashlib.sha256()
+
+	for path in paths:
+		if not os.path.exists(path):
+			continue
+
+		digest.update(path.encode())
+
+		with open(path, 'rb') as f:
+			while chunk := f.read(_CHUNK_SIZE):
+				digest.update(chunk)
+
+	return digest.hexdigest()
+
+class TensorCache:
+	'''
+	# TensorCache
+
+	Stores named numpy arrays and a scaler under a key
+
+	:param path: Directory that stores the cache entries, defaults to "stockdata/tensors"
+	:type path: str
+	:param max_entries: How many entries are kept, the least recently used are removed first, defaults to 4
+	:type max_entries: int
+	'''
+	def __init__(self, path: str = 'stockdata/tensors', max_entries: int = 4):
+		self.path = path
+		self.max_entries = max_entries
+
+	@staticmethod
+	def key(*parts):
+		'''
+		Returns the cache key of `parts` (anything with a stable `repr`)
+		'''
+		return hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+
+	def load(self, key: str):
+		'''
+		Returns a tuple of `(arrays, scaler)` for `key`, or "None" if it is not cached
+
+		Arrays are memory mapped copy-on-write, so they load instantly and are never written back to disk
+		'''
+		directory = os.path.join(self.path, key)
+
+		if not os.path.isdir(directory):
+			return None
+
+		try:
+			with open(os.path.join(directory, 'scaler'), 'rb') as f:
+				scaler = pickle.load(f)
+
+			arrays = {
+				file[:-len('.npy')]: np.load(os.path.join(directory, file), mmap_mode='c')
+				for file in os.listdir(directory) if file.endswith('.npy')
+			}
+
+		except (OSError, ValueError, pickle.UnpicklingError):
+			# A damaged entry is the same as a missing one
+			return None
+
+		# Mark the entry as recently used
+		os.utime(directory)
+
+		return arrays, scaler
+
+	def save(self, key: str, arrays: dict, scaler):
+		'''
+		Stores `arrays` (a dict of name -> numpy array) and `scaler` under `key`
+		'''
+		directory = os.path.join(self.path, key)
+
+		# Write to a hidden temporary directory first, so a half written entry is never loaded
+		temporary_directory = os.path.join(self.path, f'.{key}.tmp')
+
+		try:
+			shutil.rmtree(temporary_directory, ignore_errors=True)
+			os.makedirs(temporary_directory)
+
+			for name, array in arrays.items():
+				np.save(os.path.join(temporary_directory, f'{name}.npy'), np.ascontiguousarray(array))
+
+			with open(os.path.join(temporary_directory, 'scaler'), 'wb') as f:
+				pickle.dump(scaler, f)
+
+			shutil.rmtree(directory, ignore_errors=True)
+			os.replace(temporary_directory, directory)
+
+		except OSError as e:
+			raise errors.error('tensorcache.py', f'Could not save cache entry to {directory}', e)
+
+		self._evict()
+
+	def _evict(self):
+		'''
+		Removes the least recently used entries until at most `max_entries` are left
+		'''
+		entries = [
+			os.path.join(self.path, entry) for entry in os.listdir(self.path)
+			if not entry.startswith('.') and os.path.isdir(os.path.join(self.path, entry))
+		]
+		entries.sort(key=os.path.getmtime, reverse=True)
+
+		for entry in entries[self.max_entries:]:
+			shutil.rmtree(entry, ignore_errors=True)
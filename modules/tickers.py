@@ -7,6 +7,9 @@ from pandas import read_excel
 
 TICKERS = []
 
+# The full name of each company in "TICKERS" (ex: "APPLE INC")
+COMPANY_NAMES = {}
+
 # A list of tickers not allowed to be used
 banned_tickers = ['CASH_USD', '-', 'BRK.B', 'BRK.A', 'BF.B']
 
@@ -15,8 +18,9 @@ banned_tickers = ['CASH_USD', '-', 'BRK.B', 'BRK.A', 'BF.B']
 # Source: https://www.ssga.com/us/en/intermediary/etfs/funds/spdr-sp-500-etf-trust-spy
 
 url = 'https://www.ssga.com/us/en/intermediary/etfs/library-content/products/fund-data/etfs/us/holdings-daily-us-en-spy.xlsx'
-holdings = read_excel(url, engine='openpyxl', skiprows=4).dropna()['Ticker']
+holdings = read_excel(url, engine='openpyxl', skiprows=4).dropna()
 
-for ticker in holdings:
+for ticker, name in zip(holdings['Ticker'], holdings['Name']):
 	if ticker not in banned_tickers:
-		TICKERS.append(ticker)
\ No newline at end of file
+		TICKERS.append(ticker)
+		COMPANY_NAMES[ticker] = name
\ No newline at end of file
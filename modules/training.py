@@ -0,0 +1,229 @@
+'''
+# training
+
+Helpers for training `StockNet` quickly on CPU only machines
+'''
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from . import ml
+from . import errors
+
+def configure_threads(threads: int = 0, interop_threads: int = 0):
+	'''
+	Sets how many threads torch uses within an operation (`threads`) and between operations
+	(`interop_threads`). A value of 0 keeps torch's default
+
+	**NOTE:** Must be called before torch runs any parallel work, as the interop thread count can only be set once
+	'''
+	if threads > 0:
+		torch.set_num_threads(threads)
+
+	if interop_threads > 0:
+		torch.set_num_interop_threads(interop_threads)
+
+def compile_model(model: torch.nn.Module, example: torch.Tensor):
+	'''
+	Returns `model` compiled with `torch.compile`, or `model` itself if it can not be compiled
+
+	`torch.compile` only compiles (and fails) on the first forward and backward pass, so both are run on `example`
+	(a batch of inputs) to find out, and the gradients they leave behind are cleared. The compiled model shares its
+	parameters with `model`, so keep saving `model.state_dict()`
+	'''
+	try:
+		compiled = torch.compile(model)
+
+		compiled(example).sum().backward()
+		model.zero_grad(set_to_none=True)
+
+		return compiled
+
+	except Exception as e:
+		print(f'Could not compile StockNet, using it uncompiled ({type(e).__name__})')
+		return model
+
+class WindowBatches:
+	'''
+	# WindowBatches
+
+	Iterates over a `StockNetWindowDataset` in batches without a DataLoader: each pass shuffles with one
+	`torch.randperm` and gathers every batch straight from the dataset's tensors
+
+	:param dataset: The windows to iterate over (move it to the training device first, see `StockNetWindowDataset.to`)
+	:type dataset: StockNetWindowDataset
+	:param batch_size: How many windows are in each batch
+	:type batch_size: int
+	:param shuffle: Shuffle the windows on every pass, defaults to False
+	:type shuffle: bool
+	'''
+	def __init__(self, dataset: ml.StockNetWindowDataset, batch_size: int, shuffle: bool = False):
+		self.dataset = dataset
+		self.batch_size = batch_size
+		self.shuffle = shuffle
+
+	def __len__(self):
+		return (len(self.dataset) + self.batch_size - 1) // self.batch_size
+
+	def __iter__(self):
+		device = self.dataset.starts.device
+
+		if self.shuffle:
+			order = torch.randperm(len(self.dataset), device=device)
+		else:
+			order = torch.arange(len(self.dataset), device=device)
+
+		for first in range(0, len(order), self.batch_size):
+			yield self.dataset.__getitems__(order[first : first + self.batch_size])
+
+def evaluate(model: torch.nn.Module, dataloader, loss_func, device: str = 'cpu'):
+	'''
+	Returns the average loss of `model` over every window in `dataloader` ("nan" if it is empty)
+	'''
+	model.eval()
+
+	loss = 0
+	total = 0
+
+	with torch.no_grad():
+		for inputs, moves in iter(dataloader):
+			inputs, moves = inputs.to(device), moves.to(device)
+
+			loss += loss_func(model(inputs), moves).item() * len(inputs)
+			total += len(inputs)
+
+	return loss / total if total != 0 else float('nan')
+
+class EarlyStopping:
+	'''
+	# EarlyStopping
+
+	Tells training to stop once the validation loss has not improved for `patience` epochs in a row
+
+	:param patience: How many epochs without improvement are allowed, 0 never stops early
+	:type patience: int
+	:param min_delta: How much the loss must drop to count as an improvement, defaults to 0
+	:type min_delta: float
+	'''
+	def __init__(self, patience: int, min_delta: float = 0):
+		self.patience = patience
+		self.min_delta = min_delta
+
+		self.best = float('inf')
+		self.epochs_without_improvement = 0
+
+	def step(self, loss: float):
+		'''
+		Records an epoch's validation loss, returns "True" if training should stop
+		'''
+		if loss < self.best - self.min_delta:
+			self.best = loss
+			self.epochs_without_improvement = 0
+
+		else:
+			self.epochs_without_improvement += 1
+
+		return self.patience > 0 and self.epochs_without_improvement >= self.patience
+
+def create_scheduler(optimizer: torch.optim.Optimizer, kind: str, epochs: int, patience: int = 5, factor: float = 0.5):
+	'''
+	Returns a learning rate scheduler for `optimizer`, or "None"
+
+	:param kind: "plateau" (lower the learning rate by `factor` when the validation loss stops improving for
+	`patience` epochs), "cosine" (anneal the learning rate to 0 over `epochs` epochs) or "none"
+	:type kind: str
+
+	**NOTE:** "cosine" always anneals over the full `epochs`. When early stopping ends training long before that
+	(ex: `EPOCHS` is 1000 but training stops after 50), the learning rate has barely dropped, so either pass the number
+	of epochs training is expected to run for, or use "plateau", which follows the validation loss instead
+	'''
+	# Schedules start from the optimizer's current learning rate (an optimizer loaded from disk still has the
+	# "initial_lr" of the run that saved it, which schedulers would otherwise keep using)
+	for group in optimizer.param_groups:
+		group['initial_lr'] = group['lr']
+
+	if kind == 'plateau':
+		return torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='min', factor=factor, patience=patience)
+
+	if kind == 'cosine':
+		return torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=epochs)
+
+	if kind == 'none':
+		return None
+
+	raise errors.error('training.py', f'Unknown learning rate scheduler "{kind}"')
+
+def step_scheduler(scheduler, loss: float):
+	'''
+	Steps `scheduler` once at the end of an epoch (does nothing if it is "None")
+	'''
+	if scheduler is None:
+		return
+
+	if isinstance(scheduler, torch.optim.lr_scheduler.ReduceLROnPlateau):
+		scheduler.step(loss)
+	else:
+		scheduler.step()
+
+class AsyncCheckpointer:
+	'''
+	# AsyncCheckpointer
+
+	Saves checkpoints from a background thread, so training does not wait on the disk
+
+	State dicts are copied when `save` is called (so training can keep changing the weights), and
+	each file is written to a temporary file then renamed, so a crash never leaves a half written checkpoint
+	'''
+	def __init__(self):
+		self.executor = ThreadPoolExecutor(max_workers=1)
+		self.pending = None
+
+	@staticmethod
+	def _write(files: dict):
+		for path, state in files.items():
+			temporary_path = f'{path}.tmp'
+
+			torch.save(state, temporary_path)
+			os.replace(temporary_path, path)
+
+	def save(self, files: dict):
+		'''
+		Saves each state dict in `files` (a dict of path -> state dict) in the background
+
+		Only the newest checkpoint matters, so a checkpoint that has not started writing yet is skipped
+		'''
+		files = {path: _copy_state(state) for path, state in files.items()}
+
+		if self.pending is not None:
+			self.pending.cancel()
+
+		self.pending = self.executor.submit(self._write, files)
+
+	def close(self):
+		'''
+		Waits for the last checkpoint to finish writing, raising any error it had
+		'''
+		self.executor.shutdown(wait=True)
+
+		if self.pending is not None and not self.pending.cancelled():
+			try:
+				self.pending.result()
+
+			except Exception as e:
+				raise errors.error('training.py', 'Could not save checkpoint', e)
+
+def _copy_state(state):
+	'''
+	Returns a copy of a state dict (tensors are cloned onto the CPU)
+	'''
+	if isinstance(state, torch.Tensor):
+		return state.detach().to('cpu', copy=True)
+
+	if isinstance(state, dict):
+		return {key: _copy_state(value) for key, value in state.items()}
+
+	if isinstance(state, (list, tuple)):
+		return type(state)(_copy_state(value) for value in state)
+
+	return state
@@ -40,4 +40,31 @@ yf_values = [
 	('returnOnEquity', 'DOUBLE'),
 	('trailingPegRatio', 'DOUBLE'),
 	('sentiment', 'DOUBLE'),
-]
\ No newline at end of file
+]
+
+# Names of the numeric metrics (the features `StockNet` is trained on)
+numeric_values = [value for value, sql_type in yf_values if sql_type == 'DOUBLE']
+
+# Metrics that Yahoo's multi-symbol quote endpoint also returns, mapped to the name it uses for them.
+# Every other metric is only in a ticker's `info` (quoteSummary)
+quote_values = {
+	'previousClose': 'regularMarketPreviousClose',
+	'regularMarketPrice': 'regularMarketPrice',
+	'open': 'regularMarketOpen',
+	'dayLow': 'regularMarketDayLow',
+	'dayHigh': 'regularMarketDayHigh',
+	'trailingPE': 'trailingPE',
+	'forwardPE': 'forwardPE',
+	'volume': 'regularMarketVolume',
+	'averageVolume': 'averageDailyVolume3Month',
+	'averageVolume10days': 'averageDailyVolume10Day',
+	'marketCap': 'marketCap',
+	'fiftyTwoWeekLow': 'fiftyTwoWeekLow',
+	'fiftyTwoWeekHigh': 'fiftyTwoWeekHigh',
+	'fiftyDayAverage': 'fiftyDayAverage',
+	'twoHundredDayAverage': 'twoHundredDayAverage',
+	'bookValue': 'bookValue',
+	'priceToBook': 'priceToBook',
+	'epsTrailingTwelveMonths': 'epsTrailingTwelveMonths',
+	'epsForward': 'epsForward',
+}
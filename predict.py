@@ -0,0 +1,29 @@
+'''
+Ranks every ticker by `StockNet`'s expected return for the next trading day
+'''
+import modules.datamanager
+import modules.inference
+
+import json
+from datetime import date, timedelta
+
+# Load config
+with open('config.json') as f:
+	config = json.load(f)
+
+stock_data_manager = modules.datamanager.StockDataManager(config['TRAINING_BACKEND'], compact=config['COMPACT_STOCKDATA'])
+
+# Only load the days needed for each ticker's latest window (calendar days, so leave room for weekends/holidays),
+# missing values are filled from the last values known before them, like they are in training
+last_date = stock_data_manager.last_date()
+
+if last_date is None:
+	print('No stock data avaliable, run download.py first')
+	exit(1)
+
+stock_data_manager.start = date.fromisoformat(last_date) - timedelta(days=2 * config['LSTM_WINDOW_SIZE'] + 7)
+
+predictor = modules.inference.Predictor(config['LSTM_WINDOW_SIZE'], artifact_path=config['INFERENCE_ARTIFACT'])
+predictions = predictor.predict(stock_data_manager.stockdata, stock_data_manager.carried())
+
+print(predictions.to_string())
@@ -10,6 +10,8 @@ conda install openpyxl -y
 conda install pytz -y
 conda install scikit-learn -y
 conda install requests -y
+conda install pyarrow -y
+conda install lxml -y
 #conda install onnx -y
 conda install pip -y
 conda install tqdm -y
@@ -0,0 +1,32 @@
+'''
+Runs a hyperparameter sweep over `StockNet` (see `modules.sweep`), using every CPU core
+
+The hyperparameters to try are in the "SWEEP_SPACE" config value, and the results table is written to "SWEEP_RESULTS"
+'''
+import modules.sweep
+
+import json
+
+if __name__ == '__main__':
+	# Load config
+	with open('config.json') as f:
+		config = json.load(f)
+
+	trials = modules.sweep.create_trials(config['SWEEP_SPACE'], config['SWEEP_SEARCH'], config['SWEEP_TRIALS'])
+
+	print(f'Running {len(trials)} trials')
+
+	results = modules.sweep.run_sweep(
+		trials,
+		defaults={'HIDDEN_SIZE': 30, 'NUM_LAYERS': 1, **config},
+		results_path=config['SWEEP_RESULTS'],
+		epochs=config['SWEEP_EPOCHS'],
+		patience=config['EARLY_STOPPING_PATIENCE'],
+		warmup=config['SWEEP_PRUNE_WARMUP'],
+		processes=config['SWEEP_PROCESSES'],
+		backend=config['TRAINING_BACKEND'],
+		compact=config['COMPACT_STOCKDATA']
+	)
+
+	print('Best trial:')
+	print(results.iloc[0].to_string())
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Make `modules` importable when the tests are run from any directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
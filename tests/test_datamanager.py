@@ -0,0 +1,119 @@
+import pytest
+
+pd = pytest.importorskip('pandas')
+np = pytest.importorskip('numpy')
+preprocessing = pytest.importorskip('sklearn.preprocessing')
+pytest.importorskip('torch')
+
+from modules import datamanager
+from modules import valuations
+
+WINDOW_SIZE = 3
+
+def _stockdata():
+	'''
+	A few tickers with different lengths (one too short for a window), interleaved by date, with missing values
+	at the start, middle and end of each ticker
+	'''
+	rng = np.random.default_rng(0)
+	lengths = {'AAA': 12, 'BBB': 9, 'CCC': 3, 'DDD': 15}
+
+	rows = []
+	for day in range(max(lengths.values())):
+		for ticker, length in lengths.items():
+			if day < length:
+				rows.append({'date': f'2026-01-{day + 1:02d}', 'ticker': ticker})
+
+	stockdata = pd.DataFrame(rows)
+
+	for column in valuations.numeric_values:
+		values = rng.uniform(1, 100, len(stockdata))
+		values[rng.random(len(stockdata)) < 0.3] = np.nan
+		stockdata[column] = values
+
+	# Every ticker needs a price for its first row, so its expected return is defined
+	first = stockdata.groupby('ticker').cumcount() == 0
+	stockdata.loc[first, 'regularMarketPrice'] = rng.uniform(1, 100, first.sum())
+
+	return stockdata
+
+def _baseline(stockdata):
+	'''
+	Cleans and windows every ticker one at a time, the way `train_test_split` originally did
+	'''
+	stockdata = stockdata.drop(['date'], axis=1)
+
+	formatted = []
+	for ticker in stockdata['ticker'].unique():
+		df = stockdata.loc[stockdata['ticker'] == ticker].copy()
+
+		if len(df) <= WINDOW_SIZE:
+			continue
+
+		df['expectedReturn'] = (df['regularMarketPrice'].shift(-1) - df['regularMarketPrice']) / df['regularMarketPrice']
+
+		for col in df.columns:
+			if col in ['ticker', 'expectedReturn']:
+				continue
+
+			df[col] = df[col].interpolate(method='linear')
+			df[col] = df[col].ffill()
+			df[col] = df[col].fillna(0)
+
+		formatted.append(df.drop(df.tail(1).index))
+
+	X, y = [], []
+	for company_data in formatted:
+		inp = company_data.drop(['ticker', 'expectedReturn'], axis=1).astype('float32').reset_index(drop=True)
+		out = company_data['expectedReturn'].astype('float32').reset_index(drop=True)
+
+		for i in range(len(inp) - WINDOW_SIZE + 1):
+			X.append(inp.iloc[i : i + WINDOW_SIZE])
+			y.append([out.iloc[i + WINDOW_SIZE - 1]])
+
+	return formatted, X, np.array(y)
+
+def test_prepare_matches_per_ticker_cleaning():
+	stockdata = _stockdata()
+	formatted, _, _ = _baseline(stockdata)
+
+	prepared = datamanager.prepare(stockdata)
+
+	for expected in formatted:
+		ticker = expected['ticker'].iloc[0]
+		rows = prepared.loc[prepared['ticker'] == ticker].iloc[:-1]
+
+		np.testing.assert_allclose(
+			rows[valuations.numeric_values].to_numpy(dtype=np.float64),
+			expected[valuations.numeric_values].to_numpy(dtype=np.float64),
+			rtol=1e-6
+		)
+		np.testing.assert_allclose(rows['expectedReturn'].to_numpy(), expected['expectedReturn'].to_numpy(), rtol=1e-12)
+
+def test_weighted_scaler_matches_stacked_windows():
+	stockdata = _stockdata()
+	_, X, y = _baseline(stockdata)
+
+	manager = datamanager.StockDataManager()
+	manager.stockdata = stockdata
+
+	arrays, scaler = manager.training_arrays(WINDOW_SIZE, split_size=0.6)
+	split_idx = int(arrays['split_idx'][0])
+
+	# Same windows, in the same order, with the same targets
+	assert len(arrays['starts']) == len(X)
+	assert split_idx == int(len(X) * 0.6)
+	np.testing.assert_array_equal(arrays['y'], y.astype(np.float32))
+
+	expected = preprocessing.StandardScaler().fit(pd.concat(X[:split_idx], ignore_index=True).to_numpy())
+
+	np.testing.assert_allclose(scaler.mean_, expected.mean_, rtol=1e-9)
+	np.testing.assert_allclose(scaler.scale_, expected.scale_, rtol=1e-9)
+
+	for start, window in zip(arrays['starts'], X):
+		np.testing.assert_allclose(
+			arrays['inp'][start : start + WINDOW_SIZE],
+			expected.transform(window.to_numpy()),
+			rtol=1e-4,
+			atol=1e-5
+		)
@@ -0,0 +1,33 @@
+import pytest
+
+pytest.importorskip('lxml')
+
+from modules import extract
+
+ARTICLE = 'Shares of Apple rose after the company reported record quarterly revenue.'
+
+@pytest.mark.parametrize('name', ['commentary-body', 'story-body', 'article-body'])
+def test_article_containers_are_kept(name):
+	html = f'<html><body><div class="{name}"><p>{ARTICLE}</p></div></body></html>'
+
+	assert extract.extract_article(html) == ARTICLE
+
+@pytest.mark.parametrize('name', ['comments', 'comment-section', 'user_comments'])
+def test_comment_sections_are_removed(name):
+	html = (
+		f'<html><body><div class="story-body"><p>{ARTICLE}</p></div>'
+		f'<div class="{name}"><p>First! This stock is going to the moon, buy now everyone.</p></div></body></html>'
+	)
+
+	assert extract.extract_article(html) == ARTICLE
+
+def test_tickers_are_matched_with_their_case():
+	text = 'The market is on fire today.\nOn Semiconductor rose.\nShares of ON jumped after earnings.'
+
+	# Only room for one paragraph: the one that mentions the ticker itself
+	assert extract.fit_budget(text, ['ON'], 40) == 'Shares of ON jumped after earnings.'
+
+def test_company_names_ignore_case():
+	text = 'The market is on fire today.\nOn Semiconductor rose.'
+
+	assert extract.fit_budget(text, ['ON'], 25, [extract.name_keywords('ON SEMICONDUCTOR CORP')]) == 'On Semiconductor rose.'
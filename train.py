@@ -1,8 +1,11 @@
 import modules.ml
 import modules.datamanager
+import modules.training
+import modules.errors
 
 import torch
 import json
+import time
 from tqdm import tqdm
 
 # Load config
@@ -18,6 +21,9 @@ device = (
 
 print(f'BACKEND: {device}')
 
+# Set how many CPU threads torch uses (before any parallel work is done)
+modules.training.configure_threads(config['NUM_THREADS'], config['INTEROP_THREADS'])
+
 # Initialize our model
 try:
 	# Try and load a previous version
@@ -36,24 +42,66 @@ except:
 	print('No StockNet optimizer avaliable to load, skipping...')
 	optimizer = torch.optim.AdamW(model.parameters(), lr=config['LEARNING_RATE']) # Used to update the weights of the model
 
+# Lower the learning rate as training goes on (starting again from the configured learning rate each run)
+if config['LR_SCHEDULER'] != 'none':
+	for group in optimizer.param_groups:
+		group['lr'] = config['LEARNING_RATE']
+
+scheduler = modules.training.create_scheduler(optimizer, config['LR_SCHEDULER'], config['EPOCHS'], config['LR_PATIENCE'], config['LR_FACTOR'])
+
+# Stop once the validation loss stops improving
+early_stopping = modules.training.EarlyStopping(config['EARLY_STOPPING_PATIENCE'])
+
+# Save checkpoints without pausing training
+checkpointer = modules.training.AsyncCheckpointer()
+
 # Initialize our loss function
 loss_func = torch.nn.HuberLoss()
 
 # Load training data
-stock_data_manager = modules.datamanager.StockDataManager()
-
-# Create training and testing dataloaders
-train_dataloader, test_dataloader = stock_data_manager.train_test_split(config['LSTM_WINDOW_SIZE'], config['BATCH_SIZE'])
+stock_data_manager = modules.datamanager.StockDataManager(config['TRAINING_BACKEND'], compact=config['COMPACT_STOCKDATA'])
+
+# Create training and testing dataloaders (streamed from shards on disk, so memory use does not grow with the dataset)
+if config['STREAMING_TRAINING']:
+	train_dataloader, test_dataloader = stock_data_manager.streaming_split(
+		config['LSTM_WINDOW_SIZE'],
+		config['BATCH_SIZE'],
+		windows_per_shard=config['SHARD_WINDOWS'],
+		buffer_size=config['SHUFFLE_BUFFER'],
+		workers=config['DATALOADER_WORKERS'],
+		rows_per_read=config['SHARD_READ_ROWS']
+	)
+else:
+	train_dataloader, test_dataloader = stock_data_manager.train_test_split(config['LSTM_WINDOW_SIZE'], config['BATCH_SIZE'], cache=config['TRAINING_CACHE'])
+
+# Fast mode keeps every window on the device and slices batches out of it, skipping the DataLoader
+if config['FAST_TRAINING'] and isinstance(train_dataloader.dataset, modules.ml.StockNetWindowDataset):
+	train_dataloader = modules.training.WindowBatches(train_dataloader.dataset.to(device), config['BATCH_SIZE'], shuffle=True)
+	test_dataloader = modules.training.WindowBatches(test_dataloader.dataset.to(device), config['BATCH_SIZE'])
+
+# The model used for forward passes (the compiled model shares its weights with `model`, which is what gets saved)
+forward = modules.training.compile_model(model, next(iter(train_dataloader))[0].to(device)) if config['COMPILE_MODEL'] else model
 
 # Create variables for some config values
 best_training_loss = config['BEST_TRAINING_LOSS']
 
+# Only set once a checkpoint is saved, so `LAST_TRAINED_DATE` never covers data the saved model was not trained on
+checkpoint_saved = False
+
 # Main logic to train the neural network
 try:
 	for epoch in tqdm(range(config['EPOCHS']), desc='Training Progress', unit='Epochs'):
 		# Make sure gradient tracking is on
 		model.train()
 
+		# Streamed datasets shuffle differently each epoch
+		if hasattr(train_dataloader.dataset, 'set_epoch'):
+			train_dataloader.dataset.set_epoch(epoch)
+
+		# Track training throughput
+		epoch_start = time.perf_counter()
+		samples = 0
+
 		# Do a pass over the data
 		for inputs, moves in iter(train_dataloader):
 
@@ -64,7 +112,7 @@ try:
 			optimizer.zero_grad()
 
 			# Make predictions for this batch
-			outputs = model(inputs)
+			outputs = forward(inputs)
 
 			# Compute the loss and its gradients
 			loss = loss_func(outputs, moves)
@@ -73,6 +121,10 @@ try:
 			# Adjust learning weights
 			optimizer.step()
 
+			samples += len(inputs)
+
+		tqdm.write(f'EPOCH {epoch} * {samples / (time.perf_counter() - epoch_start):.0f} samples/sec')
+
 		# Set the model to evaluation mode, disabling dropout and using population
 		# statistics for batch normalization.
 		model.eval()
@@ -88,7 +140,7 @@ try:
 				vinputs, vmoves = vinputs.to(device), vmoves.to(device)
 
 				# Get outputs
-				voutputs = model(vinputs)
+				voutputs = forward(vinputs)
 
 				# Compute loss based on the current batch (more accurate)
 				batch_loss = loss_func(voutputs, vmoves).item()
@@ -102,24 +154,40 @@ try:
 			if avg_loss < best_training_loss:
 				best_training_loss = avg_loss
 
-				# Save the model's state if its loss execeeds the lowest recorded loss in config
-				torch.save(model.state_dict(), f'StockNet/model')
+				# Save the model's state (and the optimizer's state as well) if its loss execeeds the lowest recorded loss in config
+				checkpointer.save({'StockNet/model': model.state_dict(), 'StockNet/optimizer': optimizer.state_dict()})
+				checkpoint_saved = True
+
+		# Adjust the learning rate, and stop if the validation loss has not improved in a while
+		modules.training.step_scheduler(scheduler, avg_loss)
 
-				# Save the optimizer's state as well
-				torch.save(optimizer.state_dict(), 'StockNet/optimizer')
+		if early_stopping.step(avg_loss):
+			tqdm.write(f'Stopping early, validation loss has not improved in {early_stopping.patience} epochs')
+			break
 
 		#print(f'EPOCH [{epoch}/{config['EPOCHS']}] * Avg. Loss: {"{:.2f}".format(avg_loss)} * Best Loss: {"{:.2f}".format(best_training_loss)}\t')
 except KeyboardInterrupt:
 	pass
 finally:
+	# Wait for the last checkpoint to be written (the config is still saved if it could not be)
+	try:
+		checkpointer.close()
+
+	except modules.errors.error as e:
+		print(f'Error while saving checkpoint - {e}')
+		checkpoint_saved = False
+
 	# Print improvement
 	print(f'Improvement: {round(config['BEST_TRAINING_LOSS'] - best_training_loss, 3)} (Start: {round(config['BEST_TRAINING_LOSS'],3)})')
 	
 	# Save data to config file
 	with open('config.json','w') as f:
-		# Save best training loss to config file
+		# Save best training loss (and the newest date trained on, used by finetune.py) to config file
 		try:
 			config['BEST_TRAINING_LOSS'] = best_training_loss
+
+			if checkpoint_saved:
+				config['LAST_TRAINED_DATE'] = stock_data_manager.last_date()
 		except Exception as e:
 			print('Error while saving data - ', str(type(e)))
 
@@ -0,0 +1,235 @@
+'''
+Trains `StockNet` with one process per group of CPU cores, using `torch.distributed` (gloo) and DDP
+
+Launch with torchrun on one machine, for example:
+
+	torchrun --standalone --nproc_per_node=8 train_distributed.py
+
+Each process trains on its own share of the training windows and gradients are averaged between processes
+after every batch, so every process holds the same model. The batch size in config is per process
+'''
+import modules.ml
+import modules.datamanager
+import modules.training
+import modules.errors
+
+import os
+import pickle
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+import json
+import time
+from tqdm import tqdm
+
+# Join the other processes started by torchrun
+dist.init_process_group(backend='gloo')
+
+rank = dist.get_rank()
+world_size = dist.get_world_size()
+
+# Load config
+with open('config.json') as f:
+	config = json.load(f)
+
+# Split the CPU cores between processes, so they do not fight over the same cores
+modules.training.configure_threads(
+	config['NUM_THREADS'] if config['NUM_THREADS'] > 0 else max(1, os.cpu_count() // world_size),
+	config['INTEROP_THREADS']
+)
+
+if rank == 0:
+	print(f'BACKEND: cpu * {world_size} processes * {torch.get_num_threads()} threads each')
+
+# Initialize our model
+model = modules.ml.StockNet()
+
+try:
+	# Try and load a previous version
+	model.load_state_dict(torch.load('StockNet/model',weights_only=True))
+except:
+	if rank == 0:
+		print('No StockNet model avaliable to load, skipping...')
+
+# Wrap the model so gradients are all-reduced between processes during `backward()` (this also copies rank 0's weights to every process)
+ddp_model = DistributedDataParallel(model)
+
+# Initialize our optimizer
+optimizer = torch.optim.AdamW(ddp_model.parameters(), lr=config['LEARNING_RATE'])
+
+try:
+	# Try and load a previous version
+	optimizer.load_state_dict(torch.load('StockNet/optimizer',weights_only=True))
+except:
+	if rank == 0:
+		print('No StockNet optimizer avaliable to load, skipping...')
+
+# Lower the learning rate as training goes on (starting again from the configured learning rate each run)
+if config['LR_SCHEDULER'] != 'none':
+	for group in optimizer.param_groups:
+		group['lr'] = config['LEARNING_RATE']
+
+scheduler = modules.training.create_scheduler(optimizer, config['LR_SCHEDULER'], config['EPOCHS'], config['LR_PATIENCE'], config['LR_FACTOR'])
+
+# Stop once the validation loss stops improving (every process sees the same loss, so they all stop together)
+early_stopping = modules.training.EarlyStopping(config['EARLY_STOPPING_PATIENCE'])
+
+# Save checkpoints without pausing training
+checkpointer = modules.training.AsyncCheckpointer()
+
+# Initialize our loss function
+loss_func = torch.nn.HuberLoss()
+
+# Load training data. Rank 0 prepares it first and caches it (and saves the scaler for inference), then every
+# other process memory maps the same arrays from the cache without writing anything
+stock_data_manager = modules.datamanager.StockDataManager(config['TRAINING_BACKEND'], compact=config['COMPACT_STOCKDATA'])
+
+if rank == 0:
+	arrays, scaler = stock_data_manager.training_arrays(config['LSTM_WINDOW_SIZE'], cache=True)
+
+	with open('StockNet/scaler', 'wb') as f:
+		pickle.dump(scaler, f)
+
+dist.barrier()
+
+if rank != 0:
+	arrays, _ = stock_data_manager.training_arrays(config['LSTM_WINDOW_SIZE'], cache=True)
+
+split_idx = int(arrays['split_idx'][0])
+inp, starts, y = torch.from_numpy(arrays['inp']), torch.from_numpy(arrays['starts']), torch.from_numpy(arrays['y'])
+
+train_dataset = modules.ml.StockNetWindowDataset(inp, starts[:split_idx], y[:split_idx], config['LSTM_WINDOW_SIZE'])
+test_dataset = modules.ml.StockNetWindowDataset(inp, starts[split_idx:], y[split_idx:], config['LSTM_WINDOW_SIZE'])
+
+# Each process gets a different share of the training windows, reshuffled every epoch
+train_sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank, shuffle=True)
+
+train_dataloader = DataLoader(
+	train_dataset,
+	batch_size=config['BATCH_SIZE'],
+	sampler=train_sampler,
+	collate_fn=modules.ml.collate_windows
+)
+
+# Each process validates on every `world_size`-th window (without padding, so every window is counted once)
+test_dataloader = DataLoader(
+	modules.ml.StockNetWindowDataset(
+		test_dataset.data,
+		test_dataset.starts[rank::world_size],
+		test_dataset.y[rank::world_size],
+		config['LSTM_WINDOW_SIZE']
+	),
+	batch_size=config['BATCH_SIZE'],
+	shuffle=False,
+	collate_fn=modules.ml.collate_windows
+)
+
+# Create variables for some config values
+best_training_loss = config['BEST_TRAINING_LOSS']
+
+# Only set once a checkpoint is saved, so `LAST_TRAINED_DATE` never covers data the saved model was not trained on
+checkpoint_saved = False
+
+# Main logic to train the neural network
+try:
+	for epoch in tqdm(range(config['EPOCHS']), desc='Training Progress', unit='Epochs', disable=rank != 0):
+		# Make sure gradient tracking is on
+		ddp_model.train()
+
+		# Shuffle differently each epoch
+		train_sampler.set_epoch(epoch)
+
+		# Track training throughput
+		epoch_start = time.perf_counter()
+		samples = 0
+
+		# Do a pass over this process's share of the data
+		for inputs, moves in iter(train_dataloader):
+
+			# Zero your gradients for every batch!
+			optimizer.zero_grad()
+
+			# Make predictions for this batch
+			outputs = ddp_model(inputs)
+
+			# Compute the loss and its gradients (averaged between every process)
+			loss = loss_func(outputs, moves)
+			loss.backward()
+
+			# Adjust learning weights
+			optimizer.step()
+
+			samples += len(inputs)
+
+		# Set the model to evaluation mode
+		ddp_model.eval()
+
+		# Disable gradient computation and reduce memory consumption.
+		with torch.no_grad():
+			vloss = 0
+			total = 0
+
+			for vinputs, vmoves in iter(test_dataloader):
+
+				# Get outputs (no need to sync anything during validation, so skip the DDP wrapper)
+				voutputs = model(vinputs)
+
+				# Compute loss based on the current batch (more accurate)
+				batch_loss = loss_func(voutputs, vmoves).item()
+				vloss += batch_loss * len(vinputs)
+				total += len(vinputs)
+
+			# Add up the loss, number of windows, and training samples of every process
+			totals = torch.tensor([vloss, total, samples], dtype=torch.float64)
+			dist.all_reduce(totals, op=dist.ReduceOp.SUM)
+
+			# Average validation loss over every window ("NaN" if there are no test windows, which never counts as an improvement)
+			avg_loss = totals[0].item() / totals[1].item() if totals[1].item() != 0 else float('nan')
+
+			if rank == 0:
+				tqdm.write(f'EPOCH {epoch} * {totals[2].item() / (time.perf_counter() - epoch_start):.0f} samples/sec * Avg. Loss: {avg_loss:.4f}')
+
+			# Track best performance (every process sees the same loss, so they all agree)
+			if avg_loss < best_training_loss:
+				best_training_loss = avg_loss
+
+				# Only rank 0 saves, as every process holds the same weights
+				if rank == 0:
+					checkpointer.save({'StockNet/model': model.state_dict(), 'StockNet/optimizer': optimizer.state_dict()})
+					checkpoint_saved = True
+
+		# Adjust the learning rate, and stop if the validation loss has not improved in a while
+		modules.training.step_scheduler(scheduler, avg_loss)
+
+		if early_stopping.step(avg_loss):
+			if rank == 0:
+				tqdm.write(f'Stopping early, validation loss has not improved in {early_stopping.patience} epochs')
+			break
+
+except KeyboardInterrupt:
+	pass
+finally:
+	# Wait for the last checkpoint to be written (the config is still saved if it could not be)
+	try:
+		checkpointer.close()
+
+	except modules.errors.error as e:
+		print(f'Error while saving checkpoint - {e}')
+		checkpoint_saved = False
+
+	if rank == 0:
+		# Print improvement
+		print(f'Improvement: {round(config["BEST_TRAINING_LOSS"] - best_training_loss, 3)} (Start: {round(config["BEST_TRAINING_LOSS"],3)})')
+
+		# Save best training loss (and the newest date trained on, used by finetune.py) to config file
+		config['BEST_TRAINING_LOSS'] = best_training_loss
+
+		if checkpoint_saved:
+			config['LAST_TRAINED_DATE'] = stock_data_manager.last_date()
+
+		with open('config.json','w') as f:
+			json.dump(config, f, indent = 4)
+
+	dist.destroy_process_group()